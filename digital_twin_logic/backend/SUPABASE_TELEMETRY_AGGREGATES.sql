@@ -0,0 +1,30 @@
+-- ========================================
+-- AGRÉGATION DES ÉCHANTILLONS ENTRE DEUX SAUVEGARDES
+-- Colonnes utilisées quand TELEMETRY_SAVE_AGGREGATE=true
+-- ========================================
+
+-- Exécuter ce script dans l'éditeur SQL de Supabase
+
+-- 1. Nombre de messages MQTT résumés dans la ligne
+ALTER TABLE telemetry 
+ADD COLUMN IF NOT EXISTS sample_count INTEGER;
+
+-- 2. Détail min/max/moyenne par PID: {"rpm": {"min": 800, "max": 2400, "mean": 1350.5, "count": 12}, ...}
+ALTER TABLE telemetry 
+ADD COLUMN IF NOT EXISTS aggregates JSONB;
+
+-- ========================================
+-- NOTES IMPORTANTES
+-- ========================================
+-- 
+-- 1. Les deux colonnes sont NULLABLE: les lignes existantes (et celles écrites
+--    sans agrégation) restent valides
+-- 
+-- 2. Quand l'agrégation est active, les colonnes PID analogiques (rpm,
+--    vehicle_speed, engine_load, ...) contiennent la MOYENNE de l'intervalle;
+--    les compteurs, statuts et bitmasks gardent la dernière valeur reçue
+-- 
+-- 3. Configuration côté backend (.env):
+--    TELEMETRY_SAVE_INTERVAL=5        # secondes entre deux lignes, par véhicule
+--    TELEMETRY_SAVE_AGGREGATE=true
+--
@@ -0,0 +1,31 @@
+-- ========================================
+-- CLÉ D'IDEMPOTENCE DES LIGNES TÉLÉMÉTRIE
+-- Requise quand TELEMETRY_WAL_ENABLED=true (journal local rejoué vers la BDD)
+-- ========================================
+
+-- Exécuter ce script dans l'éditeur SQL de Supabase
+
+-- 1. Identifiant unique attribué à chaque ligne avant son écriture dans le journal
+ALTER TABLE telemetry 
+ADD COLUMN IF NOT EXISTS ingest_key TEXT;
+
+-- 2. Index unique: cible du upsert "on_conflict=ingest_key" (doublons ignorés)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_telemetry_ingest_key 
+ON telemetry(ingest_key);
+
+-- ========================================
+-- NOTES IMPORTANTES
+-- ========================================
+-- 
+-- 1. La colonne est NULLABLE: les lignes existantes et celles écrites sans
+--    journal (TELEMETRY_WAL_ENABLED=false) gardent ingest_key = NULL, ce qui
+--    ne viole pas l'index unique
+-- 
+-- 2. Après une panne BDD, le journal peut renvoyer un lot déjà inséré
+--    (livraison "au moins une fois"): la clé garantit qu'il n'est stocké qu'une fois
+-- 
+-- 3. Configuration côté backend (.env):
+--    TELEMETRY_WAL_ENABLED=true
+--    TELEMETRY_WAL_DIR=data/telemetry_wal
+--    TELEMETRY_WAL_FSYNC=interval     # always | interval | never
+--
@@ -0,0 +1,17 @@
+-- ========================================
+-- PAGINATION PAR CURSEUR DE LA TÉLÉMÉTRIE
+-- Index du parcours (recorded_at, id) décroissant par véhicule:
+-- GET /analytics/telemetry?cursor=... et le flux NDJSON
+-- ========================================
+
+-- Exécuter ce script dans l'éditeur SQL de Supabase
+-- (CONCURRENTLY: pas de verrou d'écriture pendant la construction sur une table volumineuse)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_telemetry_vehicle_recorded_id
+    ON telemetry (vehicle_id, recorded_at DESC, id DESC);
+
+-- Vérification: la page suivante doit utiliser l'index, sans tri
+-- EXPLAIN SELECT id, recorded_at, rpm FROM telemetry
+--  WHERE vehicle_id = 1
+--    AND (recorded_at < '2024-01-01T00:00:00Z' OR (recorded_at = '2024-01-01T00:00:00Z' AND id < 12345))
+--  ORDER BY recorded_at DESC, id DESC LIMIT 1000;
@@ -0,0 +1,38 @@
+-- ========================================
+-- AGRÉGATS TEMPORELS DE LA TÉLÉMÉTRIE (1 min / 1 h / 1 jour)
+-- Table alimentée par l'ingestion quand TELEMETRY_ROLLUPS_ENABLED=true
+-- ========================================
+
+-- Exécuter ce script dans l'éditeur SQL de Supabase
+
+-- 1. Un seau par véhicule, résolution et début d'intervalle
+CREATE TABLE IF NOT EXISTS telemetry_rollups (
+    id BIGSERIAL PRIMARY KEY,
+    vehicle_id BIGINT NOT NULL,
+    resolution VARCHAR(4) NOT NULL,              -- '1m', '1h', '1d'
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    sample_count INTEGER,                        -- Messages MQTT reçus dans le seau
+    stats JSONB,                                 -- {"rpm": {"min": 800, "max": 2400, "sum": 16206, "count": 12}, ...}
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- 2. Clé de l'upsert "on_conflict=vehicle_id,resolution,bucket_start" (et index des requêtes par plage)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_telemetry_rollups_bucket
+ON telemetry_rollups(vehicle_id, resolution, bucket_start);
+
+-- ========================================
+-- NOTES IMPORTANTES
+-- ========================================
+-- 
+-- 1. Les agrégats sont calculés sur TOUS les messages reçus, pas seulement sur
+--    les lignes sauvegardées dans telemetry (une toutes les TELEMETRY_SAVE_INTERVAL s)
+-- 
+-- 2. La moyenne n'est pas stockée: avg = sum / count (fusion exacte des seaux)
+-- 
+-- 3. Lecture: GET /analytics/telemetry/rollups?vehicle_id=1&from_date=...&max_points=500
+--    (choisit la résolution la plus fine qui respecte max_points)
+-- 
+-- 4. Configuration côté backend (.env):
+--    TELEMETRY_ROLLUPS_ENABLED=true
+--    TELEMETRY_ROLLUP_FLUSH_INTERVAL=10   # secondes entre deux écritures des seaux modifiés
+--
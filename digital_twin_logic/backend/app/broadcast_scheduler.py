@@ -0,0 +1,113 @@
+"""
+Diffusion WebSocket cadencée par véhicule
+
+Chaque message MQTT ne crée plus sa propre tâche de diffusion: le traitement
+marque le véhicule « à diffuser » et une boucle unique diffuse chaque véhicule
+au plus WS_BROADCAST_MAX_FPS fois par seconde. Les messages reçus entre deux
+trames sont fusionnés: la trame suivante porte l'état le plus récent (et, en
+protocole delta, tous les points d'historique ajoutés entre-temps).
+
+- premier message après une période calme: diffusé aussitôt (pas de latence
+  ajoutée pour un device qui publie lentement)
+- rafale: une trame immédiate, puis au plus une par intervalle (1 / max_fps)
+- WS_BROADCAST_MAX_FPS=0: pas de limite de cadence, fusion des messages en attente seulement
+
+Le coût du rafraîchissement des dashboards est ainsi borné par le nombre de
+véhicules × max_fps, quelle que soit la fréquence de publication des devices.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+WS_BROADCAST_MAX_FPS = float(os.getenv("WS_BROADCAST_MAX_FPS", "10"))  # trames par seconde et par véhicule
+
+
+class BroadcastScheduler:
+    def __init__(
+        self,
+        broadcast: Callable[[int], Awaitable[None]],
+        max_fps: float = WS_BROADCAST_MAX_FPS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._broadcast = broadcast
+        self.max_fps = max_fps
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._clock = clock
+        self._dirty: Dict[int, None] = {}  # véhicules à diffuser, par ordre de marquage
+        self._next_at: Dict[int, float] = {}  # prochaine trame autorisée par véhicule
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.marked = 0
+        self.merged = 0
+        self.flushed = 0
+        self.errors = 0
+
+    def mark_dirty(self, vehicle_id: int) -> None:
+        """Demande une diffusion du véhicule (sans attente, fusionnée si déjà demandée)"""
+        self.marked += 1
+        if vehicle_id in self._dirty:
+            self.merged += 1
+            return
+        self._dirty[vehicle_id] = None
+        self._wake.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    async def flush_due(self) -> Optional[float]:
+        """Diffuse les véhicules dont la cadence le permet; retourne le délai avant la prochaine trame due"""
+        now = self._clock()
+        wait: Optional[float] = None
+        for vehicle_id in list(self._dirty):
+            due = self._next_at.get(vehicle_id, 0.0)
+            if due > now:
+                wait = due - now if wait is None else min(wait, due - now)
+                continue
+            del self._dirty[vehicle_id]
+            self._next_at[vehicle_id] = now + self.interval
+            try:
+                await self._broadcast(vehicle_id)
+                self.flushed += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Diffusion du véhicule {vehicle_id} échouée: {e}")
+        return wait
+
+    async def _run(self) -> None:
+        while True:
+            # Effacé avant le passage: un marquage pendant une diffusion réveille la boucle
+            self._wake.clear()
+            wait = await self.flush_due()
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        if self._task is None:
+            # Événement lié à la boucle de l'application (le planificateur est créé à l'import)
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="ws-broadcast-scheduler")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_fps": self.max_fps,
+            "pending": self.pending,
+            "marked": self.marked,
+            "merged": self.merged,
+            "flushed": self.flushed,
+            "errors": self.errors,
+        }
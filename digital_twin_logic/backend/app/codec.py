@@ -0,0 +1,86 @@
+"""
+Codec JSON interchangeable pour l'ingestion MQTT et la diffusion WebSocket
+
+Utilise un backend accéléré s'il est installé (orjson, puis msgspec) et se rabat
+sur le module json de la bibliothèque standard sinon. Les backends accélérés
+décodent directement les bytes du payload MQTT (pas de `.decode('utf-8')`).
+
+Forçage possible via la variable d'environnement JSON_CODEC=orjson|msgspec|json.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, Tuple, Union
+
+JSON_CODEC = os.getenv("JSON_CODEC", "auto").lower()
+
+Loads = Callable[[Union[bytes, str]], Any]
+DumpsBytes = Callable[[Any], bytes]
+
+
+def _stdlib_codec() -> Tuple[Loads, DumpsBytes, Tuple[type, ...]]:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+    # json.loads accepte directement les bytes UTF-8
+    return json.loads, dumps_bytes, (json.JSONDecodeError, UnicodeDecodeError)
+
+
+def _orjson_codec() -> Tuple[Loads, DumpsBytes, Tuple[type, ...]]:
+    import orjson
+    return orjson.loads, orjson.dumps, (orjson.JSONDecodeError,)
+
+
+def _msgspec_codec() -> Tuple[Loads, DumpsBytes, Tuple[type, ...]]:
+    import msgspec
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+    return decoder.decode, encoder.encode, (msgspec.DecodeError,)
+
+
+CODECS: Dict[str, Callable[[], Tuple[Loads, DumpsBytes, Tuple[type, ...]]]] = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _stdlib_codec,
+}
+
+
+def available_codecs() -> Dict[str, Tuple[Loads, DumpsBytes, Tuple[type, ...]]]:
+    """Backends importables dans cet environnement (utilisé par le benchmark)"""
+    found = {}
+    for name, factory in CODECS.items():
+        try:
+            found[name] = factory()
+        except ImportError:
+            continue
+    return found
+
+
+def _select(preferred: str) -> Tuple[str, Tuple[Loads, DumpsBytes, Tuple[type, ...]]]:
+    if preferred != "auto":
+        try:
+            return preferred, CODECS[preferred]()
+        except (KeyError, ImportError):
+            pass  # Backend demandé indisponible: sélection automatique
+    for name in ("orjson", "msgspec"):
+        try:
+            return name, CODECS[name]()
+        except ImportError:
+            continue
+    return "json", _stdlib_codec()
+
+
+CODEC_NAME, (_loads, _dumps_bytes, DecodeError) = _select(JSON_CODEC)
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Décode un document JSON (bytes du payload MQTT ou str)"""
+    return _loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Encode en JSON UTF-8 (bytes)"""
+    return _dumps_bytes(obj)
+
+
+def dumps(obj: Any) -> str:
+    """Encode en JSON (str), pour WebSocket.send_text"""
+    return _dumps_bytes(obj).decode("utf-8")
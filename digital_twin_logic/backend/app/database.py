@@ -3,6 +3,7 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 from typing import Optional, Dict, Any
 import logging
+from .storage import STORAGE_BACKEND, get_sqlite_database
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -11,16 +12,28 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-# Créer le client Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Créer le client Supabase (optionnel avec STORAGE_BACKEND=sqlite)
+supabase: Optional[Client] = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
 
 # Logger pour traçabilité
 logger = logging.getLogger(__name__)
 
 # Fonction pour obtenir le client Supabase
 def get_supabase() -> Client:
+    if supabase is None:
+        raise RuntimeError("SUPABASE_URL et SUPABASE_KEY ne sont pas définis")
     return supabase
 
+
+def _select_rows(table: str, columns: str = "*", eq: Optional[Dict[str, Any]] = None) -> list[Dict[str, Any]]:
+    """Lecture synchrone (thread de résolution des devices): Supabase, ou la base locale si STORAGE_BACKEND=sqlite"""
+    if STORAGE_BACKEND == "sqlite":
+        return get_sqlite_database().select(table, columns, eq=eq)
+    query = get_supabase().table(table).select(columns)
+    for column, value in (eq or {}).items():
+        query = query.eq(column, value)
+    return query.execute().data or []
+
 # ============================================================================
 # FONCTIONS UTILITAIRES POUR GESTION DYNAMIQUE DES DEVICES
 # ============================================================================
@@ -34,16 +47,19 @@ def get_device_by_topic(mqtt_topic: str) -> Optional[Dict[str, Any]]:
         
     Returns:
         Dict contenant les infos du device, ou None si non trouvé
+
+    Raises:
+        Les erreurs BDD sont propagées: un échec n'est pas un device inconnu
         
     Example:
         >>> device = get_device_by_topic("wincan/device1")
         >>> print(device['device_code'])  # "device1"
     """
     try:
-        result = supabase.table("devices").select("*").eq("mqtt_topic", mqtt_topic).execute()
+        result = _select_rows("devices", eq={"mqtt_topic": mqtt_topic})
         
-        if result.data and len(result.data) > 0:
-            device = result.data[0]
+        if result:
+            device = result[0]
             logger.info(f"✅ Device trouvé: {device['device_code']} (ID: {device['id']}) - Status: {device['status']}")
             return device
         else:
@@ -52,7 +68,33 @@ def get_device_by_topic(mqtt_topic: str) -> Optional[Dict[str, Any]]:
             
     except Exception as e:
         logger.error(f"❌ Erreur lors de la récupération du device pour topic {mqtt_topic}: {e}")
-        return None
+        raise
+
+
+# Sélection de l'assignment actif avec jointure pour récupérer aussi les infos du véhicule
+ACTIVE_ASSIGNMENT_COLUMNS = "id, vehicle_id, device_id, is_active, assigned_at, notes, vehicles(id, name, vin, status)"
+
+
+def _format_assignment(assignment: Dict[str, Any]) -> Dict[str, Any]:
+    """Enrichit l'objet assignment avec les données du véhicule"""
+    vehicle = assignment.get('vehicles') or {}
+    
+    logger.info(
+        f"✅ Assignment actif trouvé: Device {assignment['device_id']} → Véhicule {vehicle.get('name', 'N/A')} "
+        f"(ID: {assignment['vehicle_id']}) depuis {assignment['assigned_at']}"
+    )
+    
+    return {
+        "assignment_id": assignment["id"],
+        "vehicle_id": assignment["vehicle_id"],
+        "device_id": assignment["device_id"],
+        "is_active": assignment["is_active"],
+        "assigned_at": assignment["assigned_at"],
+        "notes": assignment.get("notes"),
+        "vehicle_name": vehicle.get("name"),
+        "vehicle_vin": vehicle.get("vin"),
+        "vehicle_status": vehicle.get("status")
+    }
 
 
 def get_active_vehicle_for_device(device_id: int) -> Optional[Dict[str, Any]]:
@@ -64,6 +106,9 @@ def get_active_vehicle_for_device(device_id: int) -> Optional[Dict[str, Any]]:
         
     Returns:
         Dict contenant l'assignment actif avec détails véhicule, ou None si aucune association active
+
+    Raises:
+        Les erreurs BDD sont propagées: un échec n'est pas une absence d'assignment
         
     Example:
         >>> assignment = get_active_vehicle_for_device(1)
@@ -71,38 +116,35 @@ def get_active_vehicle_for_device(device_id: int) -> Optional[Dict[str, Any]]:
         >>> print(assignment['vehicle_name'])  # "Tesla Model 3"
     """
     try:
-        # Requête avec jointure pour récupérer aussi les infos du véhicule
-        result = supabase.table("vehicle_device_assignment").select(
-            "id, vehicle_id, device_id, is_active, assigned_at, notes, vehicles(id, name, vin, status)"
-        ).eq("device_id", device_id).eq("is_active", True).execute()
+        result = _select_rows(
+            "vehicle_device_assignment", ACTIVE_ASSIGNMENT_COLUMNS,
+            eq={"device_id": device_id, "is_active": True},
+        )
         
-        if result.data and len(result.data) > 0:
-            assignment = result.data[0]
-            vehicle = assignment.get('vehicles', {})
-            
-            logger.info(
-                f"✅ Assignment actif trouvé: Device {device_id} → Véhicule {vehicle.get('name', 'N/A')} "
-                f"(ID: {assignment['vehicle_id']}) depuis {assignment['assigned_at']}"
-            )
-            
-            # Enrichir l'objet assignment avec les données du véhicule
-            return {
-                "assignment_id": assignment["id"],
-                "vehicle_id": assignment["vehicle_id"],
-                "device_id": assignment["device_id"],
-                "is_active": assignment["is_active"],
-                "assigned_at": assignment["assigned_at"],
-                "notes": assignment.get("notes"),
-                "vehicle_name": vehicle.get("name"),
-                "vehicle_vin": vehicle.get("vin"),
-                "vehicle_status": vehicle.get("status")
-            }
+        if result:
+            return _format_assignment(result[0])
         else:
             logger.warning(f"⚠️  Aucun assignment actif trouvé pour le device ID: {device_id}")
             return None
             
     except Exception as e:
         logger.error(f"❌ Erreur lors de la récupération de l'assignment actif pour device {device_id}: {e}")
+        raise
+
+
+def get_active_device_topics() -> Optional[list[str]]:
+    """
+    Récupère les topics MQTT des devices actifs (abonnements du client MQTT).
+    
+    Returns:
+        Liste des topics, ou None si la BDD est inaccessible (à distinguer d'une liste vide)
+    """
+    try:
+        result = _select_rows("devices", "mqtt_topic", eq={"status": "active"})
+        return [row["mqtt_topic"] for row in result if row.get("mqtt_topic")]
+        
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de la récupération des topics des devices actifs: {e}")
         return None
 
 
@@ -114,11 +156,11 @@ def get_all_active_assignments() -> list[Dict[str, Any]]:
         Liste des assignments actifs avec détails véhicule et device
     """
     try:
-        result = supabase.table("v_active_device_assignments").select("*").execute()
+        result = _select_rows("v_active_device_assignments")
         
-        if result.data:
-            logger.info(f"📊 {len(result.data)} assignment(s) actif(s) trouvé(s)")
-            return result.data
+        if result:
+            logger.info(f"📊 {len(result)} assignment(s) actif(s) trouvé(s)")
+            return result
         else:
             logger.info("ℹ️  Aucun assignment actif")
             return []
@@ -128,3 +170,28 @@ def get_all_active_assignments() -> list[Dict[str, Any]]:
         return []
 
 
+# ============================================================================
+# VERSIONS ASYNCHRONES (routers): passent par la couche de stockage (storage/)
+# ============================================================================
+
+async def get_active_vehicle_for_device_async(device_id: int, storage=None) -> Optional[Dict[str, Any]]:
+    """Équivalent asynchrone de get_active_vehicle_for_device (n'attrape pas les erreurs)"""
+    from .storage import get_storage
+    storage = storage or get_storage()
+    rows = await storage.select(
+        "vehicle_device_assignment", ACTIVE_ASSIGNMENT_COLUMNS,
+        eq={"device_id": device_id, "is_active": True},
+    )
+    if not rows:
+        logger.warning(f"⚠️  Aucun assignment actif trouvé pour le device ID: {device_id}")
+        return None
+    return _format_assignment(rows[0])
+
+
+async def get_all_active_assignments_async(storage=None) -> list[Dict[str, Any]]:
+    """Équivalent asynchrone de get_all_active_assignments (n'attrape pas les erreurs)"""
+    from .storage import get_storage
+    storage = storage or get_storage()
+    rows = await storage.select("v_active_device_assignments")
+    logger.info(f"📊 {len(rows)} assignment(s) actif(s) trouvé(s)")
+    return rows
@@ -0,0 +1,167 @@
+"""
+Cache de résolution topic MQTT → device → véhicule
+
+Chaque message MQTT nécessitait deux requêtes Supabase (device par topic puis
+assignment actif du device). Ce module garde le résultat en mémoire avec un TTL
+et permet une invalidation explicite depuis les endpoints d'écriture
+(routers/devices.py).
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# === CONFIGURATION DU CACHE ===
+DEVICE_CACHE_TTL = float(os.getenv("DEVICE_CACHE_TTL", "60"))  # secondes
+DEVICE_CACHE_NEGATIVE_TTL = float(os.getenv("DEVICE_CACHE_NEGATIVE_TTL", "10"))  # topic inconnu / pas d'assignment
+
+Resolution = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+class DeviceResolutionCache:
+    """
+    Cache TTL thread-safe pour la résolution topic → (device, assignment).
+
+    Les résultats négatifs (device inconnu, aucun assignment actif) sont aussi
+    mis en cache, avec un TTL plus court, pour ne pas interroger la BDD à chaque
+    message d'un device non configuré.
+
+    Les loaders lèvent une exception en cas d'erreur BDD (et non None): l'échec
+    est propagé à l'appelant et rien n'est mis en cache, le message suivant
+    retente la résolution.
+    """
+
+    def __init__(
+        self,
+        device_loader: Callable[[str], Optional[Dict[str, Any]]],
+        assignment_loader: Callable[[int], Optional[Dict[str, Any]]],
+        ttl: float = DEVICE_CACHE_TTL,
+        negative_ttl: float = DEVICE_CACHE_NEGATIVE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._device_loader = device_loader
+        self._assignment_loader = assignment_loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # topic → (expires_at, device, assignment)
+        self._entries: Dict[str, Tuple[float, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def peek(self, topic: str) -> Optional[Resolution]:
+        """
+        Résolution depuis la mémoire uniquement (aucun appel BDD).
+
+        Returns:
+            (device, assignment) si une entrée valide existe, None sinon (appeler resolve)
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1], entry[2]
+        return None
+
+    def resolve(self, topic: str) -> Resolution:
+        """
+        Retourne (device, assignment) pour un topic MQTT.
+
+        assignment vaut None si le device est inconnu, inactif ou sans véhicule actif.
+        Les erreurs des loaders sont propagées (résolution non mise en cache).
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+            generation = self.invalidations
+
+        # Requêtes BDD hors du verrou pour ne pas bloquer les autres devices
+        try:
+            device = self._device_loader(topic)
+            assignment = None
+            if device and device.get("status") == "active":
+                assignment = self._assignment_loader(device["id"])
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+        ttl = self.ttl if assignment else self.negative_ttl
+        with self._lock:
+            # Ne pas mémoriser un résultat chargé avant une invalidation concurrente
+            if self.invalidations == generation:
+                self._entries[topic] = (self._clock() + ttl, device, assignment)
+        return device, assignment
+
+    def invalidate(self, topic: Optional[str] = None, device_id: Optional[int] = None) -> int:
+        """
+        Invalide les entrées correspondant à un topic et/ou à un device_id.
+
+        Returns:
+            Nombre d'entrées supprimées
+        """
+        removed = 0
+        with self._lock:
+            for key, (_, device, _) in list(self._entries.items()):
+                if (topic is not None and key == topic) or (
+                    device_id is not None and device is not None and device.get("id") == device_id
+                ):
+                    del self._entries[key]
+                    removed += 1
+            self.invalidations += 1
+        return removed
+
+    def clear(self) -> None:
+        """Vide entièrement le cache"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs hit/miss exposés via /health"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "invalidations": self.invalidations,
+                "errors": self.errors,
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+            }
+
+
+def _build_default_cache() -> DeviceResolutionCache:
+    # Import tardif: database.py crée le client Supabase à l'import
+    from .database import get_device_by_topic, get_active_vehicle_for_device
+    return DeviceResolutionCache(get_device_by_topic, get_active_vehicle_for_device)
+
+
+_cache: Optional[DeviceResolutionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_device_cache() -> DeviceResolutionCache:
+    """Retourne le cache partagé (créé à la première utilisation)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = _build_default_cache()
+    return _cache
+
+
+def invalidate_device(topic: Optional[str] = None, device_id: Optional[int] = None) -> None:
+    """Raccourci utilisé par les endpoints d'écriture des devices/assignments"""
+    if _cache is not None:
+        _cache.invalidate(topic=topic, device_id=device_id)
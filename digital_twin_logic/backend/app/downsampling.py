@@ -0,0 +1,252 @@
+"""
+Réduction du nombre de points des séries télémétriques (graphiques)
+
+- lttb:   Largest-Triangle-Three-Buckets, conserve la forme visuelle de la courbe
+- minmax: enveloppe min/max par seau, conserve les pics (alertes, dépassements)
+
+Les calculs sont faits avec NumPy: l'enveloppe min/max est entièrement
+vectorisée; LTTB dépend du point retenu dans le seau précédent et boucle donc
+sur les seaux (max_points itérations), chaque seau étant traité en vectoriel.
+
+Avec plusieurs champs, chaque série reçoit sa part du budget et les lignes
+retenues sont l'union des points choisis pour chaque champ.
+"""
+import os
+import warnings
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .history_buffer import points_from_arrays
+
+# === CONFIGURATION ===
+# Historique diffusé par WebSocket / renvoyé par /telemetry/latest:
+# WS_HISTORY_MAX_POINTS > 0: tout l'historique en mémoire réduit à ce nombre de points,
+# sinon les WS_HISTORY_WINDOW points les plus récents
+WS_HISTORY_MAX_POINTS = int(os.getenv("WS_HISTORY_MAX_POINTS", "0"))
+WS_HISTORY_DOWNSAMPLE = os.getenv("WS_HISTORY_DOWNSAMPLE", "lttb").lower()
+WS_HISTORY_WINDOW = int(os.getenv("WS_HISTORY_WINDOW", "100"))
+# Requêtes /analytics/telemetry?max_points=: lignes brutes gardées en mémoire (un bloc);
+# une plage plus courte est réduite en une fois, une plus longue bloc par bloc
+DOWNSAMPLE_CHUNK_ROWS = int(os.getenv("DOWNSAMPLE_CHUNK_ROWS", "50000"))
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def to_seconds(values: Sequence[Any]) -> np.ndarray:
+    """Horodatages ISO (ou datetime) → secondes (float64); seule l'échelle relative compte"""
+    try:
+        with warnings.catch_warnings():
+            # Chaînes avec fuseau: conversion implicite en UTC signalée par NumPy → repli Python
+            warnings.simplefilter("error")
+            parsed = np.array(values, dtype="datetime64[us]")
+        return parsed.astype("int64") / 1e6
+    except (ValueError, TypeError, UserWarning, DeprecationWarning):
+        return np.fromiter(
+            (
+                (value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace("Z", "+00:00"))).timestamp()
+                for value in values
+            ),
+            dtype=np.float64,
+            count=len(values),
+        )
+
+
+def to_float_array(values: Sequence[Any]) -> np.ndarray:
+    """Valeurs d'un champ → float64, NaN pour les valeurs absentes ou non numériques"""
+    def number(value: Any) -> float:
+        if value is None or isinstance(value, (str, bool)):
+            return np.nan
+        return value
+
+    return np.fromiter((number(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Index des n_out points retenus par LTTB (premier et dernier toujours inclus)"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Seaux intermédiaires [edges[i], edges[i + 1]); edges[-1] == n - 1 (dernier point)
+    # Division entière: avec (n - 2) / (n_out - 2) en flottant, l'arrondi peut exclure l'avant-dernier point
+    edges = np.arange(n_out - 1, dtype=np.int64) * (n - 2) // (n_out - 2) + 1
+    bounds = np.append(edges, n)
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_start, next_end = bounds[i + 1], bounds[i + 2]
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        xs, ys = x[start:end], y[start:end]
+        # Aire (x2) du triangle (point retenu précédent, candidat, moyenne du seau suivant)
+        area = np.abs((x[a] - avg_x) * (ys - y[a]) - (x[a] - xs) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Index du minimum et du maximum de chaque seau (+ extrémités), NaN ignorés"""
+    n = len(y)
+    if n_buckets < 1 or 2 * n_buckets + 2 >= n:
+        return np.arange(n)
+
+    size = -(-n // n_buckets)
+    pad = size * n_buckets - n
+    missing = np.isnan(y)
+    low = np.concatenate([np.where(missing, np.inf, y), np.full(pad, np.inf)]).reshape(n_buckets, size)
+    high = np.concatenate([np.where(missing, -np.inf, y), np.full(pad, -np.inf)]).reshape(n_buckets, size)
+
+    offsets = np.arange(n_buckets) * size
+    has_values = np.isfinite(low.min(axis=1))
+    minima = (low.argmin(axis=1) + offsets)[has_values]
+    maxima = (high.argmax(axis=1) + offsets)[has_values]
+    return np.unique(np.concatenate([[0, n - 1], minima, maxima]))
+
+
+def downsample_indices(
+    x: Optional[np.ndarray], y: np.ndarray, max_points: int, method: str = "lttb"
+) -> np.ndarray:
+    """Index retenus pour une série (valeurs NaN exclues avant LTTB)"""
+    if method == "minmax":
+        return minmax_indices(y, max(max_points // 2 - 1, 1))
+    present = np.flatnonzero(~np.isnan(y))
+    if len(present) <= max_points:
+        return present
+    chosen = lttb_indices(x[present], y[present], max_points)
+    return present[chosen]
+
+
+def downsample_rows(
+    rows: List[Dict[str, Any]],
+    fields: Sequence[str],
+    max_points: Optional[int],
+    method: str = "lttb",
+    x_key: str = "recorded_at",
+) -> List[Dict[str, Any]]:
+    """
+    Réduit une liste de lignes (triées par x croissant) à environ max_points lignes.
+
+    Le budget est partagé entre les champs; un champ sans aucune valeur numérique
+    est ignoré. Sans champ exploitable, un point sur k est conservé.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Méthode inconnue: {method} (attendu: {', '.join(DOWNSAMPLE_METHODS)})")
+    n = len(rows)
+    if not max_points or n <= max_points:
+        return rows
+
+    series = [to_float_array([row.get(name) for row in rows]) for name in fields]
+    keep = select_indices(n, lambda: to_seconds([row[x_key] for row in rows]), series, max_points, method)
+    return [rows[i] for i in keep]
+
+
+class StreamingDownsampler:
+    """
+    Réduction d'une plage lue page par page, en mémoire bornée.
+
+    Les lignes brutes sont regroupées en blocs de chunk_rows lignes, chacun
+    réduit à max_points points. Les blocs gardés couvrent tous le même nombre
+    de lignes sources: quand ils sont trop nombreux ils sont fusionnés deux à
+    deux (niveau + 1), et les blocs plus récents attendent d'atteindre ce niveau
+    (fusions successives, comme un compteur binaire). La densité reste ainsi
+    uniforme sur toute la plage; finish() réduit le tout à max_points.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        max_points: int,
+        method: str = "lttb",
+        chunk_rows: int = DOWNSAMPLE_CHUNK_ROWS,
+        max_blocks: int = 16,
+    ):
+        if method not in DOWNSAMPLE_METHODS:
+            raise ValueError(f"Méthode inconnue: {method} (attendu: {', '.join(DOWNSAMPLE_METHODS)})")
+        self.fields = list(fields)
+        self.max_points = max_points
+        self.method = method
+        self.chunk_rows = max(chunk_rows, max_points * 2)
+        self.max_blocks = max(max_blocks + max_blocks % 2, 2)
+        self.level = 0  # self.blocks couvrent chacun chunk_rows × 2**level lignes sources
+        self.blocks: List[List[Dict[str, Any]]] = []
+        self.pending: List[Tuple[int, List[Dict[str, Any]]]] = []  # (niveau, lignes), plus récents que blocks
+        self.raw: List[Dict[str, Any]] = []
+        self.rows_seen = 0
+
+    def _reduce(self, rows: List[Dict[str, Any]], points: Optional[int] = None) -> List[Dict[str, Any]]:
+        return downsample_rows(rows, self.fields, points or self.max_points, self.method)
+
+    def add(self, rows: List[Dict[str, Any]]) -> None:
+        """Ajoute des lignes (ordre chronologique, à la suite des précédentes)"""
+        self.rows_seen += len(rows)
+        self.raw.extend(rows)
+        while len(self.raw) >= self.chunk_rows:
+            chunk, self.raw = self.raw[:self.chunk_rows], self.raw[self.chunk_rows:]
+            self.pending.append((0, self._reduce(chunk)))
+            self._carry()
+
+    def _carry(self) -> None:
+        while self.pending:
+            if len(self.pending) >= 2 and self.pending[-1][0] == self.pending[-2][0] < self.level:
+                (level, older), (_, newer) = self.pending[-2:]
+                self.pending[-2:] = [(level + 1, self._reduce(older + newer))]
+            elif self.pending[0][0] == self.level:
+                self.blocks.append(self.pending.pop(0)[1])
+                if len(self.blocks) >= self.max_blocks:
+                    self.blocks = [self._reduce(a + b) for a, b in zip(self.blocks[::2], self.blocks[1::2])]
+                    self.level += 1
+            else:
+                break
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Lignes retenues (ordre chronologique)"""
+        if not self.blocks and not self.pending:
+            return self._reduce(self.raw)
+        # Blocs incomplets: réduits au prorata des lignes couvertes, pour une densité uniforme
+        span = self.chunk_rows << self.level
+        rows = [row for block in self.blocks for row in block]
+        for level, block in self.pending:
+            rows.extend(self._reduce(block, max(3, self.max_points * (self.chunk_rows << level) // span)))
+        if self.raw:
+            rows.extend(self._reduce(self.raw, max(3, self.max_points * len(self.raw) // span)))
+        return self._reduce(rows)
+
+
+def select_indices(
+    n: int, x: Callable[[], np.ndarray], series: Sequence[np.ndarray], max_points: int, method: str = "lttb"
+) -> np.ndarray:
+    """
+    Index retenus (croissants) parmi n points, pour des séries de longueur n.
+    x: fonction renvoyant l'axe des temps en secondes (évaluée seulement pour LTTB).
+    """
+    series = [y for y in series if not np.isnan(y).all()]
+    if not series:
+        return np.unique(np.linspace(0, n - 1, max_points).round().astype(np.int64))
+
+    budget = max(max_points // len(series), 3)
+    x_values = x() if method == "lttb" else None
+    return np.unique(np.concatenate([downsample_indices(x_values, y, budget, method) for y in series]))
+
+
+def downsample_history(
+    arrays: Dict[str, np.ndarray], fields: Sequence[str], extra: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """Historique en colonnes (VehicleState.history_arrays) → points dict pour le WebSocket / l'API"""
+    n = len(arrays["timestamp"])
+    if WS_HISTORY_MAX_POINTS and n > WS_HISTORY_MAX_POINTS:
+        indices = select_indices(
+            n,
+            lambda: arrays["timestamp"].view(np.int64) / 1e6,
+            [arrays[name] for name in fields],
+            WS_HISTORY_MAX_POINTS,
+            WS_HISTORY_DOWNSAMPLE,
+        )
+    else:
+        indices = np.arange(max(n - WS_HISTORY_WINDOW, 0), n)
+    return points_from_arrays(arrays, fields, indices, extra)
@@ -0,0 +1,129 @@
+"""
+Historique en mémoire d'un véhicule: buffer circulaire typé
+
+Une colonne array('q') pour les horodatages (microsecondes epoch) et une colonne
+array('d') par champ (NaN = valeur absente), soit 8 octets par valeur au lieu
+d'un dict de flottants Python par point (~1 Ko). Quelques heures d'historique
+par véhicule tiennent ainsi en quelques centaines de Ko.
+
+Les colonnes se lisent directement en NumPy (to_numpy) pour la réduction de
+points, l'analytique et les prédictions; to_points reconstruit le format dict
+historique ({"timestamp": ISO, champ: valeur}) pour le WebSocket et l'API.
+"""
+from array import array
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+NAN = float("nan")
+
+Timestamp = Union[None, int, float, str, datetime]
+
+
+def to_microseconds(timestamp: Timestamp = None) -> int:
+    """Horodatage (datetime, ISO, secondes epoch; None = maintenant) → microsecondes epoch"""
+    if timestamp is None:
+        timestamp = datetime.now()
+    elif isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if isinstance(timestamp, datetime):
+        seconds = int(timestamp.replace(microsecond=0).timestamp())
+        return seconds * 1_000_000 + timestamp.microsecond
+    return round(timestamp * 1_000_000)
+
+
+def isoformat(microseconds: int) -> str:
+    """Microsecondes epoch → ISO local sans fuseau (comme datetime.now().isoformat())"""
+    seconds, micros = divmod(int(microseconds), 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat()
+
+
+def _number(value: Any) -> float:
+    if value is None:
+        return NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN  # PID transmis sous forme de texte: hors séries numériques
+
+
+class HistoryBuffer:
+    """Buffer circulaire de capacity points; les colonnes grandissent jusqu'à capacity puis sont réécrites"""
+
+    __slots__ = ("fields", "capacity", "_timestamps", "_columns", "_next", "appended")
+
+    def __init__(self, fields: Sequence[str], capacity: int):
+        self.fields = tuple(fields)
+        self.capacity = max(int(capacity), 1)
+        self._timestamps = array("q")
+        self._columns = [array("d") for _ in self.fields]
+        self._next = 0  # prochaine case réécrite une fois le buffer plein
+        self.appended = 0  # total des points ajoutés depuis la création
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def append(self, timestamp_us: int, values: Sequence[Any]) -> None:
+        """values: une valeur par champ, dans l'ordre de fields"""
+        if len(self._timestamps) < self.capacity:
+            self._timestamps.append(timestamp_us)
+            for column, value in zip(self._columns, values):
+                column.append(_number(value))
+        else:
+            index = self._next
+            self._timestamps[index] = timestamp_us
+            for column, value in zip(self._columns, values):
+                column[index] = _number(value)
+            self._next = (index + 1) % self.capacity
+        self.appended += 1
+
+    def clear(self) -> None:
+        self._timestamps = array("q")
+        self._columns = [array("d") for _ in self.fields]
+        self._next = 0
+
+    def _chronological(self, column: array, dtype, last: Optional[int]) -> np.ndarray:
+        # Copie (vue libérée aussitôt: un array exporté ne peut plus grandir)
+        raw = np.frombuffer(column, dtype=dtype)
+        ordered = np.concatenate([raw[self._next:], raw[:self._next]]) if self._next else raw.copy()
+        return ordered[-last:] if last is not None and last < len(ordered) else ordered
+
+    def to_numpy(self, last: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Copie chronologique des colonnes:
+        {"timestamp": datetime64[us] (UTC), champ: float64 (NaN = absent), ...}
+        """
+        if not self._timestamps:
+            arrays = {"timestamp": np.array([], dtype="datetime64[us]")}
+            arrays.update((name, np.array([], dtype=np.float64)) for name in self.fields)
+            return arrays
+        arrays = {"timestamp": self._chronological(self._timestamps, np.int64, last).view("datetime64[us]")}
+        for name, column in zip(self.fields, self._columns):
+            arrays[name] = self._chronological(column, np.float64, last)
+        return arrays
+
+    def to_points(self, last: Optional[int] = None, extra: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return points_from_arrays(self.to_numpy(last), self.fields, extra=extra)
+
+
+def points_from_arrays(
+    arrays: Dict[str, np.ndarray],
+    fields: Sequence[str],
+    indices: Optional[np.ndarray] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Colonnes (to_numpy) → liste de dicts {"timestamp": ISO, **extra, champ: valeur ou None}"""
+    timestamps = arrays["timestamp"].view(np.int64)
+    columns = [arrays[name] for name in fields]
+    if indices is not None:
+        timestamps = timestamps[indices]
+        columns = [column[indices] for column in columns]
+    points = []
+    for microseconds, *values in zip(timestamps.tolist(), *(column.tolist() for column in columns)):
+        point = {"timestamp": isoformat(microseconds)}
+        if extra:
+            point.update(extra)
+        point.update((name, None if value != value else value) for name, value in zip(fields, values))
+        points.append(point)
+    return points
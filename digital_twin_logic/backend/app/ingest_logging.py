@@ -0,0 +1,158 @@
+"""
+Journalisation du chemin d'ingestion MQTT
+
+En production (journald via digital-twin.service), les print() par message
+saturaient stdout. Ce module fournit:
+- un logger à niveaux au format structuré `event=... cle=valeur`
+- des compteurs d'ingestion résumés périodiquement
+  ("N msgs/s, M sauvegardés, K PIDs non mappés")
+- un mode verbeux (détail par message), désactivé par défaut, avec échantillonnage optionnel
+"""
+import logging
+import os
+import random
+import sys
+import time
+from typing import Any, Dict
+
+# === CONFIGURATION ===
+# summary: uniquement les résumés périodiques (défaut) | verbose: détail de chaque message
+INGEST_LOG_MODE = os.getenv("INGEST_LOG_MODE", "summary").lower()
+INGEST_LOG_LEVEL = os.getenv("INGEST_LOG_LEVEL", os.getenv("LOG_LEVEL", "INFO")).upper()
+INGEST_LOG_INTERVAL = float(os.getenv("INGEST_LOG_INTERVAL", "60"))  # secondes entre deux résumés
+# En mode verbose, fraction des messages détaillés (1.0 = tous)
+INGEST_LOG_SAMPLE_RATE = float(os.getenv("INGEST_LOG_SAMPLE_RATE", "1.0"))
+
+
+def _format_value(value: Any) -> str:
+    text = str(value).replace("\n", "\\n")
+    if " " in text or "=" in text or '"' in text or not text:
+        return '"' + text.replace('"', '\\"') + '"'
+    return text
+
+
+def format_event(event: str, **fields: Any) -> str:
+    """Formate un évènement structuré: `event=mqtt.message topic=wincan/device1 pids=41`"""
+    parts = [f"event={event}"]
+    parts.extend(f"{key}={_format_value(value)}" for key, value in fields.items())
+    return " ".join(parts)
+
+
+class IngestLogger:
+    """Logger structuré avec un mode détaillé (verbose) désactivable"""
+
+    def __init__(self, name: str = "digital_twin.ingest", mode: str = INGEST_LOG_MODE,
+                 level: str = INGEST_LOG_LEVEL, sample_rate: float = INGEST_LOG_SAMPLE_RATE):
+        self.logger = logging.getLogger(name)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(asctime)s level=%(levelname)s %(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.propagate = False
+        self.logger.setLevel(getattr(logging, level, logging.INFO))
+        self.verbose = mode == "verbose"
+        self.sample_rate = sample_rate
+
+    def sampled(self) -> bool:
+        """True si le message courant doit être détaillé (mode verbose + échantillonnage)"""
+        if not self.verbose:
+            return False
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def debug(self, event: str, **fields: Any) -> None:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(format_event(event, **fields))
+
+    def info(self, event: str, **fields: Any) -> None:
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(format_event(event, **fields))
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.logger.warning(format_event(event, **fields))
+
+    def error(self, event: str, exc_info: bool = False, **fields: Any) -> None:
+        self.logger.error(format_event(event, **fields), exc_info=exc_info)
+
+
+class IngestMetrics:
+    """
+    Compteurs du chemin d'ingestion, résumés tous les `interval` secondes.
+
+    Les compteurs sont incrémentés depuis un seul thread (celui qui traite les
+    messages MQTT); le résumé est émis par ce même thread via tick().
+    """
+
+    COUNTERS = (
+        "messages",
+        "ignored_topics",
+        "unknown_devices",
+        "resolution_errors",
+        "inactive_devices",
+        "unassigned_devices",
+        "decode_errors",
+        "fields_updated",
+        "unmapped_pids",
+        "saved",
+        "rejected",
+        "broadcasts",
+        "errors",
+    )
+
+    def __init__(self, log: IngestLogger, interval: float = INGEST_LOG_INTERVAL):
+        self.log = log
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.totals: Dict[str, int] = dict.fromkeys(self.COUNTERS, 0)
+        self._reset_window(self.started_at)
+
+    def _reset_window(self, now: float) -> None:
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.window_start = now
+        self._next_emit = now + self.interval
+
+    def tick(self, **extra: Any) -> bool:
+        """Émet le résumé si l'intervalle est écoulé (appel peu coûteux, à chaque message)"""
+        now = time.monotonic()
+        if now < self._next_emit:
+            return False
+        self.emit(now, **extra)
+        return True
+
+    def window(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def emit(self, now: float = None, **extra: Any) -> None:
+        now = time.monotonic() if now is None else now
+        counts = self.window()
+        elapsed = max(now - self.window_start, 1e-9)
+        for name, value in counts.items():
+            self.totals[name] += value
+        if counts["messages"] or counts["errors"] or counts["rejected"]:
+            self.log.info(
+                "ingest.summary",
+                window_s=round(elapsed, 1),
+                msgs=counts["messages"],
+                msgs_per_s=round(counts["messages"] / elapsed, 2),
+                saved=counts["saved"],
+                unmapped_pids=counts["unmapped_pids"],
+                ignored_topics=counts["ignored_topics"],
+                unknown_devices=counts["unknown_devices"],
+                resolution_errors=counts["resolution_errors"],
+                unassigned_devices=counts["unassigned_devices"],
+                decode_errors=counts["decode_errors"],
+                rejected=counts["rejected"],
+                broadcasts=counts["broadcasts"],
+                errors=counts["errors"],
+                **extra,
+            )
+        self._reset_window(now)
+
+    def stats(self) -> Dict[str, Any]:
+        totals = {name: self.totals[name] + getattr(self, name) for name in self.COUNTERS}
+        totals["uptime_seconds"] = round(time.monotonic() - self.started_at, 1)
+        return totals
+
+
+ingest_log = IngestLogger()
+ingest_metrics = IngestMetrics(ingest_log)
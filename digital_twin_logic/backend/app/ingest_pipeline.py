@@ -0,0 +1,142 @@
+"""
+Pipeline asyncio d'ingestion MQTT
+
+Le callback paho (thread réseau `loop_start()`) ne fait plus que déposer le message
+brut `(topic, payload, ts)` dans une file asyncio. Un pool de consommateurs sur la
+boucle FastAPI fait le décodage, la résolution device → véhicule, la persistance et
+la diffusion WebSocket. Un appel Supabase lent ne bloque donc plus les keepalives
+MQTT ni la réception des messages des autres devices.
+
+Ordre garanti par device: chaque topic est affecté (hash CRC32) à une file et donc
+à un seul consommateur.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "1000"))  # messages en attente, par consommateur
+
+RawMessage = Tuple[str, bytes, float]
+Handler = Callable[[str, bytes, float], Awaitable[None]]
+
+
+class IngestPipeline:
+    """Files asyncio partitionnées par topic + consommateurs"""
+
+    def __init__(self, handler: Handler, workers: int = INGEST_WORKERS, queue_size: int = INGEST_QUEUE_MAX):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_lag: Optional[float] = None  # secondes entre réception paho et traitement
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and self.loop is not None and self.loop.is_running()
+
+    def shard_for(self, topic: str) -> int:
+        return zlib.crc32(topic.encode("utf-8")) % self.workers
+
+    async def start(self) -> None:
+        """Crée les files et les consommateurs sur la boucle courante"""
+        if self._tasks:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._consume(index, queue), name=f"mqtt-ingest-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Laisse les consommateurs vider leurs files (au plus `timeout` secondes) puis les arrête"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️  Arrêt du pipeline MQTT: {self.queue_depth} messages non traités")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+    # ------------------------------------------------------------------
+    # Côté paho (thread réseau)
+    # ------------------------------------------------------------------
+    def submit_threadsafe(self, topic: str, payload: bytes, received_at: float) -> bool:
+        """Appelé depuis le callback paho: transfert vers la boucle asyncio, rien d'autre"""
+        loop = self.loop
+        if loop is None or not self._tasks:
+            self.dropped += 1
+            return False
+        try:
+            loop.call_soon_threadsafe(self._enqueue, (topic, payload, received_at))
+        except RuntimeError:  # boucle fermée (arrêt de l'application)
+            self.dropped += 1
+            return False
+        return True
+
+    def _enqueue(self, message: RawMessage) -> None:
+        # Exécuté dans la boucle asyncio
+        if not self._queues:
+            self.dropped += 1
+            return
+        queue = self._queues[self.shard_for(message[0])]
+        if queue.full():
+            # File saturée: on abandonne le plus ancien message de ce consommateur
+            queue.get_nowait()
+            queue.task_done()
+            self.dropped += 1
+        queue.put_nowait(message)
+        self.received += 1
+
+    # ------------------------------------------------------------------
+    # Consommateurs
+    # ------------------------------------------------------------------
+    async def _consume(self, index: int, queue: asyncio.Queue) -> None:
+        while True:
+            topic, payload, received_at = await queue.get()
+            try:
+                self.last_lag = time.time() - received_at
+                await self.handler(topic, payload, received_at)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ Erreur consommateur MQTT #{index} ({topic}): {e}")
+            finally:
+                queue.task_done()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queue_depth": self.queue_depth,
+            "queue_depths": [queue.qsize() for queue in self._queues],
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_lag_seconds": round(self.last_lag, 4) if self.last_lag is not None else None,
+        }
@@ -4,8 +4,24 @@ import os
 from dotenv import load_dotenv
 from .database import get_supabase
 from .routers import vehicles, telemetry, predictions, devices
-from .mqtt_handler import start_mqtt_client, stop_mqtt_client, check_vehicle_state, get_latest_data
-from .realtime import manager
+from .mqtt_handler import (
+    start_mqtt_client, stop_mqtt_client, check_vehicle_state, get_latest_data, get_snapshot, ingest_pipeline,
+    broadcast_scheduler,
+)
+from .realtime import ALL_VEHICLES, manager, parse_protocol, parse_vehicle_ids
+from .telemetry_state import state_store
+from . import ws_frames
+from .device_cache import get_device_cache
+from .telemetry_wal import ingest_writer
+from .storage import STORAGE_BACKEND, TELEMETRY_SINK, get_storage, get_telemetry_sink
+from .persistence_scheduler import persistence_scheduler
+from .telemetry_rollups import telemetry_rollups
+from .telemetry_retention import telemetry_retention
+from .ingest_logging import ingest_metrics
+from .pid_decoder import pid_decoder
+from .mqtt_scaling import mqtt_scaling
+from .subscriptions import subscription_manager
+from . import codec
 from fastapi import WebSocket, WebSocketDisconnect
 import asyncio
 
@@ -43,6 +59,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # pagination de /telemetry
 )
 
 # Inclure les routers
@@ -52,32 +69,104 @@ app.include_router(predictions.router, tags=["predictions"])
 app.include_router(devices.router, prefix="/api", tags=["devices"])
 
 
+async def _send_latest(websocket: WebSocket, vehicle_ids):
+    """Dernières données de chaque véhicule suivi (tous: véhicule 1 par défaut, comme avant)"""
+    delta = manager.protocol(websocket) == "delta"
+    for vehicle_id in sorted(vehicle_ids) if vehicle_ids else [None]:
+        if delta:
+            # Protocole delta: snapshot numéroté, les deltas suivants s'y appliquent
+            vehicle_id = 1 if vehicle_id is None else vehicle_id
+            await manager.send_snapshot(websocket, vehicle_id, await get_snapshot(vehicle_id))
+            continue
+        initial_data = await get_latest_data() if vehicle_id is None else await get_latest_data(vehicle_id)
+        await manager.send_personal_message(initial_data, websocket)
+
+
+async def _resync(websocket: WebSocket, vehicle_ids):
+    """Snapshots demandés par un client delta (None: tous les véhicules suivis)"""
+    if vehicle_ids is None:
+        vehicle_ids = manager.subscriptions(websocket)
+    if vehicle_ids is None:
+        vehicle_ids = {state.vehicle_id for state in state_store}
+    for vehicle_id in sorted(vehicle_ids):
+        await manager.send_snapshot(websocket, vehicle_id, await get_snapshot(vehicle_id))
+
+
+async def _handle_client_message(websocket: WebSocket, data):
+    """
+    Messages du client: {"type": "subscribe" | "unsubscribe", "vehicle_ids": [1, 2] ou "*"}
+    et, en protocole delta, {"type": "resync", "vehicle_ids": [...]} (sans vehicle_ids: tous)
+    """
+    try:
+        message = ws_frames.decode(data, manager.encoding(websocket))
+    except Exception:
+        return  # keep-alive texte ou trame illisible: ignoré
+    if not isinstance(message, dict) or message.get("type") not in ("subscribe", "unsubscribe", "resync"):
+        return
+    try:
+        vehicle_ids = parse_vehicle_ids(message.get("vehicle_ids"))
+    except ValueError as e:
+        await manager.send_personal_message({"type": "error", "detail": str(e)}, websocket)
+        return
+
+    if message["type"] == "resync":
+        await _resync(websocket, vehicle_ids)
+        return
+    if message["type"] == "subscribe":
+        previous = manager.subscriptions(websocket)
+        current = await manager.subscribe(websocket, vehicle_ids)
+        # Données initiales des véhicules nouvellement suivis
+        if vehicle_ids is not None and previous is not None:
+            await _send_latest(websocket, vehicle_ids - previous)
+    else:
+        current = await manager.unsubscribe(websocket, vehicle_ids)
+    await manager.send_personal_message({
+        "type": "subscriptions",
+        "vehicle_ids": ALL_VEHICLES if current is None else sorted(current),
+    }, websocket)
+
+
 # WebSocket endpoint pour telemetry
 @app.websocket('/ws/telemetry')
 async def websocket_telemetry_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    """
+    ?vehicle_id=1,2: uniquement ces véhicules (défaut: tous)
+    ?protocol=delta: snapshot puis deltas numérotés (voir telemetry_delta.py), défaut: full
+    Sous-protocole twin.msgpack: trames binaires MessagePack (voir ws_frames.py), défaut: JSON texte
+    """
+    try:
+        vehicle_ids = parse_vehicle_ids(websocket.query_params.get("vehicle_id"))
+        protocol = parse_protocol(websocket.query_params.get("protocol"))
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    subprotocol, encoding = ws_frames.negotiate(websocket.scope.get("subprotocols", []))
+    await manager.connect(websocket, vehicle_ids, protocol, encoding, subprotocol)
     try:
         # Envoyer immédiatement les dernières données disponibles
-        import json
-        initial_data = get_latest_data()
-        await websocket.send_text(json.dumps(initial_data))
+        await _send_latest(websocket, vehicle_ids)
         
         while True:
-            # keep connection open; clients typically won't send messages
-            await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            data = message.get("text")
+            await _handle_client_message(websocket, data if data is not None else message.get("bytes"))
     except WebSocketDisconnect:
+        pass
+    finally:
         await manager.disconnect(websocket)
 
 
 # Endpoint REST pour obtenir les dernières données
 @app.get("/telemetry/latest")
-def get_latest_telemetry(vehicle_id: int = 1):
+async def get_latest_telemetry(vehicle_id: int = 1):
     """Retourne les dernières données de télémétrie pour un véhicule spécifique
     
     Args:
         vehicle_id: ID du véhicule (défaut: 1)
     """
-    return get_latest_data(vehicle_id)
+    return await get_latest_data(vehicle_id)
 
 
 # === ÉVÉNEMENTS DE DÉMARRAGE ET D'ARRÊT ===
@@ -85,15 +174,21 @@ def get_latest_telemetry(vehicle_id: int = 1):
 async def on_startup():
     """Démarrer le client MQTT au démarrage de l'application"""
     print("🚀 Démarrage de l'application FastAPI...")
-    # Enregistrer la boucle asyncio principale pour que les callbacks MQTT
-    # (qui tournent dans un thread séparé) puissent planifier des coroutines
-    # de manière thread-safe via run_coroutine_threadsafe.
-    from . import mqtt_handler as mqtt_handler_module
-    mqtt_handler_module.async_loop = asyncio.get_running_loop()
+    # L'écrivain groupé et les consommateurs MQTT doivent tourner avant l'arrivée
+    # des premiers messages (le callback paho ne fait qu'alimenter leurs files)
+    ingest_writer.start()
+    await broadcast_scheduler.start()
+    await ingest_pipeline.start()
     start_mqtt_client()
     
     # Démarrer la tâche de vérification de l'état de la voiture
     asyncio.create_task(check_vehicle_state())
+    # Rattraper les devices créés hors API (abonnements MQTT)
+    asyncio.create_task(subscription_manager.refresh_periodically())
+    # Écriture périodique des agrégats 1m/1h/1d
+    asyncio.create_task(telemetry_rollups.run_periodically())
+    # Archivage de la télémétrie brute ancienne (TELEMETRY_RETENTION_DAYS)
+    asyncio.create_task(telemetry_retention.run_periodically())
     
     print("✅ Application FastAPI démarrée avec succès!")
 
@@ -102,13 +197,40 @@ async def on_shutdown():
     """Arrêter proprement le client MQTT lors de l'arrêt"""
     print("🛑 Arrêt de l'application...")
     stop_mqtt_client()
+    # Traiter les messages déjà reçus, puis vider la file d'écriture avant de quitter
+    await ingest_pipeline.stop()
+    await broadcast_scheduler.stop()
+    if telemetry_rollups.enabled:
+        await telemetry_rollups.flush()
+    ingest_writer.stop()
+    get_telemetry_sink().close()
+    await get_storage().close()
     print("✅ Application arrêtée proprement!")
 
 @app.get("/health")
-def health_check():
-    """Endpoint de vérification de santé"""
+async def health_check():
+    """Endpoint de vérification de santé
+
+    Coroutine: exécutée sur la boucle, les statistiques (connexions WebSocket,
+    files d'envoi...) ne sont pas lues depuis un thread pendant qu'elle les modifie.
+    """
     return {
         "status": "healthy",
         "mqtt": "connected",
+        "resolution_cache": get_device_cache().stats(),
+        "telemetry_writer": ingest_writer.stats(),
+        "telemetry_sink": TELEMETRY_SINK,
+        "storage_backend": STORAGE_BACKEND,
+        "persistence": persistence_scheduler.stats(),
+        "rollups": telemetry_rollups.stats(),
+        "retention": telemetry_retention.stats(),
+        "ingest": ingest_metrics.stats(),
+        "ingest_pipeline": ingest_pipeline.stats(),
+        "mqtt_scaling": mqtt_scaling.stats(),
+        "mqtt_subscriptions": subscription_manager.stats(),
+        "websocket": manager.stats(),
+        "websocket_broadcast": broadcast_scheduler.stats(),
+        "unmapped_pids": pid_decoder.unmapped_stats(),
+        "json_codec": codec.CODEC_NAME,
         "message": "Digital Twin Car API is running"
     }
\ No newline at end of file
@@ -3,458 +3,294 @@ MQTT Handler pour Digital Twin Car
 Écoute les données OBD-II (ESP32) et les stocke dans Supabase
 + Diffusion en temps réel via WebSocket
 """
-import json
+from . import codec
 from datetime import datetime
 from typing import Optional
-import paho.mqtt.client as mqtt
-from .database import get_supabase, get_device_by_topic, get_active_vehicle_for_device
+from .device_cache import get_device_cache
+from .telemetry_state import HISTORY_FIELDS, state_store, VehicleState
+from .downsampling import downsample_history
+from .telemetry_delta import delta_encoder
+from .ws_frames import Frame
+from .telemetry_query import LATEST_COLUMNS
+from .telemetry_wal import ingest_writer
+from .persistence_scheduler import persistence_scheduler
+from .telemetry_rollups import telemetry_rollups
+from .ingest_logging import ingest_log, ingest_metrics
+from .pid_decoder import PID_TO_COLUMN_MAPPING, is_device_topic, pid_decoder
+from .ingest_pipeline import IngestPipeline
+from .mqtt_scaling import build_client_id, create_client, mqtt_scaling
+from .broadcast_scheduler import BroadcastScheduler
+from .subscriptions import subscription_manager
+from .storage import get_storage
 import asyncio
+import os
 import time
-from collections import deque
-
-# Référence vers la boucle asyncio principale (initialisée au démarrage FastAPI)
-async_loop: Optional[asyncio.AbstractEventLoop] = None
 
 # === CONFIGURATION MQTT ===
-MQTT_BROKER = "109.123.243.44"
-MQTT_PORT = 1883
-MQTT_USERNAME = "chaari"
-MQTT_PASSWORD = "chaari2023"
-
-# === TOUS LES TOPICS OBD-II ===
-MQTT_TOPICS = [
-    "wincan/#",  # S'abonner à tous les topics wincan (configuration MeatPI)
-]
+MQTT_BROKER = os.getenv("MQTT_BROKER", "109.123.243.44")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USERNAME = os.getenv("MQTT_USERNAME", "chaari")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD", "chaari2023")
 
-# === Variables globales pour stocker les dernières valeurs ===
-latest_data = {
-    "vehicle_id": None,  # Résolu dynamiquement depuis vehicle_device_assignment
-    "device_id": None,   # ID du device qui envoie les données
-    "device_code": None, # Code du device (ex: "device1")
-    
-    # PIDs essentiels (04-11)
-    "engine_load": None,
-    "coolant_temperature": None,
-    "intake_pressure": None,
-    "rpm": None,
-    "vehicle_speed": None,
-    "intake_air_temp": None,
-    "maf_airflow": None,
-    "throttle_position": None,
-    
-    # PIDs étendus
-    "monitor_status": None,
-    "oxygen_sensors_present_banks": None,
-    "obd_standard": None,
-    "time_since_engine_start": None,
-    "pids_supported_21_40": None,
-    "distance_mil_on": None,
-    "fuel_rail_pressure": None,
-    "oxygen_sensor1_faer": None,
-    "oxygen_sensor1_voltage": None,
-    "oxygen_sensor2_faer": None,
-    "egr_commanded": None,
-    "egr_error": None,
-    "egr_commanded_error": None,
-    "warmups_since_code_clear": None,
-    "distance_since_code_clear": None,
-    "absolute_barometric_pressure": None,
-    "pids_supported_41_60": None,
-    "pids_supported_61_80": None,
-    "pids_supported_81_a0": None,
-    "monitor_status_drive_cycle": None,
-    "control_module_voltage": None,
-    "relative_throttle_position": None,
-    "ambient_air_temperature": None,
-    "abs_throttle_position_d": None,
-    "abs_throttle_position_e": None,
-    "commanded_throttle_actuator": None,
-    "max_faer": None,
-    "max_oxy_sensor_voltage": None,
-    "max_oxy_sensor_current": None,
-    "max_intake_pressure": None,
-    "engine_coolant_temp1": None,
-    "engine_coolant_temp2": None,
-    "charge_air_cooler_temp": None,
-    "egt_bank1": None,
-    "diesel_aftertreatment": None
-}
+# === TOPICS OBD-II ===
+# Un abonnement par device actif (ou wincan/+), voir subscriptions.py:
+# le broker n'envoie plus les topics PID individuels (wincan/OxyCrnt, ...)
 
-# Buffer circulaire pour l'historique (max 100 points pour les graphiques Analytics)
-# Maintenant organisé par véhicule: {vehicle_id: deque(maxlen=100)}
-telemetry_history = {}
-
-# Variables pour détecter l'état de la voiture
-last_message_time = None
-vehicle_state = "offline"  # "offline", "running"
-last_saved_data = None  # Pour garder les dernières valeurs quand la voiture s'éteint
-last_saved_history = {}  # Pour garder l'historique par véhicule en mode offline: {vehicle_id: [...]}
-last_save_time = 0  # Pour throttling des sauvegardes BDD (max toutes les 5s)
-
-# Mapping des PIDs OBD-II reçus vers les noms de colonnes de la BDD
-# Format reçu: wincan/device1 → {"01-MonitorStatus":0, "04-CalcEngineLoad":79.61, ...}
-PID_TO_COLUMN_MAPPING = {
-    # PIDs essentiels
-    "01-MonitorStatus": "monitor_status",
-    "04-CalcEngineLoad": "engine_load",
-    "05-EngineCoolantTemp": "coolant_temperature",
-    "0B-IntakeManiAbsPress": "intake_pressure",
-    "0C-EngineRPM": "rpm",
-    "0D-VehicleSpeed": "vehicle_speed",
-    "0F-IntakeAirTemperature": "intake_air_temp",
-    "10-MAFAirFlowRate": "maf_airflow",
-    "11-ThrottlePosition": "throttle_position",
-    
-    # PIDs étendus
-    "13-OxySensorsPresent_2Banks": "oxygen_sensors_present_banks",
-    "1C-OBDStandard": "obd_standard",
-    "1F-TimeSinceEngStart": "time_since_engine_start",
-    "20-PIDsSupported_21_40": "pids_supported_21_40",
-    "21-DistanceMILOn": "distance_mil_on",
-    "23-FuelRailGaug": "fuel_rail_pressure",
-    "24-OxySensor1_FAER": "oxygen_sensor1_faer",
-    "24-OxySensor1_Volt": "oxygen_sensor1_voltage",
-    "25-OxySensor2_FAER": "oxygen_sensor2_faer",
-    "30-WarmUpsSinceCodeClear": "warmups_since_code_clear",
-    "31-DistanceSinceCodeClear": "distance_since_code_clear",
-    "33-AbsBaroPres": "absolute_barometric_pressure",
-    "40-PIDsSupported_41_60": "pids_supported_41_60",
-    "41-MonStatusDriveCycle": "monitor_status_drive_cycle",
-    "42-ControlModuleVolt": "control_module_voltage",
-    "45-RelThrottlePos": "relative_throttle_position",
-    "46-AmbientAirTemp": "ambient_air_temperature",
-    "49-AbsThrottlePosD": "abs_throttle_position_d",
-    "4A-AbsThrottlePosE": "abs_throttle_position_e",
-    "4C-CmdThrottleAct": "commanded_throttle_actuator",
-    "4F-Max_FAER": "max_faer",
-    "4F-Max_OxySensVol": "max_oxy_sensor_voltage",
-    "4F-Max_OxySensCrnt": "max_oxy_sensor_current",
-    "4F-Max_IntManiAbsPres": "max_intake_pressure",
-    "60-PIDsSupported_61_80": "pids_supported_61_80",
-    "67-EngineCoolantTemp1": "engine_coolant_temp1",
-    "67-EngineCoolantTemp2": "engine_coolant_temp2",
-    "69-CmdEGR_EGRError": "egr_commanded_error",
-    "77-ChargeAirCoolerTemperature": "charge_air_cooler_temp",
-    "78-EGT_Bank1": "egt_bank1",
-    "80-PIDsSupported_81_A0": "pids_supported_81_a0",
-    "8B-DieselAftertreatment": "diesel_aftertreatment"
-}
+# === État télémétrique par véhicule (voir telemetry_state.py) ===
+# Chaque véhicule a son propre enregistrement: plus de mélange des PIDs entre devices
+# La cadence de sauvegarde est aussi propre à chaque véhicule (voir persistence_scheduler.py)
 
-def on_connect(client, userdata, flags, rc):
-    """Callback lors de la connexion au broker MQTT"""
-    if rc == 0:
+def on_connect(client, userdata, flags, reason_code, properties):
+    """Callback lors de la connexion au broker MQTT (API v2: reason_code est un ReasonCode)"""
+    if not reason_code.is_failure:
         print("\n" + "="*70)
         print("✅ CONNECTÉ AU BROKER MQTT AVEC SUCCÈS!")
         print("="*70)
-        for topic in MQTT_TOPICS:
-            client.subscribe(topic)
-            print(f"📡 Abonné au topic: {topic}")
+        print(f"📡 Abonnements MQTT: mode {subscription_manager.mode}")
         print("="*70 + "\n")
+        subscription_manager.attach(client)
     else:
-        print(f"❌ Échec de connexion MQTT, code: {rc}")
+        print(f"❌ Échec de connexion MQTT: {reason_code} ({reason_code.value})")
 
 def on_message(client, userdata, msg):
-    """✅ RÉSOLUTION DYNAMIQUE: Extrait device_id depuis topic → Résout vehicle_id depuis BDD"""
-    global last_message_time, vehicle_state, last_saved_data, last_save_time
+    """Callback paho (thread réseau): dépose le message brut dans le pipeline asyncio, rien d'autre"""
+    # Mode partition: les devices des autres partitions sont traités par un autre worker
+    if not mqtt_scaling.owns(msg.topic):
+        return
+    ingest_pipeline.submit_threadsafe(msg.topic, msg.payload, time.time())
+
+
+async def process_message(topic: str, payload: bytes, received_at: float):
+    """✅ RÉSOLUTION DYNAMIQUE: Extrait device_id depuis topic → Résout vehicle_id depuis BDD
     
+    Exécuté par les consommateurs du pipeline (ingest_pipeline.py), sur la boucle asyncio.
+    Les messages d'un même topic sont traités dans l'ordre de réception.
+    """
     try:
-        topic = msg.topic
-        payload = msg.payload.decode('utf-8')
-        
         # ============================================================================
         # FILTRE: Accepter UNIQUEMENT les topics wincan/device1, wincan/device2, etc.
         # Ignorer les topics individuels comme wincan/OxyCrnt, wincan/abs_throttle_position_e
+        # (motif compilé une seule fois dans pid_decoder.py)
         # ============================================================================
-        if not topic.startswith("wincan/device"):
-            # Ignorer silencieusement les topics individuels (pas de logs pour éviter le spam)
+        if not is_device_topic(topic):
+            # Ignorer silencieusement les topics individuels (compteur uniquement)
+            ingest_metrics.ignored_topics += 1
             return
         
-        # Vérifier que c'est bien wincan/deviceX où X est un nombre
-        import re
-        if not re.match(r'^wincan/device\d+$', topic):
-            # Topic non valide (ex: wincan/device_test, wincan/deviceABC)
-            return
+        ingest_metrics.messages += 1
+        detailed = ingest_log.sampled()  # Détail par message: mode verbose uniquement
         
-        last_message_time = time.time()
-        vehicle_state = "running"
-        
-        print("\n" + "="*70)
-        print(f"📩 MESSAGE MQTT REÇU")
-        print(f"📍 Topic: {topic}")
-        print(f"📦 Payload (tronqué): {payload[:200]}..." if len(payload) > 200 else f"📦 Payload: {payload}")
-        print("-"*70)
+        if detailed:
+            ingest_log.info("mqtt.message", topic=topic, payload_bytes=len(payload),
+                            payload=payload[:200].decode('utf-8', errors='replace'))
         
         # ============================================================================
-        # ÉTAPE 1: Extraire le device depuis le topic MQTT
+        # ÉTAPE 1: Récupérer le device (et son assignment) depuis le cache / la BDD
+        # Seuls les défauts de cache font un appel Supabase, dans un thread
         # ============================================================================
-        if not topic.startswith("wincan/"):
-            print(f"⚠️  TOPIC NON RECONNU: {topic} (attendu: wincan/deviceX)")
-            print("="*70 + "\n")
-            return
-        
-        # Récupérer le device depuis la BDD
-        device = get_device_by_topic(topic)
+        cache = get_device_cache()
+        resolution = cache.peek(topic)
+        if resolution is None:
+            try:
+                resolution = await asyncio.to_thread(cache.resolve, topic)
+            except Exception as e:
+                # Erreur BDD (pas un device inconnu): message perdu, le suivant retente la résolution
+                ingest_metrics.resolution_errors += 1
+                ingest_log.warning("mqtt.resolution_failed", topic=topic, error=e)
+                return
+        device, assignment = resolution
         
         if not device:
-            print(f"❌ ERREUR: Device non trouvé pour le topic {topic}")
-            print("💡 Assurez-vous que le device existe dans la table 'devices'")
-            print("="*70 + "\n")
+            ingest_metrics.unknown_devices += 1
+            if detailed:
+                ingest_log.warning("mqtt.unknown_device", topic=topic, hint="device absent de la table devices")
             return
         
         device_id = device['id']
         device_code = device['device_code']
         device_status = device['status']
         
-        print(f"🔧 Device: {device_code} (ID: {device_id}) - Status: {device_status}")
-        
         # Vérifier si le device est actif
         if device_status != 'active':
-            print(f"⚠️  Device {device_code} n'est pas actif (status: {device_status})")
-            print("="*70 + "\n")
+            ingest_metrics.inactive_devices += 1
+            if detailed:
+                ingest_log.warning("mqtt.inactive_device", device=device_code, device_id=device_id, status=device_status)
             return
         
         # ============================================================================
-        # ÉTAPE 2: Résoudre dynamiquement le véhicule associé au device
+        # ÉTAPE 2: Véhicule associé au device (résolu par le cache à l'étape 1)
         # ============================================================================
-        assignment = get_active_vehicle_for_device(device_id)
-        
         if not assignment:
-            print(f"❌ ERREUR: Aucun véhicule actif associé au device {device_code}")
-            print("💡 Créez une association dans la table 'vehicle_device_assignment' avec is_active=TRUE")
-            print("="*70 + "\n")
+            ingest_metrics.unassigned_devices += 1
+            if detailed:
+                ingest_log.warning("mqtt.unassigned_device", device=device_code, device_id=device_id,
+                                   hint="aucune ligne active dans vehicle_device_assignment")
             return
         
         vehicle_id = assignment['vehicle_id']
-        vehicle_name = assignment['vehicle_name']
-        
-        print(f"🚗 Véhicule: {vehicle_name} (ID: {vehicle_id})")
-        print(f"🔗 Association active depuis: {assignment['assigned_at']}")
-        
-        # Mettre à jour les métadonnées dans latest_data
-        latest_data['vehicle_id'] = vehicle_id
-        latest_data['device_id'] = device_id
-        latest_data['device_code'] = device_code
         
         # ============================================================================
         # ÉTAPE 3: Parser le JSON MQTT avec tous les PIDs
         # ============================================================================
         try:
-            data = json.loads(payload)
-            print(f"🔓 JSON parsé avec {len(data)} PIDs")
-            
-            if not isinstance(data, dict):
-                print(f"⚠️  Format inattendu: attendu dict, reçu {type(data).__name__}")
-                return
-            
-            # Mettre à jour toutes les valeurs depuis le JSON
-            updated_fields = 0
-            unmapped_pids = []
-            
-            for pid_key, value in data.items():
-                if pid_key in PID_TO_COLUMN_MAPPING:
-                    field_name = PID_TO_COLUMN_MAPPING[pid_key]
-                    
-                    # Conversion si nécessaire
-                    if isinstance(value, str):
-                        try:
-                            value = float(value) if '.' in value else int(value)
-                        except (ValueError, TypeError):
-                            pass  # Garder comme texte
-                    
-                    latest_data[field_name] = value
-                    updated_fields += 1
-                else:
-                    unmapped_pids.append(pid_key)
-            
-            print(f"✅ {updated_fields} CHAMPS MIS À JOUR")
-            
-            if unmapped_pids:
-                print(f"⚠️  {len(unmapped_pids)} PIDs non mappés: {', '.join(unmapped_pids[:5])}{'...' if len(unmapped_pids) > 5 else ''}")
-                print(f"   Ajoutez-les dans PID_TO_COLUMN_MAPPING si nécessaire")
-            
-            print("-"*70)
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ Erreur parsing JSON: {e}")
-            print("="*70 + "\n")
+            data = codec.loads(payload)
+        except codec.DecodeError as e:
+            ingest_metrics.decode_errors += 1
+            ingest_log.warning("mqtt.invalid_json", topic=topic, error=e)
             return
         
-        # Vérifier données essentielles
-        has_essential_data = (
-            latest_data["rpm"] is not None or
-            latest_data["vehicle_speed"] is not None or
-            latest_data["engine_load"] is not None or
-            latest_data["coolant_temperature"] is not None or
-            latest_data["control_module_voltage"] is not None
-        )
+        if not isinstance(data, dict):
+            ingest_metrics.decode_errors += 1
+            ingest_log.warning("mqtt.unexpected_payload", topic=topic, type=type(data).__name__)
+            return
         
-        if has_essential_data:
-            # ✅ AJOUTER AU BUFFER CIRCULAIRE (pour graphiques Analytics)
-            # Créer un buffer pour ce véhicule si il n'existe pas
-            if vehicle_id not in telemetry_history:
-                telemetry_history[vehicle_id] = deque(maxlen=100)
+        # État propre à ce véhicule: les PIDs des autres devices ne s'y mélangent pas
+        state = state_store.get_or_create(vehicle_id)
+        
+        with state.lock:
+            state.device_id = device_id
+            state.device_code = device_code
+            state.last_message_time = received_at
+            state.state = "running"
             
-            telemetry_point = {
-                "timestamp": datetime.now().isoformat(),
-                "vehicle_id": vehicle_id,  # Ajouter vehicle_id pour le filtrage
-                "rpm": latest_data["rpm"],
-                "vehicle_speed": latest_data["vehicle_speed"],
-                "coolant_temperature": latest_data["coolant_temperature"],
-                "engine_load": latest_data["engine_load"],
-                "fuel_rail_pressure": latest_data["fuel_rail_pressure"],
-                "control_module_voltage": latest_data["control_module_voltage"]
-            }
-            telemetry_history[vehicle_id].append(telemetry_point)
+            # Mettre à jour toutes les valeurs depuis le JSON (une passe, table PID précompilée)
+            updated_indexes, unmapped_pids = pid_decoder.decode_into(data, state.values)
             
-            total_points = sum(len(hist) for hist in telemetry_history.values())
-            print(f"📊 Historique véhicule {vehicle_id}: {len(telemetry_history[vehicle_id])} points (Total: {total_points} points pour {len(telemetry_history)} véhicules)")
+            ingest_metrics.fields_updated += len(updated_indexes)
+            ingest_metrics.unmapped_pids += unmapped_pids
             
-            # ✅ THROTTLING: Sauvegarder max toutes les 5s
-            current_time = time.time()
-            if current_time - last_save_time >= 5:
-                print("💾 Sauvegarde en BDD...")
-                save_to_database()
-                last_save_time = current_time
-                last_saved_data = latest_data.copy()
-                last_saved_history[vehicle_id] = list(telemetry_history.get(vehicle_id, []))  # Sauvegarder l'historique du véhicule actuel
+            # Agrégats 1m/1h/1d (tous les messages, pas seulement les lignes sauvegardées)
+            if updated_indexes:
+                telemetry_rollups.observe(vehicle_id, state.values, updated_indexes, received_at)
             
-            # Broadcaster immédiatement via WebSocket (avec historique)
-            print("📡 Diffusion WebSocket...")
-            # Les callbacks paho-mqtt s'exécutent dans un thread séparé.
-            # Utiliser run_coroutine_threadsafe avec la boucle asyncio principale
-            # qui est initialisée lors de l'événement startup de FastAPI.
-            try:
-                if async_loop is not None and async_loop.is_running():
-                    asyncio.run_coroutine_threadsafe(broadcast_telemetry(), async_loop)
-                else:
-                    # Tentative de fallback: si on est dans le thread d'événement asyncio
-                    try:
-                        loop = asyncio.get_running_loop()
-                        loop.create_task(broadcast_telemetry())
-                    except RuntimeError:
-                        print("⚠️ Aucun event loop disponible pour diffuser WebSocket")
-            except Exception as e:
-                print(f"❌ Erreur planification broadcast: {e}")
+            # Vérifier données essentielles
+            has_essential_data = state.has_essential_data()
+            telemetry_row = None
+            
+            if has_essential_data:
+                # ✅ AJOUTER AU BUFFER CIRCULAIRE (pour graphiques Analytics)
+                state.append_history()
+                
+                # ✅ THROTTLING PAR VÉHICULE: cadence propre à chaque véhicule
+                # (les échantillons intermédiaires peuvent être agrégés dans la ligne)
+                if persistence_scheduler.observe(state, updated_indexes):
+                    telemetry_row = persistence_scheduler.build_row(state)
+                    state.last_saved_data = state.to_dict()
+        
+        if detailed:
+            ingest_log.info("mqtt.decoded", device=device_code, vehicle_id=vehicle_id, pids=len(data),
+                            updated=len(updated_indexes), unmapped=unmapped_pids,
+                            history_points=len(state.history), save=telemetry_row is not None)
+        
+        # Mise en file d'écriture hors du verrou
+        if telemetry_row is not None:
+            if ingest_writer.blocking_submit:
+                # submit() peut attendre (file pleine, écriture et fsync du journal): ne pas bloquer la boucle asyncio
+                await asyncio.to_thread(save_to_database, state, telemetry_row)
+            else:
+                save_to_database(state, telemetry_row)
+        
+        if has_essential_data:
+            # Diffusion WebSocket cadencée par véhicule (rafales fusionnées, voir broadcast_scheduler.py)
+            broadcast_scheduler.mark_dirty(vehicle_id)
             
     except Exception as e:
-        print(f"❌ ERREUR: {e}")
-        import traceback
-        traceback.print_exc()
-        print("="*70 + "\n")
+        ingest_metrics.errors += 1
+        ingest_log.error("mqtt.message_failed", exc_info=True, topic=topic, error=e)
+    finally:
+        ingest_metrics.tick(write_queue=ingest_writer.queue_depth, vehicles=len(state_store),
+                            ingest_queue=ingest_pipeline.queue_depth)
 
 
-async def broadcast_telemetry():
-    """Diffuse les données de télémétrie + historique via WebSocket"""
+# Pipeline asyncio: le thread paho ne fait plus que l'enqueue (voir ingest_pipeline.py)
+ingest_pipeline = IngestPipeline(process_message)
+
+
+async def broadcast_telemetry(vehicle_id: int):
+    """Diffuse les données de télémétrie + historique d'un véhicule via WebSocket"""
     try:
         from .realtime import manager
         
-        # Récupérer le vehicle_id actuel pour envoyer seulement son historique
-        vehicle_id = latest_data.get('vehicle_id')
-        vehicle_history = list(telemetry_history.get(vehicle_id, [])) if vehicle_id else []
+        state = state_store.get(vehicle_id)
+        if state is None:
+            return
+        if not manager.recipients(vehicle_id):
+            # Aucun client ne suit ce véhicule: rien à encoder, mais la séquence suit l'état
+            # (un snapshot demandé plus tard décrit l'état courant, voir telemetry_delta.py)
+            with state.lock:
+                delta_encoder.advance(state)
+            return
         
-        telemetry_message = {
-            "type": "telemetry_update",
-            "state": vehicle_state,
-            "data": latest_data.copy(),  # Dernière valeur pour KPIs Dashboard
-            "history": vehicle_history,  # Historique UNIQUEMENT du véhicule actuel
-            "timestamp": datetime.now().isoformat()
-        }
+        with state.lock:
+            vehicle_state = state.state
+            data = state.to_dict()
+            history_arrays = state.history_arrays()  # copie NumPy, réduite hors du verrou
+            # La séquence avance à chaque diffusion: (véhicule, seq) identifie l'état diffusé
+            delta = delta_encoder.delta(state, data)
+        seq = delta["seq"]
         
-        await manager.broadcast(json.dumps(telemetry_message))
-        print(f"✅ WebSocket diffusé - {len(manager.active_connections)} clients - {len(vehicle_history)} points historiques véhicule {vehicle_id} - État: {vehicle_state}")
+        def full():
+            return {
+                "type": "telemetry_update",
+                "state": vehicle_state,
+                "data": data,  # Dernière valeur pour KPIs Dashboard
+                # Historique UNIQUEMENT de ce véhicule
+                "history": downsample_history(history_arrays, HISTORY_FIELDS, extra={"vehicle_id": vehicle_id}),
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        # Trames construites et encodées au plus une fois par encodage, quel que soit le nombre de clients
+        await manager.broadcast_update(
+            vehicle_id,
+            manager.frames.frame((vehicle_id, seq, "full"), full),
+            Frame(delta),
+            snapshot_frame(state, seq),
+        )
+        ingest_metrics.broadcasts += 1
+        ingest_log.debug("ws.broadcast", vehicle_id=vehicle_id, clients=len(manager.recipients(vehicle_id)),
+                         history_points=len(history_arrays["timestamp"]), state=vehicle_state)
     except Exception as e:
-        print(f"❌ Erreur WebSocket: {e}")
+        ingest_log.error("ws.broadcast_failed", vehicle_id=vehicle_id, error=e)
+
+
+# Une trame par véhicule au plus WS_BROADCAST_MAX_FPS fois par seconde
+broadcast_scheduler = BroadcastScheduler(broadcast_telemetry)
+
 
-def save_to_database():
-    """Enregistre les données dans la table telemetry de Supabase"""
+def save_to_database(state: VehicleState, telemetry_data: Optional[dict] = None):
+    """Dépose la ligne télémétrie d'un véhicule dans l'écrivain groupé (aucun appel BDD ici)"""
     try:
-        supabase = get_supabase()
-        
-        print("\n" + "="*70)
-        print("💾 SAUVEGARDE EN BASE DE DONNÉES")
-        print("-"*70)
-        
         # Vérifier que vehicle_id et device_id sont définis
-        if latest_data["vehicle_id"] is None or latest_data["device_id"] is None:
-            print("⚠️  Impossible de sauvegarder: vehicle_id ou device_id manquant")
-            print("   Vérifiez l'association device ↔ véhicule dans vehicle_device_assignment")
-            print("="*70 + "\n")
+        if state.vehicle_id is None or state.device_id is None:
+            ingest_log.warning("db.save_skipped", vehicle_id=state.vehicle_id, device_id=state.device_id,
+                               hint="vérifiez l'association device ↔ véhicule")
             return
         
-        telemetry_data = {
-            "vehicle_id": latest_data["vehicle_id"],
-            "device_id": latest_data["device_id"],
-            
-            # PIDs essentiels
-            "engine_load": latest_data["engine_load"],
-            "coolant_temperature": latest_data["coolant_temperature"],
-            "intake_pressure": latest_data["intake_pressure"],
-            "rpm": latest_data["rpm"],
-            "vehicle_speed": latest_data["vehicle_speed"],
-            "intake_air_temp": latest_data["intake_air_temp"],
-            "maf_airflow": latest_data["maf_airflow"],
-            "throttle_position": latest_data["throttle_position"],
-            
-            # PIDs étendus
-            "monitor_status": latest_data["monitor_status"],
-            "oxygen_sensors_present_banks": latest_data["oxygen_sensors_present_banks"],
-            "obd_standard": latest_data["obd_standard"],
-            "time_since_engine_start": latest_data["time_since_engine_start"],
-            "pids_supported_21_40": latest_data["pids_supported_21_40"],
-            "distance_mil_on": latest_data["distance_mil_on"],
-            "fuel_rail_pressure": latest_data["fuel_rail_pressure"],
-            "oxygen_sensor1_faer": latest_data["oxygen_sensor1_faer"],
-            "oxygen_sensor1_voltage": latest_data["oxygen_sensor1_voltage"],
-            "oxygen_sensor2_faer": latest_data.get("oxygen_sensor2_faer"),
-            "egr_commanded": latest_data["egr_commanded"],
-            "egr_error": latest_data["egr_error"],
-            "egr_commanded_error": latest_data.get("egr_commanded_error"),
-            "warmups_since_code_clear": latest_data["warmups_since_code_clear"],
-            "distance_since_code_clear": latest_data["distance_since_code_clear"],
-            "absolute_barometric_pressure": latest_data["absolute_barometric_pressure"],
-            "pids_supported_41_60": latest_data["pids_supported_41_60"],
-            "pids_supported_61_80": latest_data.get("pids_supported_61_80"),
-            "pids_supported_81_a0": latest_data.get("pids_supported_81_a0"),
-            "monitor_status_drive_cycle": latest_data["monitor_status_drive_cycle"],
-            "control_module_voltage": latest_data["control_module_voltage"],
-            "relative_throttle_position": latest_data["relative_throttle_position"],
-            "ambient_air_temperature": latest_data["ambient_air_temperature"],
-            "abs_throttle_position_d": latest_data["abs_throttle_position_d"],
-            "abs_throttle_position_e": latest_data["abs_throttle_position_e"],
-            "commanded_throttle_actuator": latest_data["commanded_throttle_actuator"],
-            "max_faer": latest_data["max_faer"],
-            "max_oxy_sensor_voltage": latest_data["max_oxy_sensor_voltage"],
-            "max_oxy_sensor_current": latest_data["max_oxy_sensor_current"],
-            "max_intake_pressure": latest_data["max_intake_pressure"],
-            "engine_coolant_temp1": latest_data.get("engine_coolant_temp1"),
-            "engine_coolant_temp2": latest_data.get("engine_coolant_temp2"),
-            "charge_air_cooler_temp": latest_data.get("charge_air_cooler_temp"),
-            "egt_bank1": latest_data.get("egt_bank1"),
-            "diesel_aftertreatment": latest_data.get("diesel_aftertreatment"),
-            
-            "recorded_at": datetime.now().isoformat()
-        }
-        
-        # Afficher données non-null
-        print("📊 Données sauvegardées:")
-        for key, val in telemetry_data.items():
-            if val is not None and key not in ["vehicle_id", "recorded_at"]:
-                print(f"   • {key}: {val}")
-        
-        result = supabase.table("telemetry").insert(telemetry_data).execute()
-        
-        print(f"✅ SAUVEGARDE RÉUSSIE! (Device: {latest_data['device_code']} → Véhicule ID: {latest_data['vehicle_id']})")
-        print("="*70 + "\n")
+        # Ligne construite directement depuis les slots du véhicule (ou fournie par le planificateur)
+        if telemetry_data is None:
+            with state.lock:
+                telemetry_data = state.to_row()
+        telemetry_data["recorded_at"] = datetime.now().isoformat()
+        
+        # L'insertion réelle (par lots) est faite par le thread de l'écrivain
+        # (file en mémoire, ou journal sur disque rejoué vers la BDD: voir telemetry_wal.py)
+        if ingest_writer.submit(telemetry_data):
+            ingest_metrics.saved += 1
+            ingest_log.debug("db.row_queued", device=state.device_code, vehicle_id=state.vehicle_id,
+                             queue=ingest_writer.queue_depth,
+                             non_null=sum(1 for val in telemetry_data.values() if val is not None))
+        else:
+            ingest_metrics.rejected += 1
+            ingest_log.warning("db.row_rejected", vehicle_id=state.vehicle_id, policy=ingest_writer.overflow_policy)
         
     except Exception as e:
-        print(f"❌ Erreur lors de l'enregistrement en BDD: {e}")
-        import traceback
-        traceback.print_exc()
+        ingest_metrics.errors += 1
+        ingest_log.error("db.save_failed", exc_info=True, vehicle_id=state.vehicle_id, error=e)
 
-def on_disconnect(client, userdata, rc):
-    """Callback lors de la déconnexion"""
-    if rc != 0:
-        print(f"⚠️ Déconnexion inattendue du broker MQTT. Code: {rc}")
+def on_disconnect(client, userdata, disconnect_flags, reason_code, properties):
+    """Callback lors de la déconnexion (API v2)"""
+    if reason_code != 0:
+        print(f"⚠️ Déconnexion inattendue du broker MQTT: {reason_code} ({reason_code.value})")
         print("🔄 Tentative de reconnexion...")
 
 # === Client MQTT ===
@@ -464,7 +300,17 @@ def start_mqtt_client():
     """Démarre le client MQTT"""
     global mqtt_client
     
-    mqtt_client = mqtt.Client(client_id="FastAPI_DigitalTwin_OBD2")
+    try:
+        # Configuration de répartition et verrou de partition, vérifiés ici plutôt qu'à l'import
+        mqtt_scaling.start()
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ Répartition MQTT invalide: {e}")
+        print("🛑 Ingestion MQTT non démarrée (API et /health restent disponibles)")
+        return
+    
+    # client_id unique par processus: plusieurs workers ne s'éjectent plus du broker
+    client_id = build_client_id()
+    mqtt_client = create_client(mqtt_scaling, client_id)
     mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
     
     mqtt_client.on_connect = on_connect
@@ -476,6 +322,7 @@ def start_mqtt_client():
         print("🚀 DÉMARRAGE CLIENT MQTT")
         print(f"🔌 Broker: {MQTT_BROKER}:{MQTT_PORT}")
         print(f"👤 User: {MQTT_USERNAME}")
+        print(f"🆔 Client: {client_id} (mode {mqtt_scaling.mode})")
         print("="*70)
         
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
@@ -493,45 +340,83 @@ def stop_mqtt_client():
     """Arrête le client MQTT"""
     global mqtt_client
     if mqtt_client:
+        subscription_manager.detach()
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
+        mqtt_scaling.stop()
         print("🛑 Client MQTT arrêté")
 
 
 async def check_vehicle_state():
-    """Vérifie périodiquement l'état de la voiture (offline si pas de message depuis 10s)"""
-    global vehicle_state, last_message_time, last_saved_history
+    """Vérifie périodiquement l'état de chaque voiture (offline si pas de message depuis 10s)"""
     from .realtime import manager
     
     while True:
         await asyncio.sleep(5)  # Vérifier toutes les 5 secondes
         
-        if last_message_time is None:
-            continue
-            
-        time_since_last_message = time.time() - last_message_time
-        
-        # Si pas de message depuis plus de 10 secondes, considérer la voiture offline
-        if time_since_last_message > 10 and vehicle_state == "running":
-            vehicle_state = "offline"
-            print(f"🔴 Voiture OFFLINE - Pas de message depuis {time_since_last_message:.1f}s")
-            
-            # Récupérer le vehicle_id pour envoyer son historique sauvegardé
-            vehicle_id = last_saved_data.get('vehicle_id') if last_saved_data else latest_data.get('vehicle_id')
-            saved_history = last_saved_history.get(vehicle_id, []) if vehicle_id else []
+        now = time.time()
+        for state in state_store:
+            with state.lock:
+                if state.last_message_time is None or state.state != "running":
+                    continue
+                
+                time_since_last_message = now - state.last_message_time
+                
+                # Si pas de message depuis plus de 10 secondes, considérer la voiture offline
+                if time_since_last_message <= 10:
+                    continue
+                
+                state.state = "offline"
+                
+                # Envoyer l'état offline avec les dernières valeurs ET l'historique sauvegardé du véhicule
+                offline_data = state.last_saved_data if state.last_saved_data else state.to_dict()
+                offline_message = {
+                    "type": "telemetry_update",
+                    "state": "offline",
+                    "data": offline_data,
+                    # Historique du véhicule avant extinction (plus d'ajout une fois hors ligne)
+                    "history": downsample_history(state.history_arrays(), HISTORY_FIELDS,
+                                                  extra={"vehicle_id": state.vehicle_id}),
+                    "timestamp": datetime.now().isoformat()
+                }
+                # Construits sous le verrou: aucun point ajouté entre les deux formes
+                offline_delta = delta_encoder.delta(state, offline_data)
+                offline_snapshot = delta_encoder.snapshot(state)
             
-            # Envoyer l'état offline avec les dernières valeurs ET l'historique sauvegardé du véhicule
-            offline_message = {
-                "type": "telemetry_update",
-                "state": "offline",
-                "data": last_saved_data if last_saved_data else latest_data.copy(),
-                "history": saved_history,  # Historique du véhicule avant extinction
-                "timestamp": datetime.now().isoformat()
-            }
-            await manager.broadcast(json.dumps(offline_message))
+            ingest_log.info("vehicle.offline", vehicle_id=state.vehicle_id, silent_s=round(time_since_last_message, 1))
+            await manager.broadcast_update(
+                state.vehicle_id, Frame(offline_message), Frame(offline_delta), Frame(offline_snapshot)
+            )
+
+
+def snapshot_frame(state: VehicleState, seq: Optional[int] = None) -> Frame:
+    """Snapshot d'un véhicule; seq: diffusion en cours, snapshot partagé par les clients à resynchroniser
+
+    Hors diffusion (seq absent), l'état a pu changer sans que la séquence avance
+    (aucun client abonné, cadence de diffusion): le snapshot est construit à la
+    demande et n'est pas mis en cache.
+    """
+    from .realtime import manager
+
+    def build():
+        with state.lock:
+            return delta_encoder.snapshot(state)
+    if seq is None:
+        return Frame(build=build)
+    return manager.frames.frame((state.vehicle_id, seq, "snapshot"), build)
+
+
+async def get_snapshot(vehicle_id: int = 1) -> Frame:
+    """Snapshot du protocole delta: état en mémoire du véhicule, sinon dernières données en base"""
+    state = state_store.get(vehicle_id)
+    if state is not None:
+        return snapshot_frame(state)
+    snapshot = await get_latest_data(vehicle_id)
+    snapshot.update(type="telemetry_snapshot", vehicle_id=vehicle_id, seq=delta_encoder.seq(vehicle_id))
+    return Frame(snapshot)
 
 
-def get_latest_data(vehicle_id: int = 1):
+async def get_latest_data(vehicle_id: int = 1):
     """Retourne les dernières données + historique pour un véhicule spécifique
     
     Args:
@@ -540,27 +425,30 @@ def get_latest_data(vehicle_id: int = 1):
     Returns:
         Dict avec state, data, history pour le véhicule demandé
     """
+    state = state_store.get(vehicle_id)
+    is_running = state is not None and state.state == "running"
+    
     try:
-        # Requête Supabase pour obtenir la dernière télémétrie du véhicule
-        from .database import get_supabase
-        supabase = get_supabase()
-        
-        result = supabase.table("telemetry").select("*").eq("vehicle_id", vehicle_id).order("created_at", desc=True).limit(1).execute()
+        # Dernière télémétrie du véhicule (backend de stockage asynchrone)
+        result = await get_storage().select(
+            "telemetry", ", ".join(LATEST_COLUMNS), eq={"vehicle_id": vehicle_id}, order="created_at", desc=True, limit=1
+        )
         
-        if result.data and len(result.data) > 0:
+        if result:
             # Données trouvées dans la base
-            db_data = result.data[0]
+            db_data = result[0]
             
-            # Déterminer l'état (si c'est le véhicule actif dans latest_data)
-            state = "running" if latest_data.get("vehicle_id") == vehicle_id and vehicle_state == "running" else "offline"
-            
-            # Récupérer l'historique spécifique à ce véhicule
-            vehicle_history = list(telemetry_history.get(vehicle_id, [])) if state == "running" else []
+            # Historique spécifique à ce véhicule (uniquement s'il publie actuellement)
+            history = []
+            if is_running:
+                with state.lock:
+                    history_arrays = state.history_arrays()
+                history = downsample_history(history_arrays, HISTORY_FIELDS, extra={"vehicle_id": vehicle_id})
             
             return {
-                "state": state,
+                "state": "running" if is_running else "offline",
                 "data": db_data,
-                "history": vehicle_history,
+                "history": history,
                 "timestamp": datetime.now().isoformat()
             }
         else:
@@ -574,13 +462,20 @@ def get_latest_data(vehicle_id: int = 1):
             
     except Exception as e:
         print(f"❌ Erreur lors de la récupération des données pour véhicule {vehicle_id}: {e}")
-        # Fallback sur les données globales si erreur
-        is_active_vehicle = latest_data.get("vehicle_id") == vehicle_id
-        vehicle_history = list(telemetry_history.get(vehicle_id, [])) if is_active_vehicle else []
+        # Fallback sur l'état en mémoire du véhicule si erreur
+        if state is None:
+            return {
+                "state": "offline",
+                "data": {"vehicle_id": vehicle_id},
+                "history": [],
+                "timestamp": datetime.now().isoformat()
+            }
         
-        return {
-            "state": vehicle_state if is_active_vehicle else "offline",
-            "data": latest_data.copy() if is_active_vehicle else {"vehicle_id": vehicle_id},
-            "history": vehicle_history,
-            "timestamp": datetime.now().isoformat()
-        }
\ No newline at end of file
+        with state.lock:
+            return {
+                "state": state.state,
+                "data": state.to_dict(),
+                "history": downsample_history(state.history_arrays(), HISTORY_FIELDS,
+                                              extra={"vehicle_id": vehicle_id}),
+                "timestamp": datetime.now().isoformat()
+            }
@@ -0,0 +1,221 @@
+"""
+Répartition de l'ingestion MQTT entre plusieurs workers / hôtes
+
+Avec un client_id fixe, deux workers uvicorn (ou deux machines) s'éjectent
+mutuellement du broker; avec des client_id distincts mais le même abonnement,
+chacun traite tous les messages. Trois modes (MQTT_INGEST_MODE):
+
+- single:    un seul consommateur (comportement historique)
+- partition: chaque worker reçoit tout mais ne garde que les devices dont
+             crc32(topic) % MQTT_PARTITION_COUNT == MQTT_PARTITION_INDEX
+             (affectation déterministe; mode recommandé)
+- shared:    abonnements partagés MQTT v5 `$share/<groupe>/<topic>`: le broker
+             distribue chaque message à un seul membre du groupe
+
+L'ingestion n'est pas sans état: état télémétrique, historique, cadence de
+sauvegarde, détection offline et séquences delta sont tenus par véhicule, en
+mémoire du processus, et les messages d'un device doivent être traités dans
+l'ordre. Un device doit donc toujours arriver au même worker. C'est le cas en
+mode partition; en mode shared, seulement si le broker répartit par topic
+(EMQX: broker.shared_subscription_strategy = hash_topic). La répartition par
+défaut des brokers (round robin, aléatoire) disperse les messages d'un même
+device entre workers: le mode shared exige donc MQTT_SHARE_BY_TOPIC=true et
+refuse de démarrer sinon.
+
+Mode partition et workers: MQTT_PARTITION_INDEX est lu une fois par processus.
+Les workers de `uvicorn --workers N` partagent l'environnement (même index) et
+le même port (un dashboard ne choisit pas son worker): lancer une unité par
+index, chacune sur son port (digital-twin.service). Au démarrage, chaque
+processus verrouille sa partition (MQTT_PARTITION_LOCK_DIR): un second processus
+du même hôte avec le même index n'ingère pas et le signale.
+
+Une configuration invalide n'empêche pas l'application de démarrer: l'erreur
+est journalisée au démarrage de l'ingestion MQTT (qui reste arrêtée) et exposée
+dans /health (mqtt_scaling.error).
+
+Dashboards: chaque processus ne diffuse sur /ws/telemetry que les véhicules
+qu'il ingère. Un dashboard ouvre une connexion WebSocket vers chaque worker
+(chaque véhicule n'est diffusé que par un seul d'entre eux, l'union est
+complète); en mode partition, il peut ne joindre que le worker de la partition
+du device (partition et nombre de partitions dans /health). Les routes REST
+lisent la base et répondent depuis n'importe quel worker.
+
+Dans tous les modes, chaque processus a un client_id unique.
+"""
+import os
+import socket
+import uuid
+import zlib
+from typing import IO, Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de verrou de partition
+    fcntl = None
+
+import paho.mqtt.client as mqtt
+
+# === CONFIGURATION ===
+MQTT_INGEST_MODE = os.getenv("MQTT_INGEST_MODE", "single").lower()
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "digital_twin")
+# true: le broker distribue le groupe partagé par topic (chaque device toujours au même membre)
+MQTT_SHARE_BY_TOPIC = os.getenv("MQTT_SHARE_BY_TOPIC", "false").lower() == "true"
+MQTT_PARTITION_COUNT = int(os.getenv("MQTT_PARTITION_COUNT", "1"))
+MQTT_PARTITION_INDEX = os.getenv("MQTT_PARTITION_INDEX", "0")
+MQTT_PARTITION_LOCK_DIR = os.getenv("MQTT_PARTITION_LOCK_DIR", "data/mqtt_partitions")  # verrous par index (hôte)
+MQTT_CLIENT_ID_PREFIX = os.getenv("MQTT_CLIENT_ID_PREFIX", "FastAPI_DigitalTwin_OBD2")
+
+INGEST_MODES = ("single", "shared", "partition")
+
+
+def build_client_id(prefix: str = MQTT_CLIENT_ID_PREFIX) -> str:
+    """client_id unique par processus: préfixe-hôte-pid-aléa"""
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def topic_partition(topic: str, count: int) -> int:
+    """Partition d'un topic device (stable entre processus et redémarrages)"""
+    return zlib.crc32(topic.encode("utf-8")) % count
+
+
+class MqttScaling:
+    """Paramètres de répartition d'un processus d'ingestion"""
+
+    def __init__(
+        self,
+        mode: str = MQTT_INGEST_MODE,
+        share_group: str = MQTT_SHARE_GROUP,
+        share_by_topic: bool = MQTT_SHARE_BY_TOPIC,
+        partition_index: Any = MQTT_PARTITION_INDEX,
+        partition_count: int = MQTT_PARTITION_COUNT,
+        lock_dir: str = MQTT_PARTITION_LOCK_DIR,
+    ):
+        if mode not in INGEST_MODES:
+            raise ValueError(f"MQTT_INGEST_MODE invalide: {mode!r} (attendu: {', '.join(INGEST_MODES)})")
+        if mode == "shared" and (not share_group or any(c in share_group for c in "/+#")):
+            raise ValueError(f"MQTT_SHARE_GROUP invalide: {share_group!r}")
+        if mode == "shared" and not share_by_topic:
+            raise ValueError(
+                "MQTT_INGEST_MODE=shared disperse les messages d'un device entre workers (état par véhicule, "
+                "ordre des messages): utiliser MQTT_INGEST_MODE=partition, ou un broker qui répartit par topic "
+                "et MQTT_SHARE_BY_TOPIC=true"
+            )
+        try:
+            partition_index = int(partition_index)
+        except (TypeError, ValueError):
+            raise ValueError(f"MQTT_PARTITION_INDEX invalide: {partition_index!r} (entier attendu)") from None
+        if mode == "partition" and not 0 <= partition_index < partition_count:
+            raise ValueError(
+                f"MQTT_PARTITION_INDEX={partition_index} hors de [0, MQTT_PARTITION_COUNT={partition_count}["
+            )
+        self.mode = mode
+        self.share_group = share_group
+        self.share_by_topic = share_by_topic
+        self.partition_index = partition_index
+        self.partition_count = partition_count
+        self.lock_dir = lock_dir
+        self.error: Optional[str] = None  # configuration invalide (scaling_from_env)
+        self._lock_file: Optional[IO[str]] = None
+        self.skipped = 0  # messages d'autres partitions (thread paho uniquement)
+
+    def start(self) -> None:
+        """
+        Vérifications au démarrage de l'ingestion (et non à l'import).
+
+        Raises:
+            ValueError: configuration invalide
+            RuntimeError: partition déjà ingérée par un autre processus de cet hôte
+        """
+        if self.error:
+            raise ValueError(self.error)
+        if self.mode != "partition" or self.partition_count == 1 or fcntl is None or self._lock_file is not None:
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.lock_dir, f"partition-{self.partition_index}.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(
+                f"MQTT_PARTITION_INDEX={self.partition_index} déjà ingérée par un autre processus de cet hôte "
+                "(uvicorn --workers ?): une unité par index"
+            ) from None
+        self._lock_file = lock_file  # gardé ouvert: verrou libéré à l'arrêt du processus
+
+    def stop(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def protocol(self) -> int:
+        # Les abonnements partagés sont normalisés en MQTT v5
+        return mqtt.MQTTv5 if self.mode == "shared" else mqtt.MQTTv311
+
+    def subscriptions(self, topics: List[str]) -> List[str]:
+        """Filtres effectivement envoyés au broker"""
+        if self.mode == "shared":
+            return [f"$share/{self.share_group}/{topic}" for topic in topics]
+        if self.mode == "partition" and self.partition_count > 1:
+            # Topics exacts: ne souscrire qu'à ceux de cette partition (les jokers restent filtrés par owns)
+            return [
+                topic for topic in topics
+                if "+" in topic or "#" in topic
+                or topic_partition(topic, self.partition_count) == self.partition_index
+            ]
+        return list(topics)
+
+    def owns(self, topic: str) -> bool:
+        """True si ce processus doit traiter les messages de ce topic"""
+        if self.mode != "partition" or self.partition_count == 1:
+            return True
+        if topic_partition(topic, self.partition_count) == self.partition_index:
+            return True
+        self.skipped += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"mode": self.mode}
+        if self.error:
+            stats["error"] = self.error
+            return stats
+        if self.mode == "shared":
+            stats.update(share_group=self.share_group, share_by_topic=self.share_by_topic)
+        elif self.mode == "partition":
+            stats.update(
+                partition_index=self.partition_index,
+                partition_count=self.partition_count,
+                skipped=self.skipped,
+            )
+        return stats
+
+
+def create_client(scaling: MqttScaling, client_id: Optional[str] = None) -> mqtt.Client:
+    """Client paho configuré pour le mode de répartition (callbacks API v2, paho-mqtt >= 2.0)"""
+    return mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        client_id=client_id or build_client_id(),
+        protocol=scaling.protocol,
+    )
+
+
+def scaling_from_env() -> MqttScaling:
+    """Configuration de l'environnement; une erreur est conservée et signalée au démarrage (start)"""
+    try:
+        return MqttScaling(
+            mode=MQTT_INGEST_MODE,
+            share_group=MQTT_SHARE_GROUP,
+            share_by_topic=MQTT_SHARE_BY_TOPIC,
+            partition_index=MQTT_PARTITION_INDEX,
+            partition_count=MQTT_PARTITION_COUNT,
+            lock_dir=MQTT_PARTITION_LOCK_DIR,
+        )
+    except ValueError as e:
+        scaling = MqttScaling(mode="single", partition_index=0, partition_count=1)
+        scaling.mode = MQTT_INGEST_MODE
+        scaling.error = str(e)
+        return scaling
+
+
+# Instance globale
+mqtt_scaling = scaling_from_env()
@@ -0,0 +1,163 @@
+"""
+Planification des sauvegardes télémétrie, par véhicule
+
+Remplace l'ancien throttling global (`last_save_time`) qui ne laissait passer
+qu'une seule ligne toutes les 5s pour toute la flotte. Chaque véhicule a désormais
+sa propre cadence, et les échantillons reçus entre deux sauvegardes peuvent être
+agrégés (min/max/moyenne par PID) dans la ligne enregistrée.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .telemetry_state import COLUMN_INDEX, TELEMETRY_COLUMNS, VehicleState
+
+# === CONFIGURATION ===
+TELEMETRY_SAVE_INTERVAL = float(os.getenv("TELEMETRY_SAVE_INTERVAL", "5"))  # secondes, par véhicule
+TELEMETRY_SAVE_AGGREGATE = os.getenv("TELEMETRY_SAVE_AGGREGATE", "false").lower() in ("1", "true", "yes")
+
+# Champs d'état / compteurs / bitmasks: la dernière valeur a du sens, pas la moyenne
+NON_AGGREGATED_FIELDS = frozenset({
+    "monitor_status",
+    "oxygen_sensors_present_banks",
+    "obd_standard",
+    "time_since_engine_start",
+    "pids_supported_21_40",
+    "pids_supported_41_60",
+    "pids_supported_61_80",
+    "pids_supported_81_a0",
+    "distance_mil_on",
+    "warmups_since_code_clear",
+    "distance_since_code_clear",
+    "monitor_status_drive_cycle",
+    "diesel_aftertreatment",
+})
+
+AGGREGATED_FIELDS = tuple(name for name in TELEMETRY_COLUMNS if name not in NON_AGGREGATED_FIELDS)
+_AGGREGATED_INDEXES = frozenset(COLUMN_INDEX[name] for name in AGGREGATED_FIELDS)
+
+
+class SampleAggregator:
+    """Accumulateur min/max/somme/nombre par colonne entre deux sauvegardes"""
+
+    __slots__ = ("mins", "maxs", "sums", "counts", "samples")
+
+    def __init__(self):
+        size = len(TELEMETRY_COLUMNS)
+        self.mins: List[Optional[float]] = [None] * size
+        self.maxs: List[Optional[float]] = [None] * size
+        self.sums = [0.0] * size
+        self.counts = [0] * size
+        self.samples = 0
+
+    def add(self, values: List[Any], indexes: Iterable[int]) -> None:
+        self.samples += 1
+        mins, maxs, sums, counts = self.mins, self.maxs, self.sums, self.counts
+        for index in indexes:
+            if index not in _AGGREGATED_INDEXES:
+                continue
+            value = values[index]
+            if value is None or isinstance(value, (str, bool)):
+                continue
+            if counts[index] == 0:
+                mins[index] = maxs[index] = value
+            else:
+                if value < mins[index]:
+                    mins[index] = value
+                if value > maxs[index]:
+                    maxs[index] = value
+            sums[index] += value
+            counts[index] += 1
+
+    def apply(self, row: Dict[str, Any]) -> None:
+        """Remplace les valeurs analogiques par leur moyenne et ajoute le détail min/max"""
+        aggregates = {}
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            name = TELEMETRY_COLUMNS[index]
+            mean = self.sums[index] / count
+            row[name] = round(mean, 4)
+            aggregates[name] = {
+                "min": self.mins[index],
+                "max": self.maxs[index],
+                "mean": round(mean, 4),
+                "count": count,
+            }
+        row["sample_count"] = self.samples
+        row["aggregates"] = aggregates
+
+
+class PersistenceScheduler:
+    """Décide, véhicule par véhicule, quand une ligne doit être persistée"""
+
+    def __init__(
+        self,
+        interval: float = TELEMETRY_SAVE_INTERVAL,
+        aggregate: bool = TELEMETRY_SAVE_AGGREGATE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.interval = interval
+        self.aggregate = aggregate
+        self._clock = clock
+        self._last_save: Dict[int, float] = {}
+        self._aggregators: Dict[int, SampleAggregator] = {}
+        self._lock = threading.Lock()
+        self.samples_seen = 0
+        self.rows_emitted = 0
+
+    def observe(self, state: VehicleState, updated_indexes: Iterable[int]) -> bool:
+        """
+        Enregistre un échantillon (appelé sous state.lock après mise à jour des valeurs).
+
+        Args:
+            updated_indexes: index (dans TELEMETRY_COLUMNS) des colonnes reçues dans ce message
+
+        Returns:
+            True si la cadence de sauvegarde de ce véhicule est atteinte
+        """
+        vehicle_id = state.vehicle_id
+        now = self._clock()
+        with self._lock:
+            self.samples_seen += 1
+            if self.aggregate:
+                aggregator = self._aggregators.get(vehicle_id)
+                if aggregator is None:
+                    aggregator = self._aggregators[vehicle_id] = SampleAggregator()
+                aggregator.add(state.values, updated_indexes)
+
+            last = self._last_save.get(vehicle_id)
+            if last is not None and now - last < self.interval:
+                return False
+            self._last_save[vehicle_id] = now
+            return True
+
+    def build_row(self, state: VehicleState) -> Dict[str, Any]:
+        """Ligne à persister (appelé sous state.lock); réinitialise l'agrégation du véhicule"""
+        row = state.to_row()
+        if self.aggregate:
+            with self._lock:
+                aggregator = self._aggregators.pop(state.vehicle_id, None)
+            if aggregator is not None:
+                aggregator.apply(row)
+        with self._lock:
+            self.rows_emitted += 1
+        return row
+
+    def forget(self, vehicle_id: int) -> None:
+        with self._lock:
+            self._last_save.pop(vehicle_id, None)
+            self._aggregators.pop(vehicle_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "aggregate": self.aggregate,
+            "vehicles": len(self._last_save),
+            "samples_seen": self.samples_seen,
+            "rows_emitted": self.rows_emitted,
+        }
+
+
+persistence_scheduler = PersistenceScheduler()
@@ -0,0 +1,156 @@
+"""
+Décodage compilé des payloads MQTT OBD-II
+
+Le filtre de topic et la table des PIDs sont préparés une seule fois à l'import:
+chaque clé PID est associée à l'index de sa colonne (voir telemetry_state.py) et à
+un convertisseur typé. Un payload est décodé en une seule passe directement dans
+la liste de valeurs du véhicule; les PIDs inconnus sont comptés, pas listés.
+"""
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from .telemetry_state import COLUMN_INDEX
+
+# Topics acceptés: wincan/device1, wincan/device2, ...
+DEVICE_TOPIC_PATTERN = re.compile(r"wincan/device\d+")
+
+# Mapping des PIDs OBD-II reçus vers les noms de colonnes de la BDD
+# Format reçu: wincan/device1 → {"01-MonitorStatus":0, "04-CalcEngineLoad":79.61, ...}
+PID_TO_COLUMN_MAPPING = {
+    # PIDs essentiels
+    "01-MonitorStatus": "monitor_status",
+    "04-CalcEngineLoad": "engine_load",
+    "05-EngineCoolantTemp": "coolant_temperature",
+    "0B-IntakeManiAbsPress": "intake_pressure",
+    "0C-EngineRPM": "rpm",
+    "0D-VehicleSpeed": "vehicle_speed",
+    "0F-IntakeAirTemperature": "intake_air_temp",
+    "10-MAFAirFlowRate": "maf_airflow",
+    "11-ThrottlePosition": "throttle_position",
+
+    # PIDs étendus
+    "13-OxySensorsPresent_2Banks": "oxygen_sensors_present_banks",
+    "1C-OBDStandard": "obd_standard",
+    "1F-TimeSinceEngStart": "time_since_engine_start",
+    "20-PIDsSupported_21_40": "pids_supported_21_40",
+    "21-DistanceMILOn": "distance_mil_on",
+    "23-FuelRailGaug": "fuel_rail_pressure",
+    "24-OxySensor1_FAER": "oxygen_sensor1_faer",
+    "24-OxySensor1_Volt": "oxygen_sensor1_voltage",
+    "25-OxySensor2_FAER": "oxygen_sensor2_faer",
+    "30-WarmUpsSinceCodeClear": "warmups_since_code_clear",
+    "31-DistanceSinceCodeClear": "distance_since_code_clear",
+    "33-AbsBaroPres": "absolute_barometric_pressure",
+    "40-PIDsSupported_41_60": "pids_supported_41_60",
+    "41-MonStatusDriveCycle": "monitor_status_drive_cycle",
+    "42-ControlModuleVolt": "control_module_voltage",
+    "45-RelThrottlePos": "relative_throttle_position",
+    "46-AmbientAirTemp": "ambient_air_temperature",
+    "49-AbsThrottlePosD": "abs_throttle_position_d",
+    "4A-AbsThrottlePosE": "abs_throttle_position_e",
+    "4C-CmdThrottleAct": "commanded_throttle_actuator",
+    "4F-Max_FAER": "max_faer",
+    "4F-Max_OxySensVol": "max_oxy_sensor_voltage",
+    "4F-Max_OxySensCrnt": "max_oxy_sensor_current",
+    "4F-Max_IntManiAbsPres": "max_intake_pressure",
+    "60-PIDsSupported_61_80": "pids_supported_61_80",
+    "67-EngineCoolantTemp1": "engine_coolant_temp1",
+    "67-EngineCoolantTemp2": "engine_coolant_temp2",
+    "69-CmdEGR_EGRError": "egr_commanded_error",
+    "77-ChargeAirCoolerTemperature": "charge_air_cooler_temp",
+    "78-EGT_Bank1": "egt_bank1",
+    "80-PIDsSupported_81_A0": "pids_supported_81_a0",
+    "8B-DieselAftertreatment": "diesel_aftertreatment"
+}
+
+# Colonnes entières (INTEGER en BDD, ou codes/bitmasks transmis en entier)
+INTEGER_COLUMNS = frozenset({
+    "monitor_status",
+    "oxygen_sensors_present_banks",
+    "obd_standard",
+    "time_since_engine_start",
+    "pids_supported_21_40",
+    "pids_supported_41_60",
+    "pids_supported_61_80",
+    "pids_supported_81_a0",
+    "warmups_since_code_clear",
+    "monitor_status_drive_cycle",
+    "diesel_aftertreatment",
+})
+
+_NUMBER_TYPES = (int, float)
+
+
+def _to_float(value: Any) -> Any:
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return value  # Garder comme texte
+
+
+def _to_int(value: Any) -> Any:
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return _to_float(value)
+
+
+def compile_pid_table(mapping: Dict[str, str]) -> Dict[str, Tuple[int, Callable[[Any], Any]]]:
+    """Construit {clé PID: (index colonne, convertisseur)} à partir du mapping PID → colonne"""
+    return {
+        pid_key: (COLUMN_INDEX[column], _to_int if column in INTEGER_COLUMNS else _to_float)
+        for pid_key, column in mapping.items()
+    }
+
+
+PID_TABLE = compile_pid_table(PID_TO_COLUMN_MAPPING)
+
+
+def is_device_topic(topic: str) -> bool:
+    """True pour wincan/deviceN (les topics individuels comme wincan/OxyCrnt sont ignorés)"""
+    return DEVICE_TOPIC_PATTERN.fullmatch(topic) is not None
+
+
+class PidDecoder:
+    """Décode un payload JSON déjà parsé dans un enregistrement à disposition fixe"""
+
+    def __init__(self, table: Dict[str, Tuple[int, Callable[[Any], Any]]] = PID_TABLE):
+        self.table = table
+        self.unmapped: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def decode_into(self, data: Dict[str, Any], values: List[Any]) -> Tuple[List[int], int]:
+        """
+        Écrit les PIDs connus de `data` dans `values` (une seule passe).
+
+        Returns:
+            (index des colonnes mises à jour, nombre de PIDs non mappés)
+        """
+        table_get = self.table.get
+        updated = []
+        unmapped = None
+        for pid_key, value in data.items():
+            entry = table_get(pid_key)
+            if entry is None:
+                if unmapped is None:
+                    unmapped = []
+                unmapped.append(pid_key)
+                continue
+            index, convert = entry
+            # Chemin rapide: les valeurs numériques JSON sont déjà typées
+            values[index] = value if type(value) in _NUMBER_TYPES else convert(value)
+            updated.append(index)
+        if unmapped is None:
+            return updated, 0
+        with self._lock:
+            self.unmapped.update(unmapped)
+        return updated, len(unmapped)
+
+    def unmapped_stats(self, top: int = 20) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.unmapped.most_common(top))
+
+
+pid_decoder = PidDecoder()
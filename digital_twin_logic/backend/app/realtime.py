@@ -1,34 +1,360 @@
-from typing import List
-from fastapi import WebSocket
+"""
+Connexions WebSocket du dashboard (/ws/telemetry) et abonnements par véhicule
+
+Un client déclare les véhicules suivis (paramètre `vehicle_id=1,2` à la
+connexion, ou messages {"type": "subscribe" | "unsubscribe", "vehicle_ids": [...]});
+sans déclaration il reçoit tous les véhicules (comportement historique).
+L'index véhicule → connexions limite chaque diffusion aux clients intéressés.
+
+Envoi: chaque connexion a sa file bornée et sa tâche d'écriture. broadcast()
+ne fait que déposer le message dans les files (aucune attente réseau), donc
+un navigateur lent ne retarde ni les autres clients ni l'ingestion:
+- file pleine: le plus ancien message est abandonné (drop_oldest), ou, en mode
+  coalesce, un message de même clé (ex. état d'un véhicule) remplace celui en
+  attente au lieu de s'y ajouter
+- un envoi en échec ou bloqué plus de WS_SEND_TIMEOUT secondes évince le client
+
+Protocole (?protocol=full | delta, voir telemetry_delta.py): en mode delta, un
+message d'état perdu (file pleine) ou remplacé avant envoi marque le véhicule
+à resynchroniser: la diffusion suivante lui envoie un snapshot au lieu d'un delta.
+
+Encodage (json ou msgpack, voir ws_frames.py): les messages sont des Frame
+encodées au plus une fois par encodage, quel que soit le nombre de clients.
+"""
 import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+from fastapi import WebSocket
+
+from .ws_frames import Frame, FrameCache
+
+# === CONFIGURATION ===
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "32"))  # messages en attente par client
+WS_SEND_POLICY = os.getenv("WS_SEND_POLICY", "coalesce").lower()  # coalesce ou drop_oldest
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # secondes
+
+SEND_POLICIES = ("coalesce", "drop_oldest")
+PROTOCOLS = ("full", "delta")
+
+ALL_VEHICLES = "*"
+
+
+def parse_vehicle_ids(value) -> Optional[Set[int]]:
+    """
+    "1,2" / [1, 2] → {1, 2}; None, "" ou "*" → None (tous les véhicules)
+
+    Raises:
+        ValueError: identifiant non entier
+    """
+    if value is None or value == ALL_VEHICLES or value == "":
+        return None
+    if isinstance(value, str):
+        value = [part for part in value.split(",") if part.strip()]
+    if isinstance(value, (int, str)):
+        value = [value]
+    try:
+        return {int(vehicle_id) for vehicle_id in value}
+    except (TypeError, ValueError):
+        raise ValueError(f"vehicle_ids invalide: {value!r}") from None
+
+
+def parse_protocol(value: Optional[str]) -> str:
+    protocol = (value or "full").lower()
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"protocol inconnu: {value} (attendu: {', '.join(PROTOCOLS)})")
+    return protocol
+
+
+Message = Union[str, bytes, Dict[str, Any], Frame]
+
+
+def as_frame(message: Message) -> Any:
+    """dict → Frame (encodée selon chaque client); str / bytes: envoyés tels quels"""
+    return Frame(message) if isinstance(message, dict) else message
+
+
+class ClientConnection:
+    """File d'envoi bornée + tâche d'écriture d'un client WebSocket"""
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SEND_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        protocol: str = "full",
+        encoding: str = "json",
+    ):
+        if policy not in SEND_POLICIES:
+            raise ValueError(f"WS_SEND_POLICY inconnue: {policy} (attendu: {', '.join(SEND_POLICIES)})")
+        self.id = next(self._ids)
+        self.websocket = websocket
+        self.queue_size = max(queue_size, 1)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.protocol = protocol
+        self.encoding = encoding
+        # clé → (message, date de mise en file, véhicule si message d'état delta); ordre = ordre d'envoi
+        self._pending: "OrderedDict[Hashable, Tuple[Any, float, Optional[int]]]" = OrderedDict()
+        self.stale: Set[int] = set()  # véhicules à resynchroniser (protocole delta)
+        self._unkeyed = itertools.count()
+        self._ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.resyncs = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def enqueue(self, message: Any, key: Optional[Hashable] = None, vehicle_id: Optional[int] = None) -> None:
+        """
+        Dépose un message (sans attente); key: messages remplaçables entre eux (mode coalesce).
+        vehicle_id: message d'état du protocole delta, sa perte impose un snapshot.
+        """
+        if isinstance(message, Frame):
+            message = message.encode(self.encoding)
+        if key is not None and self.policy == "coalesce" and key in self._pending:
+            # Même position dans la file et même date: le retard mesuré reste celui du premier
+            self._pending[key] = (message, self._pending[key][1], vehicle_id)
+            self.coalesced += 1
+            return
+        if len(self._pending) >= self.queue_size:
+            _, (_, _, lost_vehicle) = self._pending.popitem(last=False)
+            if lost_vehicle is not None:
+                self.stale.add(lost_vehicle)
+            self.dropped += 1
+        if key is None or self.policy != "coalesce":
+            key = ("_", next(self._unkeyed))
+        self._pending[key] = (message, time.monotonic(), vehicle_id)
+        self._ready.set()
+
+    def enqueue_update(self, vehicle_id: int, key: Hashable, delta: Frame, snapshot: Frame) -> None:
+        """Protocole delta: delta si le client suit la séquence, sinon snapshot"""
+        if vehicle_id in self.stale or (self.policy == "coalesce" and key in self._pending):
+            # Delta perdu, ou message d'état encore en attente: le snapshot le remplace
+            self.stale.discard(vehicle_id)
+            self.resyncs += 1
+            self.enqueue(snapshot, key, vehicle_id)
+        else:
+            self.enqueue(delta, key, vehicle_id)
+
+    def enqueue_snapshot(self, vehicle_id: int, key: Hashable, snapshot: Frame) -> None:
+        self.stale.discard(vehicle_id)
+        self.enqueue(snapshot, key, vehicle_id)
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    async def _send(self, message: Any) -> None:
+        if isinstance(message, bytes):
+            await self.websocket.send_bytes(message)
+        else:
+            await self.websocket.send_text(message)
+
+    async def run(self) -> None:
+        """Boucle d'écriture; se termine (exception) au premier envoi en échec ou trop lent"""
+        while True:
+            await self._ready.wait()
+            while self._pending:
+                _, (message, enqueued_at, _) = self._pending.popitem(last=False)
+                await asyncio.wait_for(self._send(message), self.send_timeout)
+                self.sent += 1
+                self.last_lag = time.monotonic() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+            self._ready.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "protocol": self.protocol,
+            "encoding": self.encoding,
+            "queued": self.queued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "resyncs": self.resyncs,
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "connected_s": round(time.time() - self.connected_at, 1),
+        }
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self._lock = asyncio.Lock()
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SEND_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT,
+    ):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self._clients: Dict[WebSocket, ClientConnection] = {}
+        # Abonnements: None = tous les véhicules
+        self._subscriptions: Dict[WebSocket, Optional[Set[int]]] = {}
+        self._by_vehicle: Dict[int, Set[WebSocket]] = {}
+        self._all_vehicles: Set[WebSocket] = set()
+        self.evicted = 0
+        self.frames = FrameCache()
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self._clients)
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        vehicle_ids: Optional[Iterable[int]] = None,
+        protocol: str = "full",
+        encoding: str = "json",
+        subprotocol: Optional[str] = None,
+    ):
+        await websocket.accept(subprotocol=subprotocol)
+        client = ClientConnection(websocket, self.queue_size, self.policy, self.send_timeout, protocol, encoding)
+        self._clients[websocket] = client
+        self._subscriptions[websocket] = set()
+        self._set(websocket, None if vehicle_ids is None else set(vehicle_ids))
+        client.task = asyncio.create_task(self._write(client))
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        async with self._lock:
-            self.active_connections.append(websocket)
+    async def _write(self, client: ClientConnection) -> None:
+        try:
+            await client.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Pair mort ou bloqué: retiré des diffusions, socket fermée
+            if self._remove(client.websocket) is not None:
+                self.evicted += 1
+            try:
+                await client.websocket.close(code=1011)
+            except Exception:
+                pass
+
+    def _remove(self, websocket: WebSocket) -> Optional[ClientConnection]:
+        self._unindex(websocket)
+        self._subscriptions.pop(websocket, None)
+        return self._clients.pop(websocket, None)
 
     async def disconnect(self, websocket: WebSocket):
-        async with self._lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str):
-        async with self._lock:
-            for connection in list(self.active_connections):
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    # ignore broken connections, remove later
-                    pass
+        client = self._remove(websocket)
+        if client is not None and client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def _unindex(self, websocket: WebSocket) -> None:
+        self._all_vehicles.discard(websocket)
+        for vehicle_id in self._subscriptions.get(websocket) or ():
+            subscribers = self._by_vehicle.get(vehicle_id)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self._by_vehicle[vehicle_id]
+
+    def _set(self, websocket: WebSocket, vehicle_ids: Optional[Set[int]]) -> None:
+        self._unindex(websocket)
+        self._subscriptions[websocket] = vehicle_ids
+        if vehicle_ids is None:
+            self._all_vehicles.add(websocket)
+            return
+        for vehicle_id in vehicle_ids:
+            self._by_vehicle.setdefault(vehicle_id, set()).add(websocket)
+
+    async def subscribe(self, websocket: WebSocket, vehicle_ids: Optional[Iterable[int]]) -> Optional[Set[int]]:
+        """Ajoute des véhicules (None: tous); retourne l'abonnement résultant"""
+        if websocket not in self._subscriptions:
+            return set()
+        current = self._subscriptions[websocket]
+        if vehicle_ids is None or current is None:
+            self._set(websocket, None)
+        else:
+            self._set(websocket, current | set(vehicle_ids))
+        return self._subscriptions[websocket]
+
+    async def unsubscribe(self, websocket: WebSocket, vehicle_ids: Optional[Iterable[int]]) -> Optional[Set[int]]:
+        """Retire des véhicules (None: tous, le client ne reçoit plus rien)"""
+        if websocket not in self._subscriptions:
+            return set()
+        current = self._subscriptions[websocket]
+        if vehicle_ids is None:
+            self._set(websocket, set())
+        elif current is not None:
+            self._set(websocket, current - set(vehicle_ids))
+        return self._subscriptions[websocket]
+
+    def subscriptions(self, websocket: WebSocket) -> Optional[Set[int]]:
+        return self._subscriptions.get(websocket, set())
+
+    def protocol(self, websocket: WebSocket) -> str:
+        client = self._clients.get(websocket)
+        return client.protocol if client is not None else "full"
+
+    def encoding(self, websocket: WebSocket) -> str:
+        client = self._clients.get(websocket)
+        return client.encoding if client is not None else "json"
+
+    def recipients(self, vehicle_id: Optional[int] = None) -> List[WebSocket]:
+        """Connexions concernées par un véhicule (None: toutes)"""
+        if vehicle_id is None:
+            return list(self._clients)
+        return list(self._all_vehicles | self._by_vehicle.get(vehicle_id, set()))
+
+    async def send_personal_message(self, message: Message, websocket: WebSocket):
+        """Message pour un seul client, via sa file (ordre conservé avec les diffusions)"""
+        client = self._clients.get(websocket)
+        if client is not None:
+            client.enqueue(as_frame(message))
+
+    async def broadcast(self, message: Message, vehicle_id: Optional[int] = None, key: Optional[Hashable] = None):
+        """
+        Dépose le message dans la file des abonnés du véhicule (vehicle_id=None: tous les clients).
+        key: un message en attente de même clé est remplacé (état courant d'un véhicule).
+        """
+        message = as_frame(message)
+        for websocket in self.recipients(vehicle_id):
+            client = self._clients.get(websocket)
+            if client is not None:
+                client.enqueue(message, key)
+
+    async def send_snapshot(self, websocket: WebSocket, vehicle_id: int, message: Message):
+        """Snapshot d'un véhicule pour un client delta (remplace un état en attente)"""
+        client = self._clients.get(websocket)
+        if client is not None:
+            client.enqueue_snapshot(vehicle_id, ("telemetry", vehicle_id), as_frame(message))
+
+    async def broadcast_update(self, vehicle_id: int, full: Frame, delta: Frame, snapshot: Frame):
+        """
+        État d'un véhicule pour ses abonnés: full (message complet historique) ou, en
+        protocole delta, delta / snapshot. Chaque forme n'est construite et encodée que si un client en a besoin.
+        """
+        key = ("telemetry", vehicle_id)
+        for websocket in self.recipients(vehicle_id):
+            client = self._clients.get(websocket)
+            if client is None:
+                continue
+            if client.protocol == "delta":
+                client.enqueue_update(vehicle_id, key, delta, snapshot)
+            else:
+                client.enqueue(full, key)
+
+    def stats(self):
+        clients = list(self._clients.values())
+        return {
+            "connections": len(clients),
+            "all_vehicles": len(self._all_vehicles),
+            "vehicles": {vehicle_id: len(subscribers) for vehicle_id, subscribers in self._by_vehicle.items()},
+            "policy": self.policy,
+            "evicted": self.evicted,
+            "dropped": sum(client.dropped for client in clients),
+            "frame_cache": self.frames.stats(),
+            "clients": [client.stats() for client in clients],
+        }
 
 
 manager = ConnectionManager()
@@ -12,10 +12,13 @@ Endpoints:
 - POST /assignments - Créer un nouvel assignment
 - PUT /assignments/{assignment_id}/deactivate - Désactiver un assignment
 """
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
 from datetime import datetime
-from ..database import get_supabase, get_device_by_topic, get_active_vehicle_for_device, get_all_active_assignments
+from ..database import get_active_vehicle_for_device_async, get_all_active_assignments_async
+from ..storage import StorageBackend, get_storage
+from ..device_cache import invalidate_device
+from ..subscriptions import schedule_subscription_resync
 from ..models import (
     Device, DeviceCreate,
     VehicleDeviceAssignment, VehicleDeviceAssignmentCreate,
@@ -29,7 +32,7 @@ router = APIRouter(prefix="/api", tags=["devices"])
 # ============================================================================
 
 @router.get("/devices", response_model=List[Device])
-async def list_devices(status: str = None):
+async def list_devices(status: str = None, storage: StorageBackend = Depends(get_storage)):
     """
     Liste tous les devices OBD-II.
     
@@ -37,14 +40,7 @@ async def list_devices(status: str = None):
         status: Filtrer par status (active, inactive, maintenance)
     """
     try:
-        supabase = get_supabase()
-        query = supabase.table("devices").select("*")
-        
-        if status:
-            query = query.eq("status", status)
-        
-        result = query.execute()
-        return result.data
+        return await storage.select("devices", eq={"status": status} if status else None)
         
     except Exception as e:
         raise HTTPException(
@@ -54,7 +50,7 @@ async def list_devices(status: str = None):
 
 
 @router.post("/devices", response_model=Device, status_code=status.HTTP_201_CREATED)
-async def create_device(device: DeviceCreate):
+async def create_device(device: DeviceCreate, storage: StorageBackend = Depends(get_storage)):
     """
     Créer un nouveau device OBD-II.
     
@@ -65,29 +61,31 @@ async def create_device(device: DeviceCreate):
         status: active (default), inactive, maintenance
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le device_code n'existe pas déjà
-        existing = supabase.table("devices").select("id").eq("device_code", device.device_code).execute()
-        if existing.data:
+        existing = await storage.select("devices", "id", eq={"device_code": device.device_code})
+        if existing:
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Device avec le code '{device.device_code}' existe déjà"
             )
         
         # Vérifier que le mqtt_topic n'existe pas déjà
-        existing = supabase.table("devices").select("id").eq("mqtt_topic", device.mqtt_topic).execute()
-        if existing.data:
+        existing = await storage.select("devices", "id", eq={"mqtt_topic": device.mqtt_topic})
+        if existing:
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Device avec le topic '{device.mqtt_topic}' existe déjà"
             )
         
         # Créer le device
-        result = supabase.table("devices").insert(device.dict()).execute()
+        result = await storage.insert("devices", device.dict())
         
-        if result.data:
-            return result.data[0]
+        # Le topic a pu être mis en cache comme inconnu
+        invalidate_device(topic=device.mqtt_topic)
+        schedule_subscription_resync()
+        
+        if result:
+            return result[0]
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -104,19 +102,18 @@ async def create_device(device: DeviceCreate):
 
 
 @router.get("/devices/{device_id}", response_model=Device)
-async def get_device(device_id: int):
+async def get_device(device_id: int, storage: StorageBackend = Depends(get_storage)):
     """Récupérer les détails d'un device spécifique."""
     try:
-        supabase = get_supabase()
-        result = supabase.table("devices").select("*").eq("id", device_id).execute()
+        result = await storage.select("devices", eq={"id": device_id})
         
-        if not result.data:
+        if not result:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device ID {device_id} non trouvé"
             )
         
-        return result.data[0]
+        return result[0]
         
     except HTTPException:
         raise
@@ -128,7 +125,7 @@ async def get_device(device_id: int):
 
 
 @router.put("/devices/{device_id}", response_model=Device)
-async def update_device(device_id: int, device: DeviceCreate):
+async def update_device(device_id: int, device: DeviceCreate, storage: StorageBackend = Depends(get_storage)):
     """
     Modifier un device existant.
     
@@ -140,11 +137,9 @@ async def update_device(device_id: int, device: DeviceCreate):
           (car ils sont des clés uniques critiques)
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le device existe
-        existing = supabase.table("devices").select("*").eq("id", device_id).execute()
-        if not existing.data:
+        existing = await storage.select("devices", eq={"id": device_id})
+        if not existing:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device ID {device_id} non trouvé"
@@ -157,10 +152,12 @@ async def update_device(device_id: int, device: DeviceCreate):
             "updated_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("devices").update(update_data).eq("id", device_id).execute()
+        result = await storage.update("devices", update_data, eq={"id": device_id})
+        invalidate_device(device_id=device_id, topic=existing[0].get("mqtt_topic"))
+        schedule_subscription_resync()
         
-        if result.data:
-            return result.data[0]
+        if result:
+            return result[0]
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -177,7 +174,7 @@ async def update_device(device_id: int, device: DeviceCreate):
 
 
 @router.delete("/devices/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_device(device_id: int):
+async def delete_device(device_id: int, storage: StorageBackend = Depends(get_storage)):
     """
     Supprimer un device.
     
@@ -185,18 +182,18 @@ async def delete_device(device_id: int):
     Les télémétries existantes auront device_id=NULL.
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le device existe
-        existing = supabase.table("devices").select("id").eq("id", device_id).execute()
-        if not existing.data:
+        existing = await storage.select("devices", "id, mqtt_topic", eq={"id": device_id})
+        if not existing:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device ID {device_id} non trouvé"
             )
         
         # Supprimer le device (CASCADE sur assignments)
-        supabase.table("devices").delete().eq("id", device_id).execute()
+        await storage.delete("devices", eq={"id": device_id})
+        invalidate_device(device_id=device_id, topic=existing[0].get("mqtt_topic"))
+        schedule_subscription_resync()
         
         return None
         
@@ -214,14 +211,14 @@ async def delete_device(device_id: int):
 # ============================================================================
 
 @router.get("/assignments/active")
-async def list_active_assignments():
+async def list_active_assignments(storage: StorageBackend = Depends(get_storage)):
     """
     Liste tous les assignments actifs (device → véhicule).
     
     Retourne les détails complets: device, véhicule, dates, etc.
     """
     try:
-        assignments = get_all_active_assignments()
+        assignments = await get_all_active_assignments_async(storage)
         return {
             "count": len(assignments),
             "assignments": assignments
@@ -235,14 +232,14 @@ async def list_active_assignments():
 
 
 @router.get("/assignments/device/{device_id}")
-async def get_device_assignment(device_id: int):
+async def get_device_assignment(device_id: int, storage: StorageBackend = Depends(get_storage)):
     """
     Récupérer l'assignment actif d'un device spécifique.
     
     Retourne les détails du véhicule associé, ou 404 si aucun assignment actif.
     """
     try:
-        assignment = get_active_vehicle_for_device(device_id)
+        assignment = await get_active_vehicle_for_device_async(device_id, storage)
         
         if not assignment:
             raise HTTPException(
@@ -262,7 +259,7 @@ async def get_device_assignment(device_id: int):
 
 
 @router.post("/assignments", response_model=VehicleDeviceAssignment, status_code=status.HTTP_201_CREATED)
-async def create_assignment(assignment: VehicleDeviceAssignmentCreate):
+async def create_assignment(assignment: VehicleDeviceAssignmentCreate, storage: StorageBackend = Depends(get_storage)):
     """
     Créer un nouvel assignment device → véhicule.
     
@@ -276,36 +273,35 @@ async def create_assignment(assignment: VehicleDeviceAssignmentCreate):
           automatiquement désactivé (via trigger SQL).
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le véhicule existe
-        vehicle = supabase.table("cars").select("id, name").eq("id", assignment.vehicle_id).execute()
-        if not vehicle.data:
+        vehicle = await storage.select("cars", "id, name", eq={"id": assignment.vehicle_id})
+        if not vehicle:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Véhicule ID {assignment.vehicle_id} non trouvé"
             )
         
         # Vérifier que le device existe
-        device = supabase.table("devices").select("id, device_code, status").eq("id", assignment.device_id).execute()
-        if not device.data:
+        device = await storage.select("devices", "id, device_code, status", eq={"id": assignment.device_id})
+        if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device ID {assignment.device_id} non trouvé"
             )
         
         # Vérifier que le device est actif
-        if device.data[0]['status'] != 'active':
+        if device[0]['status'] != 'active':
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Device {device.data[0]['device_code']} n'est pas actif (status: {device.data[0]['status']})"
+                detail=f"Device {device[0]['device_code']} n'est pas actif (status: {device[0]['status']})"
             )
         
         # Créer l'assignment
-        result = supabase.table("vehicle_device_assignment").insert(assignment.dict()).execute()
+        result = await storage.insert("vehicle_device_assignment", assignment.dict())
+        invalidate_device(device_id=assignment.device_id)
         
-        if result.data:
-            return result.data[0]
+        if result:
+            return result[0]
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -322,24 +318,22 @@ async def create_assignment(assignment: VehicleDeviceAssignmentCreate):
 
 
 @router.put("/assignments/{assignment_id}/deactivate")
-async def deactivate_assignment(assignment_id: int):
+async def deactivate_assignment(assignment_id: int, storage: StorageBackend = Depends(get_storage)):
     """
     Désactiver un assignment (débrancher un device).
     
     Met is_active=FALSE et enregistre unassigned_at=NOW().
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que l'assignment existe et est actif
-        existing = supabase.table("vehicle_device_assignment").select("*").eq("id", assignment_id).execute()
-        if not existing.data:
+        existing = await storage.select("vehicle_device_assignment", eq={"id": assignment_id})
+        if not existing:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Assignment ID {assignment_id} non trouvé"
             )
         
-        if not existing.data[0]['is_active']:
+        if not existing[0]['is_active']:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Assignment ID {assignment_id} est déjà désactivé"
@@ -351,12 +345,13 @@ async def deactivate_assignment(assignment_id: int):
             "unassigned_at": datetime.utcnow().isoformat()
         }
         
-        result = supabase.table("vehicle_device_assignment").update(update_data).eq("id", assignment_id).execute()
+        result = await storage.update("vehicle_device_assignment", update_data, eq={"id": assignment_id})
+        invalidate_device(device_id=existing[0]['device_id'])
         
-        if result.data:
+        if result:
             return {
                 "message": "Assignment désactivé avec succès",
-                "assignment": result.data[0]
+                "assignment": result[0]
             }
         else:
             raise HTTPException(
@@ -374,7 +369,7 @@ async def deactivate_assignment(assignment_id: int):
 
 
 @router.get("/assignments/history/device/{device_id}")
-async def get_device_history(device_id: int, limit: int = 10):
+async def get_device_history(device_id: int, limit: int = 10, storage: StorageBackend = Depends(get_storage)):
     """
     Récupérer l'historique complet des assignments d'un device.
     
@@ -384,26 +379,26 @@ async def get_device_history(device_id: int, limit: int = 10):
         limit: Nombre max de résultats (default: 10)
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le device existe
-        device = supabase.table("devices").select("device_code").eq("id", device_id).execute()
-        if not device.data:
+        device = await storage.select("devices", "device_code", eq={"id": device_id})
+        if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Device ID {device_id} non trouvé"
             )
         
         # Récupérer l'historique avec jointure sur cars
-        result = supabase.table("vehicle_device_assignment").select(
-            "id, vehicle_id, is_active, assigned_at, unassigned_at, notes, cars(id, name, vin)"
-        ).eq("device_id", device_id).order("assigned_at", desc=True).limit(limit).execute()
+        result = await storage.select(
+            "vehicle_device_assignment",
+            "id, vehicle_id, is_active, assigned_at, unassigned_at, notes, cars(id, name, vin)",
+            eq={"device_id": device_id}, order="assigned_at", desc=True, limit=limit,
+        )
         
         return {
             "device_id": device_id,
-            "device_code": device.data[0]['device_code'],
-            "history_count": len(result.data),
-            "history": result.data
+            "device_code": device[0]['device_code'],
+            "history_count": len(result),
+            "history": result
         }
         
     except HTTPException:
@@ -416,7 +411,7 @@ async def get_device_history(device_id: int, limit: int = 10):
 
 
 @router.get("/assignments/history/vehicle/{vehicle_id}")
-async def get_vehicle_history(vehicle_id: int, limit: int = 10):
+async def get_vehicle_history(vehicle_id: int, limit: int = 10, storage: StorageBackend = Depends(get_storage)):
     """
     Récupérer l'historique complet des devices branchés sur un véhicule.
     
@@ -426,26 +421,26 @@ async def get_vehicle_history(vehicle_id: int, limit: int = 10):
         limit: Nombre max de résultats (default: 10)
     """
     try:
-        supabase = get_supabase()
-        
         # Vérifier que le véhicule existe
-        vehicle = supabase.table("cars").select("name").eq("id", vehicle_id).execute()
-        if not vehicle.data:
+        vehicle = await storage.select("cars", "name", eq={"id": vehicle_id})
+        if not vehicle:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Véhicule ID {vehicle_id} non trouvé"
             )
         
         # Récupérer l'historique avec jointure sur devices
-        result = supabase.table("vehicle_device_assignment").select(
-            "id, device_id, is_active, assigned_at, unassigned_at, notes, devices(id, device_code, mqtt_topic)"
-        ).eq("vehicle_id", vehicle_id).order("assigned_at", desc=True).limit(limit).execute()
+        result = await storage.select(
+            "vehicle_device_assignment",
+            "id, device_id, is_active, assigned_at, unassigned_at, notes, devices(id, device_code, mqtt_topic)",
+            eq={"vehicle_id": vehicle_id}, order="assigned_at", desc=True, limit=limit,
+        )
         
         return {
             "vehicle_id": vehicle_id,
-            "vehicle_name": vehicle.data[0]['name'],
-            "history_count": len(result.data),
-            "history": result.data
+            "vehicle_name": vehicle[0]['name'],
+            "history_count": len(result),
+            "history": result
         }
         
     except HTTPException:
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from typing import List, Optional
 from datetime import datetime, timedelta
 from ..models import PredictionRequest, PredictionResponse
-from ..database import get_supabase
+from ..storage import StorageBackend, get_storage
 from ..ml.model_manager import model_manager
 
 router = APIRouter(
@@ -12,14 +12,13 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=PredictionResponse)
-async def generate_predictions(req: PredictionRequest, supabase=Depends(get_supabase)):
+async def generate_predictions(req: PredictionRequest, storage: StorageBackend = Depends(get_storage)):
     """
     Génère des prédictions pour un véhicule spécifié.
     """
     try:
         # Récupérer les données historiques du véhicule depuis Supabase
-        response = supabase.from_("vehicles").select("*").eq("id", req.vehicle_id).execute()
-        vehicle_data = response.data
+        vehicle_data = await storage.select("vehicles", eq={"id": req.vehicle_id})
         
         if not vehicle_data:
             raise HTTPException(status_code=404, detail="Véhicule non trouvé")
@@ -32,8 +31,9 @@ async def generate_predictions(req: PredictionRequest, supabase=Depends(get_supa
         v_id_query = int(req.vehicle_id) if str(req.vehicle_id).isdigit() else req.vehicle_id
         print(f"🔍 Recherche télémétrie pour vehicle_id={v_id_query} (type: {type(v_id_query)})")
 
-        telemetry_response = supabase.from_("telemetry").select("*").eq("vehicle_id", v_id_query).order("recorded_at", desc=True).limit(20).execute()
-        telemetry_data = telemetry_response.data
+        telemetry_data = await storage.select(
+            "telemetry", eq={"vehicle_id": v_id_query}, order="recorded_at", desc=True, limit=20
+        )
         
         if not telemetry_data:
             print(f"⚠️ Aucune donnée de télémétrie trouvée pour le véhicule {req.vehicle_id}")
@@ -120,13 +120,13 @@ async def generate_predictions(req: PredictionRequest, supabase=Depends(get_supa
         raise HTTPException(status_code=500, detail=f"Erreur de prédiction: {str(e)}")
 
 @router.get("/{vehicle_id}", response_model=PredictionResponse)
-async def get_predictions(vehicle_id: str, supabase=Depends(get_supabase)):
+async def get_predictions(vehicle_id: str, storage: StorageBackend = Depends(get_storage)):
     """
     Obtient les prédictions pour un véhicule spécifié par son ID.
     """
     try:
         req = PredictionRequest(vehicle_id=vehicle_id)
-        return await generate_predictions(req, supabase)
+        return await generate_predictions(req, storage)
     except HTTPException as he:
         raise he
     except Exception as e:
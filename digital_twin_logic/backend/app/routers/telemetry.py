@@ -1,8 +1,20 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 from pydantic import BaseModel
-from ..database import get_supabase
+from ..storage import StorageBackend, get_storage
+from ..telemetry_rollups import RESOLUTION_SECONDS, telemetry_rollups
+from ..telemetry_state import ESSENTIAL_FIELDS
+from ..persistence_scheduler import AGGREGATED_FIELDS
+from ..downsampling import DOWNSAMPLE_METHODS, StreamingDownsampler
+from ..telemetry_query import (
+    LATEST_COLUMNS, NDJSON_MEDIA_TYPE, decode_cursor, fetch_page, iter_pages, iter_rows, ndjson_lines, parse_fields,
+    wants_ndjson,
+)
+from ..telemetry_export import TelemetryExport, iter_export_batches, stream_export
+from .. import codec
+import asyncio
 
 router = APIRouter()
 
@@ -55,67 +67,87 @@ class TelemetryIn(BaseModel):
 class TelemetryOut(TelemetryIn):
     id: int
 
+# Colonnes lues par défaut (au lieu de select("*"): plus de 45 colonnes en base)
+TELEMETRY_OUT_FIELDS = tuple(TelemetryOut.model_fields)
+
 # ------------------------------
 # 📊 ROUTES
 # ------------------------------
 
 @router.get("/telemetry", response_model=List[TelemetryOut])
-def get_telemetry(
+async def get_telemetry(
+    request: Request,
     vehicle_id: int = Query(..., description="ID du véhicule"),
-    limit: int = Query(50, description="Nombre maximum d’enregistrements à retourner"),
+    limit: Optional[int] = Query(None, ge=1, description="Nombre maximum d’enregistrements (défaut: 50; flux NDJSON: toute la plage)"),
     from_date: Optional[datetime] = Query(None, description="Filtrer à partir de cette date"),
     to_date: Optional[datetime] = Query(None, description="Filtrer jusqu’à cette date"),
+    max_points: Optional[int] = Query(None, ge=3, le=10000, description="Réduire la plage à ~max_points points (ignore limit)"),
+    downsample: str = Query("lttb", description="Méthode de réduction: lttb ou minmax"),
+    fields: Optional[str] = Query(None, description="Colonnes à retourner, séparées par des virgules (défaut: toutes)"),
+    cursor: Optional[str] = Query(None, description="Page suivante: valeur de l’en-tête X-Next-Cursor (absent après une page vide)"),
+    format: Optional[str] = Query(None, description="json (défaut) ou ndjson (flux, aussi via Accept: application/x-ndjson)"),
+    storage: StorageBackend = Depends(get_storage),
 ):
-    """📥 Récupérer les données télémétriques filtrées pour un véhicule"""
+    """📥 Récupérer les données télémétriques filtrées pour un véhicule (du plus récent au plus ancien)"""
+    if format is not None and format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Format inconnu: {format} (attendu: json, ndjson)")
     try:
-        supabase = get_supabase()
-
-        query = supabase.table("telemetry").select("*").eq("vehicle_id", vehicle_id)
-
-        if from_date:
-            query = query.gte("recorded_at", from_date.isoformat())
-        if to_date:
-            query = query.lte("recorded_at", to_date.isoformat())
-
-        res = query.order("recorded_at", desc=True).limit(limit).execute()
-
-        # ✅ Vérification propre des erreurs
-        if hasattr(res, "error") and res.error:
-            raise HTTPException(status_code=500, detail=str(res.error))
-
-        # ✅ Supabase renvoie souvent un dict avec clé 'data'
-        if isinstance(res, dict):
-            data = res.get("data", [])
-        else:
-            data = getattr(res, "data", [])
-
-        if not data:
-            return []  # Pas d'erreur → juste vide
-
-        return data
+        # Sans fields, max_points ne lit que les PIDs essentiels
+        default = ("vehicle_id", *ESSENTIAL_FIELDS) if max_points is not None else TELEMETRY_OUT_FIELDS
+        columns = parse_fields(fields, default)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    gte = {"recorded_at": from_date} if from_date else None
+    lte = {"recorded_at": to_date} if to_date else None
+
+    if max_points is not None:
+        if downsample not in DOWNSAMPLE_METHODS:
+            raise HTTPException(status_code=400, detail=f"Méthode inconnue: {downsample} (attendu: {', '.join(DOWNSAMPLE_METHODS)})")
+        series = [name for name in columns if name in AGGREGATED_FIELDS]
+        sampler = StreamingDownsampler(series, max_points, downsample)
+        try:
+            # Plage complète en ordre chronologique (archives comprises), uniquement les colonnes utiles,
+            # page par page: aucune ligne n'est ignorée, quelle que soit la longueur de la plage
+            async for page in iter_pages(storage, vehicle_id, columns, gte=gte, lte=lte, desc=False):
+                await asyncio.to_thread(sampler.add, page)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des données : {e}")
+        rows = await asyncio.to_thread(sampler.finish)
+        # Même ordre que sans réduction: du plus récent au plus ancien
+        return Response(codec.dumps_bytes(rows[::-1]), media_type="application/json",
+                        headers={"X-Source-Rows": str(sampler.rows_seen)})
+
+    if wants_ndjson(format, request.headers.get("accept")):
+        # Pages lues au fil de l'envoi: mémoire constante quelle que soit la plage
+        rows = iter_rows(storage, vehicle_id, columns, gte=gte, lte=lte, after=after, limit=limit)
+        return StreamingResponse(ndjson_lines(rows), media_type=NDJSON_MEDIA_TYPE)
 
+    try:
+        # Les erreurs du backend (HTTP >= 400) sont levées en StorageError
+        rows, next_cursor = await fetch_page(storage, vehicle_id, columns, limit or 50, gte=gte, lte=lte, after=after)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des données : {e}")
 
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(codec.dumps_bytes(rows), media_type="application/json", headers=headers)
+
 @router.get("/telemetry/latest", response_model=TelemetryOut)
-def get_latest(vehicle_id: int = Query(..., description="ID du véhicule")):
+async def get_latest(
+    vehicle_id: int = Query(..., description="ID du véhicule"),
+    storage: StorageBackend = Depends(get_storage),
+):
     """📡 Récupérer la dernière donnée de télémétrie pour un véhicule"""
     try:
-        supabase = get_supabase()
-
-        res = (
-            supabase.table("telemetry")
-            .select("*")
-            .eq("vehicle_id", vehicle_id)
-            .order("recorded_at", desc=True)
-            .limit(1)
-            .execute()
+        data = await storage.select(
+            "telemetry",
+            ", ".join(TELEMETRY_OUT_FIELDS),
+            eq={"vehicle_id": vehicle_id},
+            order="recorded_at",
+            desc=True,
+            limit=1,
         )
-
-        if hasattr(res, "error") and res.error:
-            raise HTTPException(status_code=500, detail=str(res.error))
-
-        data = res.data if hasattr(res, "data") else res.get("data", [])
         if not data:
             raise HTTPException(status_code=404, detail="Aucune donnée trouvée pour ce véhicule.")
 
@@ -123,3 +155,67 @@ def get_latest(vehicle_id: int = Query(..., description="ID du véhicule")):
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération de la dernière donnée : {e}")
+
+
+@router.get("/telemetry/rollups")
+async def get_telemetry_rollups(
+    vehicle_id: int = Query(..., description="ID du véhicule"),
+    from_date: Optional[datetime] = Query(None, description="Début de la plage (défaut: to_date - 24h)"),
+    to_date: Optional[datetime] = Query(None, description="Fin de la plage (défaut: maintenant)"),
+    max_points: int = Query(500, ge=1, le=10000, description="Nombre maximum de seaux à retourner"),
+    resolution: Optional[str] = Query(None, description="Forcer la résolution: 1m, 1h ou 1d"),
+    fields: Optional[str] = Query(None, description="PIDs à inclure, séparés par des virgules (défaut: tous)"),
+    storage: StorageBackend = Depends(get_storage),
+):
+    """📈 Agrégats min/max/moyenne par seau (1m/1h/1d), résolution choisie selon la plage et max_points"""
+    if resolution is not None and resolution not in RESOLUTION_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Résolution inconnue: {resolution} (attendu: {', '.join(RESOLUTION_SECONDS)})")
+    # Dates sans fuseau: heure locale, comme recorded_at
+    end = (to_date or datetime.now()).timestamp()
+    start = from_date.timestamp() if from_date else end - timedelta(days=1).total_seconds()
+    if start > end:
+        raise HTTPException(status_code=400, detail="from_date doit précéder to_date")
+    try:
+        return await telemetry_rollups.query(
+            vehicle_id,
+            start,
+            end,
+            max_points=max_points,
+            resolution=resolution,
+            fields=[name.strip() for name in fields.split(",") if name.strip()] if fields else None,
+            storage=storage,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des agrégats : {e}")
+
+
+@router.get("/telemetry/export")
+async def export_telemetry(
+    vehicle_id: int = Query(..., description="ID du véhicule"),
+    from_date: Optional[datetime] = Query(None, description="Début de la plage (défaut: premier enregistrement)"),
+    to_date: Optional[datetime] = Query(None, description="Fin de la plage (défaut: dernier enregistrement)"),
+    format: str = Query("csv", description="csv, ndjson, arrow (flux IPC) ou parquet"),
+    compression: str = Query("none", description="none, gzip ou zstd"),
+    fields: Optional[str] = Query(None, description="Colonnes à exporter, séparées par des virgules (défaut: toutes)"),
+    storage: StorageBackend = Depends(get_storage),
+):
+    """📦 Export de la plage complète par ordre chronologique, en flux (mémoire constante côté serveur)"""
+    try:
+        columns = parse_fields(fields, LATEST_COLUMNS)
+        export = TelemetryExport(columns, format, compression)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    batches = iter_export_batches(
+        storage,
+        vehicle_id,
+        columns,
+        gte={"recorded_at": from_date} if from_date else None,
+        lte={"recorded_at": to_date} if to_date else None,
+    )
+    filename = export.filename(f"telemetry_{vehicle_id}")
+    return StreamingResponse(
+        stream_export(export, batches),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
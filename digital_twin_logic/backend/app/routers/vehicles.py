@@ -1,46 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from ..database import get_supabase
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from typing import List, Optional
+from .. import codec
+from ..storage import StorageBackend, get_storage
+from ..telemetry_query import decode_cursor, fetch_page, parse_fields
 from ..realtime import manager
 from ..models import Vehicle, VehicleCreate, Telemetry, TelemetryCreate, VehicleState
 
+TELEMETRY_FIELDS = tuple(Telemetry.model_fields)
+
 router = APIRouter()
 
 @router.post("/vehicles/", response_model=Vehicle)
-async def create_vehicle(vehicle: VehicleCreate, supabase=Depends(get_supabase)):
+async def create_vehicle(vehicle: VehicleCreate, storage: StorageBackend = Depends(get_storage)):
     try:
-        response = supabase.table('vehicles').insert({
+        rows = await storage.insert('vehicles', {
             "name": vehicle.name,
             "vin": vehicle.vin,
             "status": vehicle.status
-        }).execute()
-        return response.data[0]
+        })
+        return rows[0]
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/vehicles/", response_model=List[Vehicle])
-async def get_vehicles(supabase=Depends(get_supabase)):
+async def get_vehicles(storage: StorageBackend = Depends(get_storage)):
     try:
-        response = supabase.table('vehicles').select("*").execute()
-        return response.data
+        return await storage.select('vehicles')
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/vehicles/status", response_model=List[VehicleState])
-async def get_vehicles_status(supabase=Depends(get_supabase)):
+async def get_vehicles_status(storage: StorageBackend = Depends(get_storage)):
     try:
-        response = supabase.rpc('get_vehicles_last_state').execute()
-        return response.data
+        return await storage.rpc('get_vehicles_last_state')
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/vehicles/{vehicle_id}", response_model=Vehicle)
-async def get_vehicle(vehicle_id: int, supabase=Depends(get_supabase)):
+async def get_vehicle(vehicle_id: int, storage: StorageBackend = Depends(get_storage)):
     try:
-        response = supabase.table('vehicles').select("*").eq("id", vehicle_id).execute()
-        if not response.data:
+        rows = await storage.select('vehicles', eq={"id": vehicle_id})
+        if not rows:
             raise HTTPException(status_code=404, detail="Vehicle not found")
-        return response.data[0]
+        return rows[0]
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -48,30 +51,29 @@ async def get_vehicle(vehicle_id: int, supabase=Depends(get_supabase)):
 async def create_telemetry(
     vehicle_id: int, 
     telemetry: TelemetryCreate, 
-    supabase=Depends(get_supabase)
+    storage: StorageBackend = Depends(get_storage)
 ):
     try:
         # Vérifier si le véhicule existe
-        vehicle_check = supabase.table('vehicles').select("id").eq("id", vehicle_id).execute()
-        if not vehicle_check.data:
+        vehicle_check = await storage.select('vehicles', "id", eq={"id": vehicle_id})
+        if not vehicle_check:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
-        response = supabase.table('telemetry').insert({
+        rows = await storage.insert('telemetry', {
             "vehicle_id": vehicle_id,
             "latitude": telemetry.latitude,
             "longitude": telemetry.longitude,
             "speed_kmh": telemetry.speed_kmh,
             "battery_pct": telemetry.battery_pct,
             "temperature": telemetry.temperature
-        }).execute()
-        inserted = response.data[0]
+        })
+        inserted = rows[0]
         # Broadcast the new telemetry to connected WebSocket clients
         try:
-            import json
-            await manager.broadcast(json.dumps({
+            await manager.broadcast({
                 "type": "telemetry_insert",
                 "data": inserted
-            }))
+            }, vehicle_id=vehicle_id)
         except Exception:
             # If broadcasting fails, ignore (do not break insertion)
             pass
@@ -82,16 +84,19 @@ async def create_telemetry(
 @router.get("/vehicles/{vehicle_id}/telemetry", response_model=List[Telemetry])
 async def get_vehicle_telemetry(
     vehicle_id: int,
-    limit: int = 10,
-    supabase=Depends(get_supabase)
+    limit: int = Query(10, ge=1),
+    fields: Optional[str] = Query(None, description="Colonnes à retourner, séparées par des virgules"),
+    cursor: Optional[str] = Query(None, description="Page suivante: valeur de l’en-tête X-Next-Cursor (absent après une page vide)"),
+    storage: StorageBackend = Depends(get_storage)
 ):
     try:
-        response = supabase.table('telemetry')\
-            .select("*")\
-            .eq("vehicle_id", vehicle_id)\
-            .order("recorded_at", desc=True)\
-            .limit(limit)\
-            .execute()
-        return response.data
+        columns = parse_fields(fields, TELEMETRY_FIELDS)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        rows, next_cursor = await fetch_page(storage, vehicle_id, columns, limit, after=after)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(codec.dumps_bytes(rows), media_type="application/json", headers=headers)
@@ -0,0 +1,95 @@
+"""
+Couche de stockage
+
+- Accès aux données des routers (asynchrone): STORAGE_BACKEND=postgrest (défaut)
+  ou sqlite (base locale embarquée, SQLITE_PATH)
+- Écriture de la télémétrie par l'ingestion: TELEMETRY_SINK=supabase (défaut,
+  PostgREST), postgres (COPY direct, DATABASE_URL) ou sqlite
+"""
+import os
+import threading
+from typing import Optional
+
+from .backend import StorageBackend, StorageError
+from .base import Row, TelemetrySink, is_rejected_write
+from .postgres_copy import PostgresCopyTelemetrySink
+from .postgrest import PostgrestBackend
+from .sqlite import SqliteBackend, SqliteTelemetrySink, get_sqlite_database
+from .supabase_sink import SupabaseTelemetrySink
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgrest").lower()
+
+TELEMETRY_SINK = os.getenv("TELEMETRY_SINK", "supabase").lower()
+
+SINKS = {
+    "supabase": SupabaseTelemetrySink,
+    "postgres": PostgresCopyTelemetrySink,
+    "sqlite": SqliteTelemetrySink,
+}
+
+STORAGE_BACKENDS = {
+    "postgrest": PostgrestBackend,
+    "sqlite": SqliteBackend,
+}
+
+_sink: Optional[TelemetrySink] = None
+_sink_lock = threading.Lock()
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def create_telemetry_sink(name: str = TELEMETRY_SINK) -> TelemetrySink:
+    try:
+        factory = SINKS[name]
+    except KeyError:
+        raise ValueError(f"TELEMETRY_SINK inconnu: {name} (attendu: {', '.join(SINKS)})") from None
+    return factory()
+
+
+def get_telemetry_sink() -> TelemetrySink:
+    """Backend partagé (créé à la première utilisation)"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = create_telemetry_sink()
+    return _sink
+
+
+def create_storage(name: str = STORAGE_BACKEND) -> StorageBackend:
+    try:
+        factory = STORAGE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"STORAGE_BACKEND inconnu: {name} (attendu: {', '.join(STORAGE_BACKENDS)})") from None
+    return factory()
+
+
+def get_storage() -> StorageBackend:
+    """Backend partagé des routers (utilisable comme dépendance FastAPI)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+
+__all__ = [
+    "StorageBackend",
+    "StorageError",
+    "PostgrestBackend",
+    "SqliteBackend",
+    "get_sqlite_database",
+    "STORAGE_BACKENDS",
+    "create_storage",
+    "get_storage",
+    "Row",
+    "TelemetrySink",
+    "is_rejected_write",
+    "SupabaseTelemetrySink",
+    "PostgresCopyTelemetrySink",
+    "SqliteTelemetrySink",
+    "SINKS",
+    "create_telemetry_sink",
+    "get_telemetry_sink",
+]
@@ -0,0 +1,80 @@
+"""
+Interface asynchrone d'accès aux données (tables, vues, fonctions RPC)
+
+Les routers n'appellent plus le client Supabase synchrone (qui bloquait la boucle
+asyncio pendant tout l'aller-retour HTTP): ils attendent (`await`) un backend
+de stockage choisi par STORAGE_BACKEND (voir storage/__init__.py).
+
+Les filtres reprennent les opérateurs PostgREST utilisés dans le projet:
+`eq`, `gte`, `lte`, passés sous forme de dictionnaires {colonne: valeur}, et
+`in_` pour les suppressions ciblées ({colonne: [valeurs]}).
+`columns` accepte la syntaxe de sélection PostgREST, y compris les
+ressources embarquées: "id, vehicle_id, vehicles(id, name)".
+
+Pagination par clé (keyset): `order="recorded_at, id"` trie sur plusieurs
+colonnes (même sens), et `after={"recorded_at": ..., "id": ...}` ne garde que
+les lignes situées strictement après ce tuple dans cet ordre.
+"""
+from typing import Any, Dict, List, Optional
+
+Row = Dict[str, Any]
+Filters = Optional[Dict[str, Any]]
+
+
+class StorageError(Exception):
+    """Erreur renvoyée par le backend (HTTP >= 400, contrainte SQL, ...)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StorageBackend:
+    """Opérations génériques communes à tous les backends"""
+
+    name = "abstract"
+
+    async def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        eq: Filters = None,
+        gte: Filters = None,
+        lte: Filters = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+        after: Filters = None,
+    ) -> List[Row]:
+        raise NotImplementedError
+
+    async def insert(self, table: str, rows: Any) -> List[Row]:
+        """Insère une ligne (dict) ou plusieurs (liste); retourne les lignes créées"""
+        raise NotImplementedError
+
+    async def upsert(self, table: str, rows: Any, *, on_conflict: str, ignore_duplicates: bool = False) -> List[Row]:
+        raise NotImplementedError
+
+    async def update(self, table: str, values: Row, *, eq: Filters) -> List[Row]:
+        """Met à jour les lignes filtrées; retourne les lignes modifiées"""
+        raise NotImplementedError
+
+    async def delete(
+        self,
+        table: str,
+        *,
+        eq: Filters,
+        gte: Filters = None,
+        lte: Filters = None,
+        in_: Filters = None,
+        returning: bool = True,
+    ) -> List[Row]:
+        """Supprime les lignes filtrées; returning=False: pas de renvoi des lignes (suppression en masse)"""
+        raise NotImplementedError
+
+    async def rpc(self, function: str, params: Optional[Row] = None) -> Any:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Ferme les connexions (arrêt de l'application)"""
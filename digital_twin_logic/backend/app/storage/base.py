@@ -0,0 +1,51 @@
+"""
+Interface commune des backends d'écriture de la télémétrie
+"""
+from typing import Any, Dict, List
+
+from .backend import StorageError
+
+Row = Dict[str, Any]
+
+# Classes SQLSTATE des refus liés aux données: 22 (type, format, valeur), 23 (contrainte)
+_REJECTED_SQLSTATE_CLASSES = ("22", "23")
+
+
+def is_rejected_write(error: BaseException) -> bool:
+    """
+    True si la BDD refuse les données elles-mêmes (les renvoyer échouera toujours),
+    False pour une panne (réseau, délai, 5xx) qui mérite un nouvel essai.
+
+    StorageError: statut 4xx (hors 408 / 429); psycopg2 (pgcode) et client
+    Supabase (APIError.code): code SQLSTATE de classe 22 ou 23.
+    """
+    if isinstance(error, StorageError):
+        status = error.status_code
+        return status is not None and 400 <= status < 500 and status not in (408, 429)
+    code = getattr(error, "pgcode", None) or getattr(error, "code", None)
+    return isinstance(code, str) and len(code) == 5 and code[:2] in _REJECTED_SQLSTATE_CLASSES
+
+
+class TelemetrySink:
+    """
+    Destination des lots de lignes télémétrie (écrivain groupé, rejeu du journal).
+
+    Une instance est appelable: `sink(rows)` équivaut à `sink.insert(rows)`, ce qui
+    permet de la passer directement à BatchedTelemetryWriter.
+    """
+
+    name = "abstract"
+
+    def insert(self, rows: List[Row]) -> None:
+        """Insertion multi-lignes dans la table telemetry"""
+        raise NotImplementedError
+
+    def upsert(self, rows: List[Row], key: str = "ingest_key") -> None:
+        """Insertion idempotente: les lignes dont `key` existe déjà sont ignorées"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Libère les connexions (arrêt de l'application)"""
+
+    def __call__(self, rows: List[Row]) -> None:
+        self.insert(rows)
@@ -0,0 +1,212 @@
+"""
+Écriture de la télémétrie directement dans Postgres avec COPY
+
+Chaque lot est sérialisé en CSV et envoyé en une seule commande
+`COPY telemetry (...) FROM STDIN`, sur une connexion d'un pool partagé entre
+l'écrivain groupé et le rejeu du journal. Évite la sérialisation JSON et le
+passage par PostgREST (HTTP) de la voie Supabase.
+
+L'upsert idempotent passe par une table temporaire:
+COPY → table de transit, puis INSERT ... SELECT ... ON CONFLICT (clé) DO NOTHING.
+
+La lecture en masse (export) utilise un curseur nommé, côté serveur: Postgres
+n'envoie que batch_size lignes à chaque fetchmany au lieu du résultat entier.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .base import Row, TelemetrySink
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+DATABASE_URL = os.getenv("DATABASE_URL")
+TELEMETRY_PG_POOL_MIN = int(os.getenv("TELEMETRY_PG_POOL_MIN", "1"))
+TELEMETRY_PG_POOL_MAX = int(os.getenv("TELEMETRY_PG_POOL_MAX", "4"))
+
+_NULL = r"\N"
+
+
+def columns_for(rows: List[Row]) -> List[str]:
+    """Union ordonnée des colonnes présentes dans le lot (absentes → NULL)"""
+    columns = {}
+    for row in rows:
+        for name in row:
+            columns.setdefault(name, None)
+    return list(columns)
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return _NULL
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)  # colonnes JSONB (aggregates)
+    return value
+
+
+def rows_to_csv(rows: List[Row], columns: List[str]) -> io.StringIO:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row in rows:
+        writer.writerow([_csv_value(row.get(name)) for name in columns])
+    buffer.seek(0)
+    return buffer
+
+
+def _plain(value: Any) -> Any:
+    """Types psycopg2 → types des autres backends (NUMERIC → float, horodatage → ISO)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class PostgresCopyTelemetrySink(TelemetrySink):
+    name = "postgres"
+
+    def __init__(
+        self,
+        dsn: Optional[str] = DATABASE_URL,
+        table: str = "telemetry",
+        min_connections: int = TELEMETRY_PG_POOL_MIN,
+        max_connections: int = TELEMETRY_PG_POOL_MAX,
+    ):
+        if not dsn:
+            raise ValueError("DATABASE_URL est requis pour TELEMETRY_SINK=postgres")
+        self.dsn = dsn
+        self.table = table
+        self.min_connections = min_connections
+        self.max_connections = max(min_connections, max_connections)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self._pool = ThreadedConnectionPool(self.min_connections, self.max_connections, self.dsn)
+        return self._pool
+
+    @contextmanager
+    def _cursor(self) -> Iterator[Any]:
+        import psycopg2
+
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True  # connexion perdue: ne pas la remettre dans le pool
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=broken or conn.closed)
+
+    def _copy(self, cursor, table, rows: List[Row], columns: List[str]) -> None:
+        from psycopg2 import sql
+
+        statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL {})").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.Literal(_NULL),
+        )
+        cursor.copy_expert(statement, rows_to_csv(rows, columns))
+
+    def insert(self, rows: List[Row]) -> None:
+        if not rows:
+            return
+        with self._cursor() as cursor:
+            self._copy(cursor, self.table, rows, columns_for(rows))
+
+    def upsert(self, rows: List[Row], key: str = "ingest_key") -> None:
+        if not rows:
+            return
+        from psycopg2 import sql
+
+        columns = columns_for(rows)
+        stage = f"{self.table}_copy_stage"
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+        with self._cursor() as cursor:
+            cursor.execute(sql.SQL(
+                "CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            ).format(sql.Identifier(stage), sql.Identifier(self.table)))
+            self._copy(cursor, stage, rows, columns)
+            cursor.execute(sql.SQL(
+                "INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) DO NOTHING"
+            ).format(
+                sql.Identifier(self.table), column_list, column_list,
+                sql.Identifier(stage), sql.Identifier(key),
+            ))
+
+    def iter_batches(
+        self,
+        columns: Sequence[str],
+        vehicle_id: int,
+        gte: Optional[Dict[str, Any]] = None,
+        lte: Optional[Dict[str, Any]] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[List[Row]]:
+        """
+        Lignes d'un véhicule par ordre (recorded_at, id) croissant, par lots de batch_size.
+
+        Curseur nommé (côté serveur) dans une transaction en lecture seule; la
+        connexion est rendue au pool à la fin du parcours ou à la fermeture du générateur.
+        """
+        import psycopg2
+        from psycopg2 import sql
+
+        conditions = [sql.SQL("vehicle_id = %s")]
+        params: List[Any] = [vehicle_id]
+        for bounds, operator in ((gte, ">="), (lte, "<=")):
+            for column, value in (bounds or {}).items():
+                conditions.append(sql.SQL("{} {} %s").format(sql.Identifier(column), sql.SQL(operator)))
+                params.append(value)
+        query = sql.SQL("SELECT {} FROM {} WHERE {} ORDER BY recorded_at, id").format(
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.Identifier(self.table),
+            sql.SQL(" AND ").join(conditions),
+        )
+
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            conn.set_session(readonly=True)
+            with conn.cursor(name=f"{self.table}_export_{uuid.uuid4().hex}") as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    yield [dict(zip(columns, map(_plain, values))) for values in batch]
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                conn.rollback()
+                conn.set_session(readonly=False)
+            pool.putconn(conn, close=broken or conn.closed)
+
+    def close(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
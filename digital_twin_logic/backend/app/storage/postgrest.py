@@ -0,0 +1,198 @@
+"""
+Backend asynchrone PostgREST (API REST de Supabase) sur un client httpx mutualisé
+
+Un seul httpx.AsyncClient par processus: connexions keep-alive réutilisées
+entre requêtes, et HTTP/2 (multiplexage) si le paquet `h2` est installé.
+"""
+import importlib.util
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .. import codec
+from .backend import Filters, Row, StorageBackend, StorageError
+
+# === CONFIGURATION ===
+STORAGE_POOL_MAX = int(os.getenv("STORAGE_POOL_MAX", "20"))
+STORAGE_POOL_KEEPALIVE = int(os.getenv("STORAGE_POOL_KEEPALIVE", "10"))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "10"))
+# auto: HTTP/2 si h2 est installé | true | false
+STORAGE_HTTP2 = os.getenv("STORAGE_HTTP2", "auto").lower()
+
+
+def _http2_enabled(setting: str = STORAGE_HTTP2) -> bool:
+    available = importlib.util.find_spec("h2") is not None
+    if setting == "auto":
+        return available
+    return setting in ("1", "true", "yes") and available
+
+
+def _literal(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def build_filters(
+    eq: Filters = None, gte: Filters = None, lte: Filters = None, in_: Filters = None
+) -> List[Tuple[str, str]]:
+    """Filtres au format PostgREST: [("vehicle_id", "eq.3"), ("recorded_at", "gte.2024-..."), ("id", "in.(1,2)")]"""
+    params = []
+    for operator, filters in (("eq", eq), ("gte", gte), ("lte", lte)):
+        for column, value in (filters or {}).items():
+            if operator == "eq" and value is None:
+                params.append((column, "is.null"))
+            else:
+                params.append((column, f"{operator}.{_literal(value)}"))
+    for column, values in (in_ or {}).items():
+        params.append((column, f"in.({','.join(_quoted(value) for value in values)})"))
+    return params
+
+
+def _quoted(value: Any) -> str:
+    # Guillemets: la valeur peut contenir des caractères réservés (",", "(", ":")
+    return '"' + _literal(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def build_keyset(after: Dict[str, Any], desc: bool) -> str:
+    """
+    Filtre `or` PostgREST: lignes strictement après le tuple `after` dans l'ordre de tri
+    {"recorded_at": t, "id": 5} (desc) → (recorded_at.lt."t",and(recorded_at.eq."t",id.lt."5"))
+    """
+    operator = "lt" if desc else "gt"
+    items = list(after.items())
+    clauses = []
+    for position, (column, value) in enumerate(items):
+        parts = [f"{name}.eq.{_quoted(v)}" for name, v in items[:position]]
+        parts.append(f"{column}.{operator}.{_quoted(value)}")
+        clauses.append(parts[0] if len(parts) == 1 else f"and({','.join(parts)})")
+    return f"({','.join(clauses)})"
+
+
+def order_columns(order: str) -> List[str]:
+    return [column.strip() for column in order.split(",") if column.strip()]
+
+
+class PostgrestBackend(StorageBackend):
+    name = "postgrest"
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        key: Optional[str] = None,
+        http2: Optional[bool] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        url = url or os.getenv("SUPABASE_URL")
+        key = key or os.getenv("SUPABASE_KEY")
+        if not url or not key:
+            raise ValueError("SUPABASE_URL et SUPABASE_KEY sont requis pour STORAGE_BACKEND=postgrest")
+        self.base_url = url.rstrip("/") + "/rest/v1"
+        self.http2 = _http2_enabled() if http2 is None else http2
+        self._headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {key}",
+            "Content-Type": "application/json",
+        }
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Créé à la première requête, dans la boucle asyncio de l'application
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._headers,
+                http2=self.http2,
+                timeout=STORAGE_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=STORAGE_POOL_MAX,
+                    max_keepalive_connections=STORAGE_POOL_KEEPALIVE,
+                ),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[List[Tuple[str, str]]] = None,
+        body: Any = None,
+        prefer: Optional[str] = None,
+    ) -> Any:
+        headers: Dict[str, str] = {"Prefer": prefer} if prefer else {}
+        content = codec.dumps_bytes(body) if body is not None else None
+        response = await self._get_client().request(method, path, params=params, content=content, headers=headers)
+        if response.status_code >= 400:
+            try:
+                detail = codec.loads(response.content)
+                message = detail.get("message") or str(detail)
+            except (codec.DecodeError, AttributeError):
+                message = response.text
+            raise StorageError(f"{method} {path}: {message}", response.status_code)
+        if not response.content:
+            return []
+        return codec.loads(response.content)
+
+    async def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        eq: Filters = None,
+        gte: Filters = None,
+        lte: Filters = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+        after: Filters = None,
+    ) -> List[Row]:
+        params = [("select", columns.replace(" ", ""))] + build_filters(eq, gte, lte)
+        if after:
+            params.append(("or", build_keyset(after, desc)))
+        if order:
+            direction = "desc" if desc else "asc"
+            params.append(("order", ",".join(f"{column}.{direction}" for column in order_columns(order))))
+        if limit is not None:
+            params.append(("limit", str(limit)))
+        return await self._request("GET", f"/{table}", params)
+
+    async def insert(self, table: str, rows: Any) -> List[Row]:
+        return await self._request("POST", f"/{table}", body=rows, prefer="return=representation")
+
+    async def upsert(self, table: str, rows: Any, *, on_conflict: str, ignore_duplicates: bool = False) -> List[Row]:
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        return await self._request(
+            "POST", f"/{table}", params=[("on_conflict", on_conflict)], body=rows,
+            prefer=f"resolution={resolution},return=representation",
+        )
+
+    async def update(self, table: str, values: Row, *, eq: Filters) -> List[Row]:
+        return await self._request("PATCH", f"/{table}", build_filters(eq), body=values, prefer="return=representation")
+
+    async def delete(
+        self,
+        table: str,
+        *,
+        eq: Filters,
+        gte: Filters = None,
+        lte: Filters = None,
+        in_: Filters = None,
+        returning: bool = True,
+    ) -> List[Row]:
+        prefer = "return=representation" if returning else "return=minimal"
+        return await self._request("DELETE", f"/{table}", build_filters(eq, gte, lte, in_), prefer=prefer)
+
+    async def rpc(self, function: str, params: Optional[Row] = None) -> Any:
+        return await self._request("POST", f"/rpc/{function}", body=params or {})
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
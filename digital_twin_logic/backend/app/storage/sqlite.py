@@ -0,0 +1,569 @@
+"""
+Backend local embarqué (SQLite) à la place de Supabase
+
+Reprend le schéma utilisé par l'application (vehicles, devices,
+vehicle_device_assignment, telemetry), la vue v_active_device_assignments et la
+fonction get_vehicles_last_state, pour faire tourner toute la chaîne (MQTT →
+ingestion → API) sur une seule machine: bancs d'essai, petits déploiements
+sans cloud.
+
+- Mode WAL: les lectures (une connexion par thread) ne bloquent pas l'écrivain
+- Une seule connexion d'écriture, protégée par un verrou
+- Les lots de télémétrie sont insérés en une transaction (executemany)
+- Les appels asynchrones (routers) passent par asyncio.to_thread
+
+STORAGE_BACKEND=sqlite et/ou TELEMETRY_SINK=sqlite, fichier SQLITE_PATH.
+"""
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..telemetry_state import TELEMETRY_COLUMNS
+from .backend import Filters, Row, StorageBackend, StorageError
+from .base import TelemetrySink
+
+# === CONFIGURATION ===
+SQLITE_PATH = os.getenv("SQLITE_PATH", "data/digital_twin.db")
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+# NORMAL: sûr en mode WAL (seule la dernière transaction peut être perdue en cas de coupure)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+_NOW = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+
+# Colonnes héritées de l'ancienne table telemetry (POST /vehicles/{id}/telemetry)
+LEGACY_TELEMETRY_COLUMNS = ("latitude", "longitude", "speed_kmh", "battery_pct", "temperature")
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS vehicles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    vin TEXT,
+    status TEXT DEFAULT 'active',
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_code TEXT UNIQUE NOT NULL,
+    mqtt_topic TEXT UNIQUE NOT NULL,
+    description TEXT,
+    status TEXT DEFAULT 'active',
+    created_at TEXT DEFAULT {_NOW},
+    updated_at TEXT DEFAULT {_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_devices_status ON devices(status);
+
+CREATE TABLE IF NOT EXISTS vehicle_device_assignment (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicle_id INTEGER NOT NULL REFERENCES vehicles(id) ON DELETE CASCADE,
+    device_id INTEGER NOT NULL REFERENCES devices(id) ON DELETE CASCADE,
+    is_active INTEGER DEFAULT 1,
+    assigned_at TEXT DEFAULT {_NOW},
+    unassigned_at TEXT,
+    notes TEXT,
+    created_at TEXT DEFAULT {_NOW}
+);
+CREATE UNIQUE INDEX IF NOT EXISTS unique_active_device_assignment
+    ON vehicle_device_assignment(device_id) WHERE is_active = 1;
+CREATE INDEX IF NOT EXISTS idx_vda_vehicle ON vehicle_device_assignment(vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_vda_assigned_at ON vehicle_device_assignment(assigned_at DESC);
+
+-- Équivalent du trigger deactivate_previous_device_assignment (CREATE_DEVICE_TABLES.sql)
+CREATE TRIGGER IF NOT EXISTS trigger_deactivate_previous_assignment_insert
+BEFORE INSERT ON vehicle_device_assignment
+WHEN NEW.is_active = 1
+BEGIN
+    UPDATE vehicle_device_assignment SET is_active = 0, unassigned_at = {_NOW}
+    WHERE device_id = NEW.device_id AND is_active = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trigger_deactivate_previous_assignment_update
+BEFORE UPDATE OF is_active ON vehicle_device_assignment
+WHEN NEW.is_active = 1 AND OLD.is_active = 0
+BEGIN
+    UPDATE vehicle_device_assignment SET is_active = 0, unassigned_at = {_NOW}
+    WHERE device_id = NEW.device_id AND is_active = 1 AND id != NEW.id;
+END;
+
+CREATE TABLE IF NOT EXISTS telemetry (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicle_id INTEGER NOT NULL,
+    device_id INTEGER REFERENCES devices(id) ON DELETE SET NULL,
+    {", ".join(f"{name} NUMERIC" for name in TELEMETRY_COLUMNS + LEGACY_TELEMETRY_COLUMNS)},
+    sample_count INTEGER,
+    aggregates TEXT,
+    ingest_key TEXT,
+    recorded_at TEXT DEFAULT {_NOW},
+    created_at TEXT DEFAULT {_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_telemetry_vehicle_recorded ON telemetry(vehicle_id, recorded_at DESC);
+CREATE INDEX IF NOT EXISTS idx_telemetry_vehicle_created ON telemetry(vehicle_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_telemetry_device ON telemetry(device_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_telemetry_ingest_key ON telemetry(ingest_key);
+
+-- Agrégats 1m/1h/1d par véhicule (telemetry_rollups.py)
+CREATE TABLE IF NOT EXISTS telemetry_rollups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicle_id INTEGER NOT NULL,
+    resolution TEXT NOT NULL,
+    bucket_start TEXT NOT NULL,
+    sample_count INTEGER,
+    stats TEXT,
+    updated_at TEXT DEFAULT {_NOW},
+    UNIQUE (vehicle_id, resolution, bucket_start)
+);
+
+CREATE VIEW IF NOT EXISTS v_active_device_assignments AS
+SELECT
+    vda.id AS assignment_id,
+    vda.vehicle_id,
+    v.name AS vehicle_name,
+    v.vin AS vehicle_vin,
+    vda.device_id,
+    d.device_code,
+    d.mqtt_topic,
+    d.status AS device_status,
+    vda.assigned_at,
+    vda.notes
+FROM vehicle_device_assignment vda
+JOIN vehicles v ON vda.vehicle_id = v.id
+JOIN devices d ON vda.device_id = d.id
+WHERE vda.is_active = 1;
+"""
+
+# Dernière ligne télémétrie de chaque véhicule (format du modèle VehicleState)
+VEHICLES_LAST_STATE = """
+SELECT
+    v.id AS vehicle_id,
+    v.name AS vehicle_name,
+    COALESCE(t.latitude, 0) AS last_latitude,
+    COALESCE(t.longitude, 0) AS last_longitude,
+    COALESCE(t.vehicle_speed, t.speed_kmh, 0) AS last_speed,
+    COALESCE(t.battery_pct, t.control_module_voltage, 0) AS last_battery,
+    COALESCE(t.coolant_temperature, t.temperature, 0) AS last_temperature,
+    t.rpm AS last_rpm,
+    t.recorded_at AS last_update
+FROM vehicles v
+JOIN telemetry t ON t.id = (
+    SELECT id FROM telemetry WHERE vehicle_id = v.id ORDER BY recorded_at DESC LIMIT 1
+)
+ORDER BY v.id
+"""
+
+RPC_QUERIES = {
+    "get_vehicles_last_state": VEHICLES_LAST_STATE,
+}
+
+# "cars" est l'ancien nom de la table vehicles, encore utilisé par certains routers
+TABLE_ALIASES = {"cars": "vehicles"}
+
+# Ressources embarquées (clé étrangère → table référencée), comme dans PostgREST
+EMBEDS = {
+    "vehicles": ("vehicle_id", "vehicles"),
+    "cars": ("vehicle_id", "vehicles"),
+    "devices": ("device_id", "devices"),
+}
+
+BOOLEAN_COLUMNS = frozenset({"is_active"})
+JSON_COLUMNS = frozenset({"aggregates", "stats"})
+
+_EMBED_RE = re.compile(r"^(\w+)\((.*)\)$")
+
+
+def parse_columns(columns: str) -> Tuple[List[str], List[Tuple[str, List[str]]]]:
+    """
+    Sépare les colonnes simples des ressources embarquées:
+    "id, vehicles(id, name)" → (["id"], [("vehicles", ["id", "name"])])
+    """
+    plain, embeds, depth, current = [], [], 0, ""
+    for char in columns + ",":
+        if char == "," and depth == 0:
+            item = current.strip()
+            current = ""
+            if not item:
+                continue
+            match = _EMBED_RE.match(item.replace(" ", ""))
+            if match:
+                embeds.append((match.group(1), [c for c in match.group(2).split(",") if c]))
+            else:
+                plain.append(item)
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    return plain, embeds
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _to_sql(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _from_sql(row: sqlite3.Row) -> Row:
+    data = dict(row)
+    for name in BOOLEAN_COLUMNS.intersection(data):
+        if data[name] is not None:
+            data[name] = bool(data[name])
+    for name in JSON_COLUMNS.intersection(data):
+        if isinstance(data[name], str):
+            data[name] = json.loads(data[name])
+    return data
+
+
+class SqliteDatabase:
+    """Fichier SQLite partagé par le backend des routers et l'écrivain de télémétrie"""
+
+    def __init__(self, path: str = SQLITE_PATH, timeout: float = SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._columns: Dict[str, List[str]] = {}
+        self._writer = self._connect()
+        with self._write_lock:
+            self._writer.executescript(SCHEMA)
+
+    # --- Connexions ---
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _write(self, statements: List[Tuple[str, Any]], many: bool = False) -> List[Row]:
+        """Exécute les requêtes dans une seule transaction; retourne les lignes RETURNING"""
+        rows: List[Row] = []
+        with self._write_lock:
+            try:
+                self._writer.execute("BEGIN IMMEDIATE")
+                for sql, params in statements:
+                    if many:
+                        self._writer.executemany(sql, params)
+                    else:
+                        rows.extend(_from_sql(row) for row in self._writer.execute(sql, params).fetchall())
+                self._writer.execute("COMMIT")
+            except sqlite3.IntegrityError as e:
+                self._writer.execute("ROLLBACK")
+                raise StorageError(str(e), 409) from e
+            except sqlite3.Error as e:
+                if self._writer.in_transaction:
+                    self._writer.execute("ROLLBACK")
+                raise StorageError(str(e), 400) from e
+        return rows
+
+    # --- Schéma ---
+
+    def columns(self, table: str) -> List[str]:
+        table = TABLE_ALIASES.get(table, table)
+        if table not in self._columns:
+            names = [row["name"] for row in self._reader().execute(f"PRAGMA table_info({_quote(table)})")]
+            if not names:
+                raise StorageError(f"Table inconnue: {table}", 404)
+            self._columns[table] = names
+        return self._columns[table]
+
+    def _check(self, table: str, names) -> None:
+        known = self.columns(table)
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise StorageError(f"Colonne(s) inconnue(s) dans {table}: {', '.join(unknown)}", 400)
+
+    def _where(
+        self, table: str, eq: Filters, gte: Filters = None, lte: Filters = None, in_: Filters = None
+    ) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for operator, filters in (("=", eq), (">=", gte), ("<=", lte)):
+            for column, value in (filters or {}).items():
+                self._check(table, [column])
+                if operator == "=" and value is None:
+                    clauses.append(f"{_quote(column)} IS NULL")
+                else:
+                    clauses.append(f"{_quote(column)} {operator} ?")
+                    params.append(_to_sql(value))
+        for column, values in (in_ or {}).items():
+            self._check(table, [column])
+            values = list(values)
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' * len(values))})" if values else "0")
+            params.extend(_to_sql(value) for value in values)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    # --- Opérations (synchrones) ---
+
+    def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        eq: Filters = None,
+        gte: Filters = None,
+        lte: Filters = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+        after: Filters = None,
+    ) -> List[Row]:
+        name = TABLE_ALIASES.get(table, table)
+        plain, embeds = parse_columns(columns)
+        embeds = [(embed, EMBEDS.get(embed), cols) for embed, cols in embeds]
+        missing = [embed for embed, relation, _ in embeds if relation is None]
+        if missing:
+            raise StorageError(f"Relation inconnue depuis {table}: {', '.join(missing)}", 400)
+
+        # Les clés étrangères des ressources embarquées sont lues puis retirées
+        extra = []
+        if plain and plain != ["*"]:
+            self._check(table, plain)
+            extra = [fk for _, (fk, _), _ in embeds if fk not in plain and fk not in extra]
+            selected = ", ".join(_quote(c) for c in plain + extra)
+        else:
+            selected = "*"
+        where, params = self._where(table, eq, gte, lte)
+        if after:
+            # Comparaison de tuples (row values): strictement après le curseur
+            self._check(table, after)
+            keyset = f"({', '.join(map(_quote, after))}) {'<' if desc else '>'} ({', '.join('?' * len(after))})"
+            where = f"{where} AND {keyset}" if where else f" WHERE {keyset}"
+            params.extend(_to_sql(value) for value in after.values())
+        sql = f"SELECT {selected} FROM {_quote(name)}{where}"
+        if order:
+            columns_order = [column.strip() for column in order.split(",") if column.strip()]
+            self._check(table, columns_order)
+            direction = "DESC" if desc else "ASC"
+            sql += " ORDER BY " + ", ".join(f"{_quote(column)} {direction}" for column in columns_order)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        try:
+            rows = [_from_sql(row) for row in self._reader().execute(sql, params)]
+        except sqlite3.Error as e:
+            raise StorageError(str(e), 400) from e
+
+        for embed, (fk, target), cols in embeds:
+            self._embed(rows, embed, fk, target, cols)
+        for row in rows:
+            for fk in extra:
+                row.pop(fk, None)
+        return rows
+
+    def _embed(self, rows: List[Row], embed: str, fk: str, target: str, cols: List[str]) -> None:
+        """Jointure many-to-one en une seule requête (WHERE id IN (...))"""
+        ids = sorted({row[fk] for row in rows if row.get(fk) is not None})
+        related: Dict[Any, Row] = {}
+        if ids:
+            wanted = cols if cols and cols != ["*"] else ["*"]
+            if wanted != ["*"]:
+                self._check(target, wanted)
+            fetched = wanted if wanted == ["*"] or "id" in wanted else wanted + ["id"]
+            selected = "*" if fetched == ["*"] else ", ".join(map(_quote, fetched))
+            placeholders = ", ".join("?" * len(ids))
+            for row in self._reader().execute(
+                f"SELECT {selected} FROM {_quote(target)} WHERE id IN ({placeholders})", ids
+            ):
+                data = _from_sql(row)
+                key = data["id"] if "id" in wanted or wanted == ["*"] else data.pop("id")
+                related[key] = data
+        for row in rows:
+            row[embed] = related.get(row.get(fk))
+
+    def insert(self, table: str, rows: Any, returning: bool = True) -> List[Row]:
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        if not rows:
+            return []
+        name = TABLE_ALIASES.get(table, table)
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        self._check(table, columns)
+        sql = (
+            f"INSERT INTO {_quote(name)} ({', '.join(map(_quote, columns))}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+        params = [[_to_sql(row.get(column)) for column in columns] for row in rows]
+        if not returning:
+            self._write([(sql, params)], many=True)
+            return []
+        return self._write([(sql + " RETURNING *", p) for p in params])
+
+    def upsert(
+        self, table: str, rows: Any, *, on_conflict: str, ignore_duplicates: bool = False, returning: bool = True
+    ) -> List[Row]:
+        rows = [rows] if isinstance(rows, dict) else list(rows)
+        if not rows:
+            return []
+        name = TABLE_ALIASES.get(table, table)
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        keys = [key.strip() for key in on_conflict.split(",")]
+        self._check(table, columns + keys)
+        if ignore_duplicates:
+            action = "DO NOTHING"
+        else:
+            updates = [c for c in columns if c not in keys]
+            action = "DO UPDATE SET " + ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates) \
+                if updates else "DO NOTHING"
+        sql = (
+            f"INSERT INTO {_quote(name)} ({', '.join(map(_quote, columns))}) "
+            f"VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({', '.join(map(_quote, keys))}) {action}"
+        )
+        params = [[_to_sql(row.get(column)) for column in columns] for row in rows]
+        if not returning:
+            self._write([(sql, params)], many=True)
+            return []
+        return self._write([(sql + " RETURNING *", p) for p in params])
+
+    def update(self, table: str, values: Row, *, eq: Filters) -> List[Row]:
+        if not values:
+            return self.select(table, eq=eq)
+        name = TABLE_ALIASES.get(table, table)
+        self._check(table, values)
+        where, params = self._where(table, eq)
+        assignments = ", ".join(f"{_quote(column)} = ?" for column in values)
+        sql = f"UPDATE {_quote(name)} SET {assignments}{where} RETURNING *"
+        return self._write([(sql, [_to_sql(v) for v in values.values()] + params)])
+
+    def delete(
+        self,
+        table: str,
+        *,
+        eq: Filters,
+        gte: Filters = None,
+        lte: Filters = None,
+        in_: Filters = None,
+        returning: bool = True,
+    ) -> List[Row]:
+        name = TABLE_ALIASES.get(table, table)
+        where, params = self._where(table, eq, gte, lte, in_)
+        return self._write([(f"DELETE FROM {_quote(name)}{where}{' RETURNING *' if returning else ''}", params)])
+
+    def rpc(self, function: str, params: Optional[Row] = None) -> Any:
+        try:
+            sql = RPC_QUERIES[function]
+        except KeyError:
+            raise StorageError(f"Fonction inconnue: {function}", 404) from None
+        return [_from_sql(row) for row in self._reader().execute(sql, params or {})]
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_databases: Dict[str, SqliteDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def get_sqlite_database(path: str = SQLITE_PATH) -> SqliteDatabase:
+    """Une instance par fichier: le backend et l'écrivain partagent le verrou d'écriture"""
+    path = os.path.abspath(path)
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = SqliteDatabase(path)
+        return _databases[path]
+
+
+def close_sqlite_database(path: str = SQLITE_PATH) -> None:
+    with _databases_lock:
+        database = _databases.pop(os.path.abspath(path), None)
+    if database is not None:
+        database.close()
+
+
+class SqliteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.db = get_sqlite_database(path)
+
+    async def select(
+        self,
+        table: str,
+        columns: str = "*",
+        *,
+        eq: Filters = None,
+        gte: Filters = None,
+        lte: Filters = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+        after: Filters = None,
+    ) -> List[Row]:
+        return await asyncio.to_thread(
+            self.db.select, table, columns,
+            eq=eq, gte=gte, lte=lte, order=order, desc=desc, limit=limit, after=after,
+        )
+
+    async def insert(self, table: str, rows: Any) -> List[Row]:
+        return await asyncio.to_thread(self.db.insert, table, rows)
+
+    async def upsert(self, table: str, rows: Any, *, on_conflict: str, ignore_duplicates: bool = False) -> List[Row]:
+        return await asyncio.to_thread(
+            self.db.upsert, table, rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates
+        )
+
+    async def update(self, table: str, values: Row, *, eq: Filters) -> List[Row]:
+        return await asyncio.to_thread(self.db.update, table, values, eq=eq)
+
+    async def delete(
+        self,
+        table: str,
+        *,
+        eq: Filters,
+        gte: Filters = None,
+        lte: Filters = None,
+        in_: Filters = None,
+        returning: bool = True,
+    ) -> List[Row]:
+        return await asyncio.to_thread(self.db.delete, table, eq=eq, gte=gte, lte=lte, in_=in_, returning=returning)
+
+    async def rpc(self, function: str, params: Optional[Row] = None) -> Any:
+        return await asyncio.to_thread(self.db.rpc, function, params)
+
+    async def close(self) -> None:
+        close_sqlite_database(self.path)
+
+
+class SqliteTelemetrySink(TelemetrySink):
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH, table: str = "telemetry"):
+        self.path = path
+        self.table = table
+        self.db = get_sqlite_database(path)
+
+    def insert(self, rows: List[Row]) -> None:
+        # Lot entier en une transaction, sans RETURNING
+        self.db.insert(self.table, rows, returning=False)
+
+    def upsert(self, rows: List[Row], key: str = "ingest_key") -> None:
+        self.db.upsert(self.table, rows, on_conflict=key, ignore_duplicates=True, returning=False)
+
+    def close(self) -> None:
+        close_sqlite_database(self.path)
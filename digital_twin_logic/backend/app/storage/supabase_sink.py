@@ -0,0 +1,25 @@
+"""
+Écriture de la télémétrie via Supabase (PostgREST, JSON sur HTTP)
+"""
+from typing import List
+
+from .base import Row, TelemetrySink
+
+
+class SupabaseTelemetrySink(TelemetrySink):
+    name = "supabase"
+
+    def __init__(self, table: str = "telemetry"):
+        self.table = table
+
+    @staticmethod
+    def _client():
+        # Import tardif: database.py crée le client Supabase à l'import
+        from ..database import get_supabase
+        return get_supabase()
+
+    def insert(self, rows: List[Row]) -> None:
+        self._client().table(self.table).insert(rows).execute()
+
+    def upsert(self, rows: List[Row], key: str = "ingest_key") -> None:
+        self._client().table(self.table).upsert(rows, on_conflict=key, ignore_duplicates=True).execute()
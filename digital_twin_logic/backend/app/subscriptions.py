@@ -0,0 +1,155 @@
+"""
+Abonnements MQTT calculés depuis la table devices
+
+`wincan/#` faisait livrer par le broker tous les topics PID individuels
+(wincan/OxyCrnt, ...) que l'ingestion jetait ensuite. Modes (MQTT_SUBSCRIPTION_MODE):
+
+- devices:  un abonnement par `devices.mqtt_topic` actif, resynchronisé après
+            chaque écriture sur les devices (routers/devices.py) et périodiquement
+- wildcard: `wincan/+` (un seul niveau: exclut les sous-topics), le filtre
+            wincan/deviceN restant fait côté ingestion
+
+Si la BDD est inaccessible, les abonnements courants sont conservés (ou
+`wincan/+` au premier démarrage) pour ne pas perdre de données.
+"""
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from .mqtt_scaling import MqttScaling, mqtt_scaling
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+MQTT_SUBSCRIPTION_MODE = os.getenv("MQTT_SUBSCRIPTION_MODE", "devices").lower()
+MQTT_SUBSCRIPTION_REFRESH = float(os.getenv("MQTT_SUBSCRIPTION_REFRESH", "300"))  # secondes, 0 = désactivé
+MQTT_SUBSCRIPTION_QOS = int(os.getenv("MQTT_SUBSCRIPTION_QOS", "0"))
+
+WILDCARD_TOPICS = ["wincan/+"]
+
+
+class SubscriptionManager:
+    """Aligne les abonnements du client MQTT sur les topics des devices actifs"""
+
+    def __init__(
+        self,
+        topic_loader: Optional[Callable[[], Optional[List[str]]]] = None,
+        scaling: MqttScaling = mqtt_scaling,
+        mode: str = MQTT_SUBSCRIPTION_MODE,
+        qos: int = MQTT_SUBSCRIPTION_QOS,
+    ):
+        if mode not in ("devices", "wildcard"):
+            raise ValueError(f"MQTT_SUBSCRIPTION_MODE invalide: {mode!r} (attendu: devices, wildcard)")
+        self._topic_loader = topic_loader
+        self.scaling = scaling
+        self.mode = mode
+        self.qos = qos
+        self._client = None
+        self._subscribed: Set[str] = set()
+        self._lock = threading.Lock()
+        self.syncs = 0
+        self.load_errors = 0
+
+    def _load_topics(self) -> Optional[List[str]]:
+        loader = self._topic_loader
+        if loader is None:
+            # Import tardif: database.py crée le client Supabase à l'import
+            from .database import get_active_device_topics
+            loader = self._topic_loader = get_active_device_topics
+        return loader()
+
+    def desired_topics(self) -> Set[str]:
+        """Filtres à envoyer au broker (mode de répartition appliqué)"""
+        if self.mode == "wildcard":
+            topics = WILDCARD_TOPICS
+        else:
+            topics = self._load_topics()
+            if topics is None:
+                self.load_errors += 1
+                if self._subscribed:
+                    return set(self._subscribed)  # Garder l'existant
+                topics = WILDCARD_TOPICS
+        return set(self.scaling.subscriptions(sorted(set(topics))))
+
+    def attach(self, client) -> None:
+        """
+        À appeler depuis on_connect: session neuve côté broker, tout est à (re)souscrire.
+        La synchronisation (requête BDD) est faite hors du thread réseau paho.
+        """
+        with self._lock:
+            self._client = client
+            self._subscribed = set()
+        self.schedule_resync()
+
+    def detach(self) -> None:
+        with self._lock:
+            self._client = None
+            self._subscribed = set()
+
+    def sync(self) -> Dict[str, List[str]]:
+        """Souscrit aux nouveaux topics, se désabonne des topics retirés"""
+        with self._lock:
+            client = self._client
+            if client is None:
+                return {"added": [], "removed": []}
+            desired = self.desired_topics()
+            added = sorted(desired - self._subscribed)
+            removed = sorted(self._subscribed - desired)
+
+            if added:
+                rc, _ = client.subscribe([(topic, self.qos) for topic in added])
+                if rc != 0:
+                    logger.warning(f"⚠️  Abonnement MQTT refusé (rc={rc}), nouvel essai à la prochaine synchro")
+                    added = []
+            if removed:
+                rc, _ = client.unsubscribe(removed)
+                if rc != 0:
+                    logger.warning(f"⚠️  Désabonnement MQTT refusé (rc={rc})")
+                    removed = []
+            self._subscribed = (self._subscribed | set(added)) - set(removed)
+            self.syncs += 1
+
+        for topic in added:
+            print(f"📡 Abonné au topic: {topic}")
+        for topic in removed:
+            print(f"🔕 Désabonné du topic: {topic}")
+        return {"added": added, "removed": removed}
+
+    def schedule_resync(self) -> None:
+        """Resynchronisation en arrière-plan (endpoints devices, callback on_connect)"""
+        threading.Thread(target=self._safe_sync, name="mqtt-subscriptions", daemon=True).start()
+
+    def _safe_sync(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"❌ Erreur de synchronisation des abonnements MQTT: {e}")
+
+    async def refresh_periodically(self, interval: float = MQTT_SUBSCRIPTION_REFRESH) -> None:
+        """Rattrape les devices créés hors API (SQL, scripts de setup)"""
+        if self.mode != "devices" or interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self._safe_sync)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribed = sorted(self._subscribed)
+        return {
+            "mode": self.mode,
+            "topics": subscribed,
+            "syncs": self.syncs,
+            "load_errors": self.load_errors,
+        }
+
+
+subscription_manager = SubscriptionManager()
+
+
+def schedule_subscription_resync() -> None:
+    """Raccourci utilisé par les endpoints d'écriture des devices"""
+    if subscription_manager.mode == "devices":
+        subscription_manager.schedule_resync()
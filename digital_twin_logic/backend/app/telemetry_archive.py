@@ -0,0 +1,232 @@
+"""
+Archives de la télémétrie brute: un fichier compressé par véhicule et par jour (UTC)
+
+    TELEMETRY_ARCHIVE_DIR/vehicle_<id>/<AAAA-MM-JJ>.npz
+
+Format colonnaire NumPy (np.savez_compressed), un tableau par colonne:
+- _ts: horodatage en secondes epoch (tri et filtres), id / vehicle_id en int64
+- recorded_at, created_at, aggregates (JSON): texte, "" pour null
+- PIDs et autres colonnes numériques: float64, NaN pour null (entiers restitués en int);
+  une valeur non numérique dans une colonne numérique est archivée à null
+- sample_count / aggregates (migration optionnelle SUPABASE_TELEMETRY_AGGREGATES.sql):
+  archivées à null quand la base ne les a pas; un fichier sans une colonne (plus
+  ancien) la restitue à null
+
+Les lectures (select) reprennent la sémantique du backend de stockage
+(gte / lte / after / desc / limit) pour être fusionnées avec les lignes encore
+en base par telemetry_query.fetch_page.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import codec
+from .downsampling import to_seconds
+from .pid_decoder import INTEGER_COLUMNS
+from .telemetry_state import TELEMETRY_COLUMNS
+
+# === CONFIGURATION ===
+TELEMETRY_ARCHIVE_DIR = os.getenv("TELEMETRY_ARCHIVE_DIR", "data/archive")
+
+DAY_SECONDS = 86400
+
+ARCHIVE_BASE_COLUMNS = ("id", "vehicle_id", "device_id", "recorded_at", "created_at") + TELEMETRY_COLUMNS
+# Colonnes de la migration optionnelle des agrégats: lues en base seulement si elles existent
+AGGREGATE_ARCHIVE_COLUMNS = ("sample_count", "aggregates")
+ARCHIVE_COLUMNS = ARCHIVE_BASE_COLUMNS + AGGREGATE_ARCHIVE_COLUMNS  # schéma des fichiers
+_TEXT_COLUMNS = frozenset({"recorded_at", "created_at", "aggregates"})
+_INT64_COLUMNS = frozenset({"id", "vehicle_id"})
+_NULLABLE_INTEGER_COLUMNS = frozenset({"device_id", "sample_count"}) | INTEGER_COLUMNS
+
+Row = Dict[str, Any]
+
+
+def seconds(value: Any) -> float:
+    """Horodatage (ISO ou datetime) → secondes epoch; sans fuseau: UTC"""
+    return float(to_seconds([value])[0])
+
+
+def day_name(day_start: float) -> str:
+    return datetime.fromtimestamp(day_start, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def day_start_of(name: str) -> float:
+    return datetime.strptime(name, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def encode_column(name: str, values: Sequence[Any]) -> np.ndarray:
+    if name in _INT64_COLUMNS:
+        return np.asarray(values, dtype=np.int64)
+    if name in _TEXT_COLUMNS:
+        def text(value: Any) -> str:
+            if value is None:
+                return ""
+            return value if isinstance(value, str) else codec.dumps(value)
+        return np.array([text(value) for value in values], dtype=str) if values else np.array([], dtype=str)
+
+    def number(value: Any) -> float:
+        try:
+            return np.nan if value is None or isinstance(value, bool) else float(value)
+        except (TypeError, ValueError):
+            return np.nan
+    return np.fromiter((number(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def decode_column(name: str, array: np.ndarray) -> List[Any]:
+    if name in _INT64_COLUMNS:
+        return array.tolist()
+    if name in _TEXT_COLUMNS:
+        values = [value or None for value in array.tolist()]
+        if name == "aggregates":
+            return [codec.loads(value) if value else None for value in values]
+        return values
+    as_int = name in _NULLABLE_INTEGER_COLUMNS
+    return [None if value != value else (int(value) if as_int else value) for value in array.tolist()]
+
+
+class TelemetryArchive:
+    """Lecture / écriture des fichiers d'archive (appels synchrones: à exécuter via asyncio.to_thread)"""
+
+    def __init__(self, path: str = TELEMETRY_ARCHIVE_DIR):
+        self.path = path
+        self._lock = threading.Lock()  # écritures (fusion avec un fichier existant)
+
+    def _vehicle_dir(self, vehicle_id: int) -> str:
+        return os.path.join(self.path, f"vehicle_{int(vehicle_id)}")
+
+    def _file(self, vehicle_id: int, day_start: float) -> str:
+        return os.path.join(self._vehicle_dir(vehicle_id), f"{day_name(day_start)}.npz")
+
+    def days(self, vehicle_id: int) -> List[float]:
+        """Débuts (secondes epoch) des jours archivés, croissants"""
+        try:
+            names = os.listdir(self._vehicle_dir(vehicle_id))
+        except FileNotFoundError:
+            return []
+        return sorted(day_start_of(name[:-4]) for name in names if name.endswith(".npz"))
+
+    def _load(self, vehicle_id: int, day_start: float, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+        with np.load(self._file(vehicle_id, day_start), allow_pickle=False) as data:
+            return {name: data[name] for name in ("_ts", *columns) if name in data.files}
+
+    def write(self, vehicle_id: int, day_start: float, rows: List[Row]) -> int:
+        """
+        Archive les lignes d'un jour (fusion avec le fichier existant, sans doublon d'id).
+        Écriture atomique: fichier temporaire puis remplacement.
+        """
+        if not rows:
+            return 0
+        path = self._file(vehicle_id, day_start)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            arrays = {name: encode_column(name, [row.get(name) for row in rows]) for name in ARCHIVE_COLUMNS}
+            arrays["_ts"] = to_seconds([row["recorded_at"] for row in rows])
+            if os.path.exists(path):
+                existing = self._load(vehicle_id, day_start, ARCHIVE_COLUMNS)
+                count = len(existing["id"])
+                # Colonne absente d'un fichier plus ancien: null pour ses lignes
+                for name in arrays:
+                    if name not in existing:
+                        existing[name] = encode_column(name, [None] * count)
+                fresh = ~np.isin(arrays["id"], existing["id"])
+                arrays = {name: np.concatenate([existing[name], arrays[name][fresh]]) for name in arrays}
+            order = np.lexsort((arrays["id"], arrays["_ts"]))
+            arrays = {name: array[order] for name, array in arrays.items()}
+
+            tmp_path = path[:-4] + ".tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+        return len(rows)
+
+    def select(
+        self,
+        vehicle_id: int,
+        columns: Sequence[str],
+        gte: Optional[Dict[str, Any]] = None,
+        lte: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None,
+        desc: bool = True,
+        limit: Optional[int] = None,
+    ) -> List[Row]:
+        """Lignes archivées triées par (recorded_at, id), mêmes filtres que StorageBackend.select"""
+        low = seconds(gte["recorded_at"]) if gte and "recorded_at" in gte else -np.inf
+        high = seconds(lte["recorded_at"]) if lte and "recorded_at" in lte else np.inf
+        after_key: Optional[Tuple[float, int]] = (seconds(after["recorded_at"]), after["id"]) if after else None
+        if after_key and desc:
+            high = min(high, after_key[0])
+        elif after_key:
+            low = max(low, after_key[0])
+
+        days = [day for day in self.days(vehicle_id) if day <= high and day + DAY_SECONDS > low]
+        rows: List[Row] = []
+        for day in (reversed(days) if desc else days):
+            data = self._load(vehicle_id, day, columns)
+            ts, ids = data["_ts"], data["id"]
+            mask = (ts >= low) & (ts <= high)
+            if after_key:
+                at, at_id = after_key
+                mask &= ((ts < at) | ((ts == at) & (ids < at_id))) if desc else ((ts > at) | ((ts == at) & (ids > at_id)))
+            selected = np.flatnonzero(mask)  # fichier déjà trié par (_ts, id)
+            if desc:
+                selected = selected[::-1]
+            if limit is not None:
+                selected = selected[: limit - len(rows)]
+            values = [decode_column(name, data[name][selected]) if name in data else [None] * len(selected) for name in columns]
+            rows.extend(dict(zip(columns, row)) for row in zip(*values))
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+    def merge_page(
+        self,
+        rows: List[Row],
+        vehicle_id: int,
+        columns: Sequence[str],
+        limit: int,
+        gte: Optional[Dict[str, Any]] = None,
+        lte: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None,
+        desc: bool = True,
+    ) -> List[Row]:
+        """Complète une page lue en base avec les lignes archivées de la même plage"""
+        days = self.days(vehicle_id)
+        if not days:
+            return rows
+        # Page pleine et entièrement plus récente que les archives: rien à fusionner
+        if desc and len(rows) >= limit and seconds(rows[-1]["recorded_at"]) >= days[-1] + DAY_SECONDS:
+            return rows
+        archived = self.select(vehicle_id, columns, gte=gte, lte=lte, after=after, desc=desc, limit=limit)
+        # Lignes archivées mais pas encore supprimées de la base: une seule fois
+        hot_ids = {row["id"] for row in rows}
+        archived = [row for row in archived if row["id"] not in hot_ids]
+        if rows:
+            # Page de la base peut-être tronquée (max-rows): pas d'archive au-delà de sa dernière
+            # ligne, sinon le curseur sauterait les lignes de la base pas encore lues
+            last = (seconds(rows[-1]["recorded_at"]), rows[-1]["id"])
+
+            def within_page(row: Row) -> bool:
+                key = (seconds(row["recorded_at"]), row["id"])
+                return key > last if desc else key < last
+            archived = [row for row in archived if within_page(row)]
+        if not archived:
+            return rows
+        merged = rows + archived
+        keys = to_seconds([row["recorded_at"] for row in merged])
+        order = sorted(range(len(merged)), key=lambda i: (keys[i], merged[i]["id"]), reverse=desc)
+        return [merged[i] for i in order[:limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        files = size = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith(".npz"):
+                    files += 1
+                    size += os.path.getsize(os.path.join(root, name))
+        return {"path": self.path, "files": files, "bytes": size}
+
+
+# Instance globale
+telemetry_archive = TelemetryArchive()
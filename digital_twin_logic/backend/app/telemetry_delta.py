@@ -0,0 +1,121 @@
+"""
+Protocole delta du WebSocket (/ws/telemetry?protocol=delta)
+
+Au lieu de renvoyer à chaque message MQTT toute la télémétrie (~50 champs) et
+l'historique complet (100 points), le client reçoit:
+
+- telemetry_snapshot: état complet d'un véhicule (data, history, state) à la
+  séquence seq; envoyé à la connexion, à l'abonnement, sur demande
+  ({"type": "resync", "vehicle_ids": [...]}) et après un delta perdu
+- telemetry_delta: seq = précédente + 1, uniquement les champs de data qui ont
+  changé, les nouveaux points d'historique et state s'il a changé
+
+Côté client: appliquer un delta seulement si seq == dernière seq + 1 (sinon
+ignorer et attendre le snapshot, ou envoyer resync); ajouter les points
+d'historique plus récents que le dernier connu et garder les history_window
+derniers. Les séquences sont propres à chaque véhicule et communes à tous les
+clients (un delta est encodé une seule fois par diffusion).
+
+Un snapshot décrit exactement l'état à sa séquence (celui dont part le delta
+suivant), pas l'état courant: un champ modifié puis revenu à sa valeur avant
+la diffusion suivante ne peut pas rester faux côté client. Sans client abonné,
+la séquence avance quand même à chaque diffusion (advance), pour que les
+snapshots suivent l'état.
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from .downsampling import WS_HISTORY_MAX_POINTS, WS_HISTORY_WINDOW, downsample_history
+from .telemetry_state import HISTORY_FIELDS, VehicleState
+
+# Points d'historique conservés côté client (taille de l'historique d'un snapshot)
+HISTORY_WINDOW = WS_HISTORY_MAX_POINTS or WS_HISTORY_WINDOW
+
+_MISSING = object()
+
+
+class _VehicleCursor:
+    """Dernier état diffusé d'un véhicule"""
+
+    __slots__ = ("seq", "data", "state", "appended")
+
+    def __init__(self):
+        self.seq = 0
+        self.data: Dict[str, Any] = {}
+        self.state: Optional[str] = None
+        self.appended = 0  # HistoryBuffer.appended au dernier delta
+
+
+class TelemetryDeltaEncoder:
+    """Séquences et derniers états diffusés, par véhicule (méthodes à appeler sous state.lock)"""
+
+    def __init__(self):
+        self._cursors: Dict[int, _VehicleCursor] = {}
+
+    def _cursor(self, vehicle_id: int) -> _VehicleCursor:
+        cursor = self._cursors.get(vehicle_id)
+        if cursor is None:
+            cursor = self._cursors[vehicle_id] = _VehicleCursor()
+        return cursor
+
+    def seq(self, vehicle_id: int) -> int:
+        cursor = self._cursors.get(vehicle_id)
+        return cursor.seq if cursor is not None else 0
+
+    def advance(self, state: VehicleState, data: Optional[Dict[str, Any]] = None) -> int:
+        """Avance la séquence jusqu'à l'état courant sans construire de delta (aucun client abonné)"""
+        cursor = self._cursor(state.vehicle_id)
+        cursor.seq += 1
+        cursor.data = state.to_dict() if data is None else data
+        cursor.state = state.state
+        cursor.appended = state.history.appended
+        return cursor.seq
+
+    def delta(self, state: VehicleState, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Delta depuis la diffusion précédente du véhicule (avance la séquence)"""
+        cursor = self._cursor(state.vehicle_id)
+        data = state.to_dict() if data is None else data
+        changed = {name: value for name, value in data.items() if cursor.data.get(name, _MISSING) != value}
+        new_points = min(state.history.appended - cursor.appended, len(state.history), HISTORY_WINDOW)
+
+        cursor.seq += 1
+        cursor.data = data
+        cursor.appended = state.history.appended
+        message = {
+            "type": "telemetry_delta",
+            "vehicle_id": state.vehicle_id,
+            "seq": cursor.seq,
+            "data": changed,
+            "history": state.history_list(new_points) if new_points > 0 else [],
+            "timestamp": datetime.now().isoformat(),
+        }
+        if state.state != cursor.state:
+            cursor.state = message["state"] = state.state
+        return message
+
+    def snapshot(self, state: VehicleState) -> Dict[str, Any]:
+        """État complet à la séquence courante, tel que diffusé (n'avance la séquence qu'à la première)"""
+        cursor = self._cursor(state.vehicle_id)
+        if cursor.seq == 0:
+            self.advance(state)
+        history = state.history_arrays()
+        # Points ajoutés depuis la séquence: portés par le delta suivant
+        keep = len(history["timestamp"]) - min(state.history.appended - cursor.appended, len(history["timestamp"]))
+        history = {name: values[:keep] for name, values in history.items()}
+        return {
+            "type": "telemetry_snapshot",
+            "vehicle_id": state.vehicle_id,
+            "seq": cursor.seq,
+            "state": cursor.state,
+            "data": cursor.data,
+            "history": downsample_history(history, HISTORY_FIELDS, extra={"vehicle_id": state.vehicle_id}),
+            "history_window": HISTORY_WINDOW,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {vehicle_id: cursor.seq for vehicle_id, cursor in self._cursors.items()}
+
+
+# Instance globale
+delta_encoder = TelemetryDeltaEncoder()
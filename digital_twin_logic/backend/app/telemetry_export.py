@@ -0,0 +1,322 @@
+"""
+Export en masse de la télémétrie d'un véhicule (analyse hors ligne, entraînement)
+
+Le flux est produit lot par lot, en mémoire constante:
+source (lots de TELEMETRY_EXPORT_BATCH_SIZE lignes) → encodeur → compression → réponse HTTP
+
+- source: curseur côté serveur Postgres si TELEMETRY_SINK=postgres (DATABASE_URL),
+  sinon pages par curseur (recorded_at, id) du backend de stockage (PostgREST, SQLite).
+  Les jours archivés (rétention) sont toujours lus par pages fusionnées avec les
+  archives, le curseur Postgres ne couvrant que la suite de la plage
+- formats: csv, ndjson, arrow (flux IPC) et parquet (pyarrow, optionnel)
+- compression: gzip (zlib) ou zstd (zstandard, optionnel); arrow et parquet
+  compressent en interne (zstd pour arrow, gzip ou zstd pour parquet)
+
+Arrow / Parquet: colonnes typées (entiers, réels, horodatages en texte ISO);
+une valeur non numérique dans une colonne numérique est exportée à null.
+"""
+import asyncio
+import csv
+import io
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from . import codec
+from .pid_decoder import INTEGER_COLUMNS
+from .storage import TELEMETRY_SINK, Row, get_telemetry_sink
+from .telemetry_archive import seconds
+from .telemetry_query import NDJSON_MEDIA_TYPE, archived_until, iter_pages
+
+# === CONFIGURATION ===
+TELEMETRY_EXPORT_BATCH_SIZE = int(os.getenv("TELEMETRY_EXPORT_BATCH_SIZE", "5000"))
+TELEMETRY_EXPORT_GZIP_LEVEL = int(os.getenv("TELEMETRY_EXPORT_GZIP_LEVEL", "6"))
+TELEMETRY_EXPORT_ZSTD_LEVEL = int(os.getenv("TELEMETRY_EXPORT_ZSTD_LEVEL", "3"))
+
+EXPORT_COMPRESSIONS = ("none", "gzip", "zstd")
+
+_INTEGER_COLUMNS = frozenset({"id", "vehicle_id", "device_id", "sample_count"}) | INTEGER_COLUMNS
+_TEXT_COLUMNS = frozenset({"recorded_at", "created_at"})
+
+
+class ExportWriter:
+    """Encodeur incrémental: write(lot) et close() renvoient les octets prêts à envoyer"""
+
+    media_type = "application/octet-stream"
+    extension = "bin"
+    # Compressions gérées par le format lui-même (sinon: flux compressé en sortie)
+    internal_compressions: Sequence[str] = ()
+
+    def __init__(self, columns: Sequence[str], compression: str = "none"):
+        self.columns = list(columns)
+        self.compression = compression
+
+    def write(self, rows: List[Row]) -> bytes:
+        raise NotImplementedError
+
+    def close(self) -> bytes:
+        return b""
+
+
+class CsvWriter(ExportWriter):
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, columns: Sequence[str], compression: str = "none"):
+        super().__init__(columns, compression)
+        self._header = True
+
+    def write(self, rows: List[Row]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if self._header:
+            writer.writerow(self.columns)
+            self._header = False
+        for row in rows:
+            writer.writerow([_csv_value(row.get(name)) for name in self.columns])
+        return buffer.getvalue().encode("utf-8")
+
+    def close(self) -> bytes:
+        # Export vide: l'en-tête seul
+        return self.write([]) if self._header else b""
+
+
+class NdjsonWriter(ExportWriter):
+    media_type = NDJSON_MEDIA_TYPE
+    extension = "ndjson"
+
+    def write(self, rows: List[Row]) -> bytes:
+        return b"".join(codec.dumps_bytes({name: row.get(name) for name in self.columns}) + b"\n" for row in rows)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Fichier en écriture seule vidé après chaque lot; tell() compte tous les octets écrits (pied Parquet)"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ArrowWriterBase(ExportWriter):
+    def __init__(self, columns: Sequence[str], compression: str = "none"):
+        super().__init__(columns, compression)
+        self.pa = _import_pyarrow()
+        self.schema = self.pa.schema([(name, _arrow_type(self.pa, name)) for name in self.columns])
+        self._sink = _ChunkSink()
+        self._writer = self._open(self._sink)
+
+    def _open(self, sink):
+        raise NotImplementedError
+
+    def write(self, rows: List[Row]) -> bytes:
+        arrays = [
+            self.pa.array([_arrow_value(name, row.get(name)) for row in rows], type=field.type)
+            for name, field in zip(self.columns, self.schema)
+        ]
+        self._write_batch(self.pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self._sink.drain()
+
+    def _write_batch(self, batch) -> None:
+        self._writer.write_batch(batch)
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+class ArrowWriter(_ArrowWriterBase):
+    """Flux Arrow IPC (pyarrow.ipc.open_stream côté lecteur)"""
+
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+    internal_compressions = ("zstd",)
+
+    def _open(self, sink):
+        import pyarrow.ipc as ipc
+
+        options = ipc.IpcWriteOptions(compression=None if self.compression == "none" else self.compression)
+        return ipc.new_stream(sink, self.schema, options=options)
+
+
+class ParquetWriter(_ArrowWriterBase):
+    """Parquet: un groupe de lignes par lot"""
+
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+    internal_compressions = ("gzip", "zstd")
+
+    def _open(self, sink):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(sink, self.schema, compression=self.compression)
+
+    def _write_batch(self, batch) -> None:
+        self._writer.write_table(self.pa.Table.from_batches([batch]))
+
+
+EXPORT_FORMATS = {
+    "csv": CsvWriter,
+    "ndjson": NdjsonWriter,
+    "arrow": ArrowWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return codec.dumps(value)
+    return "" if value is None else value
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Formats arrow et parquet indisponibles: installer pyarrow") from None
+    return pyarrow
+
+
+def _arrow_type(pa, name: str):
+    if name in _TEXT_COLUMNS:
+        return pa.string()
+    return pa.int64() if name in _INTEGER_COLUMNS else pa.float64()
+
+
+def _arrow_value(name: str, value: Any) -> Any:
+    if value is None or name in _TEXT_COLUMNS:
+        return value
+    try:
+        return int(value) if name in _INTEGER_COLUMNS else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compressor(compression: str):
+    """Objet compress()/flush() (interface zlib), None sans compression"""
+    if compression == "gzip":
+        return zlib.compressobj(TELEMETRY_EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: en-tête gzip
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Compression zstd indisponible: installer zstandard") from None
+        return zstandard.ZstdCompressor(level=TELEMETRY_EXPORT_ZSTD_LEVEL).compressobj()
+    return None
+
+
+class TelemetryExport:
+    """Encodeur + compression d'un export; lève ValueError si la combinaison est invalide"""
+
+    def __init__(self, columns: Sequence[str], format: str = "csv", compression: str = "none"):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Format inconnu: {format} (attendu: {', '.join(EXPORT_FORMATS)})")
+        if compression not in EXPORT_COMPRESSIONS:
+            raise ValueError(f"Compression inconnue: {compression} (attendu: {', '.join(EXPORT_COMPRESSIONS)})")
+        writer_class = EXPORT_FORMATS[format]
+        internal = compression != "none" and compression in writer_class.internal_compressions
+        if writer_class.internal_compressions and compression != "none" and not internal:
+            raise ValueError(
+                f"Compression {compression} non gérée par {format} "
+                f"(attendu: none, {', '.join(writer_class.internal_compressions)})"
+            )
+        self.writer = writer_class(columns, compression if internal else "none")
+        self.compression = compression
+        self._compressor = None if internal else _compressor(compression)
+
+    @property
+    def media_type(self) -> str:
+        if self._compressor is None:
+            return self.writer.media_type
+        return "application/gzip" if self.compression == "gzip" else "application/zstd"
+
+    def filename(self, stem: str) -> str:
+        suffix = {"gzip": ".gz", "zstd": ".zst"}.get(self.compression, "") if self._compressor else ""
+        return f"{stem}.{self.writer.extension}{suffix}"
+
+    def encode(self, rows: List[Row]) -> bytes:
+        return self._compress(self.writer.write(rows))
+
+    def finish(self) -> bytes:
+        data = self._compress(self.writer.close())
+        if self._compressor is not None:
+            data += self._compressor.flush()
+        return data
+
+    def _compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) if self._compressor is not None and data else data
+
+
+async def iter_export_batches(
+    storage,
+    vehicle_id: int,
+    columns: Sequence[str],
+    gte: Optional[Dict[str, Any]] = None,
+    lte: Optional[Dict[str, Any]] = None,
+    batch_size: int = TELEMETRY_EXPORT_BATCH_SIZE,
+) -> AsyncIterator[List[Row]]:
+    """Lots de lignes par ordre chronologique (curseur Postgres ou pages du backend de stockage)"""
+    if TELEMETRY_SINK != "postgres":
+        async for rows in iter_pages(
+            storage, vehicle_id, columns, gte=gte, lte=lte, page_size=batch_size, desc=False
+        ):
+            yield rows
+        return
+
+    boundary = await asyncio.to_thread(archived_until, vehicle_id)
+    low = seconds(gte["recorded_at"]) if gte and "recorded_at" in gte else None
+    high = seconds(lte["recorded_at"]) if lte and "recorded_at" in lte else None
+    if boundary is not None and (low is None or low < boundary):
+        # Jours archivés: pages de la base fusionnées avec les archives (telemetry_query)
+        archived_only = high is not None and high < boundary
+        async for rows in iter_pages(
+            storage, vehicle_id, columns, gte=gte, lte=lte if archived_only else {"recorded_at": _iso(boundary - 1e-6)},
+            page_size=batch_size, desc=False,
+        ):
+            yield rows
+        if archived_only:
+            return
+        gte = {**(gte or {}), "recorded_at": _iso(boundary)}
+
+    batches = get_telemetry_sink().iter_batches(columns, vehicle_id, gte=gte, lte=lte, batch_size=batch_size)
+    try:
+        while True:
+            rows = await asyncio.to_thread(next, batches, None)
+            if rows is None:
+                return
+            yield rows
+    finally:
+        # Client déconnecté ou fin du parcours: fermer le curseur et rendre la connexion
+        await asyncio.to_thread(batches.close)
+
+
+def _iso(value: float) -> str:
+    return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+
+
+async def stream_export(export: TelemetryExport, batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    """Octets de l'export; l'encodage et la compression de chaque lot tournent hors de la boucle asyncio"""
+    async for rows in batches:
+        data = await asyncio.to_thread(export.encode, rows)
+        if data:
+            yield data
+    data = await asyncio.to_thread(export.finish)
+    if data:
+        yield data
@@ -0,0 +1,161 @@
+"""
+Lecture paginée de la table telemetry: projection de colonnes et curseur (keyset)
+
+- fields: colonnes demandées, validées contre les PIDs connus (TELEMETRY_COLUMNS)
+  et les colonnes techniques; id et recorded_at sont toujours inclus (curseur)
+- curseur: tuple (recorded_at, id) de la dernière ligne servie, encodé en base64;
+  la page suivante filtre `(recorded_at, id) < curseur` au lieu d'un OFFSET
+  (coût constant quelle que soit la profondeur). Une page plus courte que
+  demandé n'est pas la dernière: PostgREST plafonne chaque réponse (max-rows,
+  1000 par défaut sur Supabase). Seule une page vide termine le parcours.
+- flux NDJSON: pages successives lues à la demande, une ligne JSON par enregistrement
+- archives: chaque page est complétée par les lignes archivées de la même plage
+  (rétention, app/telemetry_archive.py), de façon transparente pour les appelants
+"""
+import asyncio
+import base64
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from . import codec
+from .persistence_scheduler import TELEMETRY_SAVE_AGGREGATE
+from .telemetry_archive import DAY_SECONDS, telemetry_archive
+from .telemetry_state import TELEMETRY_COLUMNS
+
+# === CONFIGURATION ===
+TELEMETRY_PAGE_SIZE = int(os.getenv("TELEMETRY_PAGE_SIZE", "1000"))  # lignes par lecture (flux NDJSON)
+
+BASE_COLUMNS = ("id", "vehicle_id", "device_id", "recorded_at", "created_at")
+# Migration optionnelle SUPABASE_TELEMETRY_AGGREGATES.sql: lue par défaut seulement si
+# TELEMETRY_SAVE_AGGREGATE=true, sinon uniquement si demandée explicitement (fields=)
+AGGREGATE_COLUMNS = ("sample_count",)
+QUERYABLE_COLUMNS = frozenset(BASE_COLUMNS + AGGREGATE_COLUMNS + TELEMETRY_COLUMNS)
+CURSOR_COLUMNS = ("recorded_at", "id")
+
+# Colonnes de get_latest_data (dernière ligne diffusée au dashboard): sans aggregates ni ingest_key
+LATEST_COLUMNS = BASE_COLUMNS + (AGGREGATE_COLUMNS if TELEMETRY_SAVE_AGGREGATE else ()) + TELEMETRY_COLUMNS
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def parse_fields(fields: Optional[str], default: Sequence[str]) -> List[str]:
+    """
+    "rpm, vehicle_speed" → ["id", "recorded_at", "rpm", "vehicle_speed"]
+
+    Raises:
+        ValueError: champ inconnu
+    """
+    requested = [name.strip() for name in fields.split(",") if name.strip()] if fields else list(default)
+    unknown = [name for name in requested if name not in QUERYABLE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Champ(s) inconnu(s): {', '.join(unknown)}")
+    return list(dict.fromkeys([*CURSOR_COLUMNS, *requested]))
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = codec.dumps_bytes([row["recorded_at"], row["id"]])
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Raises:
+        ValueError: curseur illisible
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        recorded_at, row_id = codec.loads(raw)
+    except (ValueError, TypeError, *codec.DecodeError):
+        raise ValueError("Curseur invalide") from None
+    if not isinstance(recorded_at, str) or not isinstance(row_id, int):
+        raise ValueError("Curseur invalide")
+    return {"recorded_at": recorded_at, "id": row_id}
+
+
+async def fetch_page(
+    storage,
+    vehicle_id: int,
+    columns: Sequence[str],
+    limit: int,
+    gte: Optional[Dict[str, Any]] = None,
+    lte: Optional[Dict[str, Any]] = None,
+    after: Optional[Dict[str, Any]] = None,
+    desc: bool = True,
+    archives: bool = True,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Une page (du plus récent au plus ancien, sauf desc=False) et le curseur de la suivante (None si page vide)"""
+    rows = await storage.select(
+        "telemetry",
+        ", ".join(columns),
+        eq={"vehicle_id": vehicle_id},
+        gte=gte,
+        lte=lte,
+        order="recorded_at, id",
+        desc=desc,
+        limit=limit,
+        after=after,
+    )
+    if archives:
+        rows = await asyncio.to_thread(
+            telemetry_archive.merge_page, rows, vehicle_id, columns, limit, gte, lte, after, desc
+        )
+    # Page éventuellement tronquée par le serveur (max-rows): seule une page vide est la dernière
+    next_cursor = encode_cursor(rows[-1]) if rows else None
+    return rows, next_cursor
+
+
+def archived_until(vehicle_id: int) -> Optional[float]:
+    """Fin (secondes epoch, exclue) du dernier jour archivé du véhicule; None sans archive"""
+    days = telemetry_archive.days(vehicle_id)
+    return days[-1] + DAY_SECONDS if days else None
+
+
+async def iter_pages(
+    storage,
+    vehicle_id: int,
+    columns: Sequence[str],
+    gte: Optional[Dict[str, Any]] = None,
+    lte: Optional[Dict[str, Any]] = None,
+    after: Optional[Dict[str, Any]] = None,
+    limit: Optional[int] = None,
+    page_size: int = TELEMETRY_PAGE_SIZE,
+    desc: bool = True,
+    archives: bool = True,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Parcourt la plage page par page (une seule page en mémoire)"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        rows, next_cursor = await fetch_page(storage, vehicle_id, columns, size, gte, lte, after, desc, archives)
+        if rows:
+            yield rows
+        if remaining is not None:
+            remaining -= len(rows)
+        if next_cursor is None:
+            return
+        after = {"recorded_at": rows[-1]["recorded_at"], "id": rows[-1]["id"]}
+
+
+async def iter_rows(storage, vehicle_id: int, columns: Sequence[str], **kwargs) -> AsyncIterator[Dict[str, Any]]:
+    """Comme iter_pages, ligne par ligne"""
+    async for rows in iter_pages(storage, vehicle_id, columns, **kwargs):
+        for row in rows:
+            yield row
+
+
+async def ndjson_lines(rows: AsyncIterator[Dict[str, Any]], chunk_rows: int = 200) -> AsyncIterator[bytes]:
+    """Sérialise un flux de lignes en NDJSON, par paquets de chunk_rows lignes"""
+    chunk: List[bytes] = []
+    async for row in rows:
+        chunk.append(codec.dumps_bytes(row))
+        if len(chunk) >= chunk_rows:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+def wants_ndjson(format: Optional[str], accept: Optional[str]) -> bool:
+    if format:
+        return format.lower() == "ndjson"
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
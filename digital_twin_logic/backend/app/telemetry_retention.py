@@ -0,0 +1,185 @@
+"""
+Rétention de la télémétrie brute (tâche de fond de l'application)
+
+Les lignes de `telemetry` plus anciennes que TELEMETRY_RETENTION_DAYS (jours UTC
+complets) sont déplacées dans les archives (app/telemetry_archive.py), un
+véhicule-jour à la fois: lecture par pages → fichier d'archive → suppression.
+Seuls les agrégats (telemetry_rollups) restent en base pour ces périodes; les
+lectures de telemetry_query complètent les plages anciennes depuis les archives.
+
+Les colonnes de la migration optionnelle des agrégats (sample_count, aggregates)
+ne sont lues que si la table telemetry les a (vérifié au premier passage); sans
+elles, les lignes sont archivées avec ces colonnes à null.
+
+La suppression ne vise que les ids effectivement écrits dans l'archive (par
+paquets de TELEMETRY_RETENTION_DELETE_CHUNK): une ligne arrivée en retard pendant
+le passage reste en base et sera archivée au passage suivant.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from .storage import StorageError
+from .telemetry_archive import (
+    AGGREGATE_ARCHIVE_COLUMNS, ARCHIVE_BASE_COLUMNS, ARCHIVE_COLUMNS, DAY_SECONDS, TelemetryArchive, day_name, seconds,
+    telemetry_archive,
+)
+from .telemetry_query import iter_pages
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+TELEMETRY_RETENTION_ENABLED = os.getenv("TELEMETRY_RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+TELEMETRY_RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "30"))
+TELEMETRY_RETENTION_INTERVAL = float(os.getenv("TELEMETRY_RETENTION_INTERVAL", "3600"))  # secondes
+# Véhicules-jours archivés au maximum par passage (limite la charge de la base)
+TELEMETRY_RETENTION_MAX_PARTITIONS = int(os.getenv("TELEMETRY_RETENTION_MAX_PARTITIONS", "50"))
+TELEMETRY_RETENTION_PAGE_SIZE = int(os.getenv("TELEMETRY_RETENTION_PAGE_SIZE", "5000"))
+# Ids par requête de suppression (longueur d'URL PostgREST, paramètres SQLite)
+TELEMETRY_RETENTION_DELETE_CHUNK = int(os.getenv("TELEMETRY_RETENTION_DELETE_CHUNK", "500"))
+
+
+def _iso(value: float) -> str:
+    # Même forme que les horodatages stockés (comparaison textuelle en SQLite)
+    return datetime.fromtimestamp(value, tz=timezone.utc).isoformat()
+
+
+class TelemetryRetention:
+    def __init__(
+        self,
+        enabled: bool = TELEMETRY_RETENTION_ENABLED,
+        retention_days: int = TELEMETRY_RETENTION_DAYS,
+        archive: TelemetryArchive = telemetry_archive,
+        storage_factory: Optional[Callable[[], Any]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.enabled = enabled
+        self.retention_days = retention_days
+        self.archive = archive
+        self._storage_factory = storage_factory
+        self._clock = clock
+        self._run_lock = asyncio.Lock()
+        self.archived_rows = 0
+        self.archived_partitions = 0
+        self.errors = 0
+        self.last_run: Optional[float] = None
+        self._source_columns: Optional[Sequence[str]] = None
+
+    def _storage(self):
+        if self._storage_factory is not None:
+            return self._storage_factory()
+        from .storage import get_storage
+        return get_storage()
+
+    def cutoff(self) -> float:
+        """Début du premier jour conservé en base (UTC)"""
+        horizon = self._clock() - self.retention_days * DAY_SECONDS
+        return horizon - horizon % DAY_SECONDS
+
+    async def _oldest_partition(self, storage, cutoff: float) -> Optional[Tuple[int, float]]:
+        rows = await storage.select(
+            "telemetry",
+            "vehicle_id, recorded_at",
+            lte={"recorded_at": _iso(cutoff - 1e-6)},
+            order="recorded_at",
+            limit=1,
+        )
+        if not rows:
+            return None
+        ts = seconds(rows[0]["recorded_at"])
+        return rows[0]["vehicle_id"], ts - ts % DAY_SECONDS
+
+    async def source_columns(self, storage) -> Sequence[str]:
+        """Colonnes lues en base: celles des agrégats seulement si la migration a été appliquée"""
+        if self._source_columns is None:
+            try:
+                await storage.select("telemetry", ", ".join(AGGREGATE_ARCHIVE_COLUMNS), limit=1)
+                self._source_columns = ARCHIVE_COLUMNS
+            except StorageError as e:
+                # Colonne inconnue: 4xx; réseau ou 5xx: propagée, nouvel essai au passage suivant
+                if e.status_code is None or e.status_code >= 500:
+                    raise
+                logger.info("ℹ️ Rétention: colonnes sample_count/aggregates absentes, archivées à null")
+                self._source_columns = ARCHIVE_BASE_COLUMNS
+        return self._source_columns
+
+    async def archive_partition(self, storage, vehicle_id: int, day_start: float) -> int:
+        """Déplace les lignes d'un véhicule-jour de la base vers l'archive"""
+        gte = {"recorded_at": _iso(day_start)}
+        lte = {"recorded_at": _iso(day_start + DAY_SECONDS - 1e-6)}
+        columns = await self.source_columns(storage)
+        rows = []
+        # iter_pages ne s'arrête que sur une page vide (ou une erreur, propagée): le jour est lu en entier
+        async for page in iter_pages(
+            storage, vehicle_id, columns, gte=gte, lte=lte, page_size=TELEMETRY_RETENTION_PAGE_SIZE,
+            desc=False, archives=False,
+        ):
+            rows.extend(page)
+        if not rows:
+            return 0
+        await asyncio.to_thread(self.archive.write, vehicle_id, day_start, rows)
+        # Fichier écrit (atomiquement) avant toute suppression, limitée aux ids archivés
+        ids = [row["id"] for row in rows]
+        for start in range(0, len(ids), TELEMETRY_RETENTION_DELETE_CHUNK):
+            await storage.delete(
+                "telemetry",
+                eq={"vehicle_id": vehicle_id},
+                in_={"id": ids[start:start + TELEMETRY_RETENTION_DELETE_CHUNK]},
+                returning=False,
+            )
+        return len(rows)
+
+    async def run_once(self) -> int:
+        """Un passage de rétention; retourne le nombre de lignes archivées"""
+        if not self.enabled:
+            return 0
+        async with self._run_lock:
+            storage = self._storage()
+            cutoff = self.cutoff()
+            archived = 0
+            done = set()
+            try:
+                for _ in range(TELEMETRY_RETENTION_MAX_PARTITIONS):
+                    partition = await self._oldest_partition(storage, cutoff)
+                    if partition is None:
+                        break
+                    if partition in done:
+                        # Lignes restées en base après suppression: ne pas boucler
+                        logger.warning(f"⚠️ Rétention: véhicule {partition[0]}, {day_name(partition[1])} non purgé")
+                        break
+                    done.add(partition)
+                    vehicle_id, day_start = partition
+                    count = await self.archive_partition(storage, vehicle_id, day_start)
+                    archived += count
+                    self.archived_partitions += 1
+                    logger.info(f"🗄️ Télémétrie archivée: véhicule {vehicle_id}, {day_name(day_start)} ({count} lignes)")
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Rétention de la télémétrie interrompue: {e}")
+            self.archived_rows += archived
+            self.last_run = self._clock()
+            return archived
+
+    async def run_periodically(self, interval: float = TELEMETRY_RETENTION_INTERVAL) -> None:
+        if not self.enabled or interval <= 0:
+            return
+        while True:
+            await self.run_once()
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "retention_days": self.retention_days,
+            "archived_rows": self.archived_rows,
+            "archived_partitions": self.archived_partitions,
+            "errors": self.errors,
+            "last_run": self.last_run,
+        }
+
+
+# Instance globale
+telemetry_retention = TelemetryRetention()
@@ -0,0 +1,282 @@
+"""
+Agrégats temporels continus de la télémétrie (1 min / 1 h / 1 jour par véhicule)
+
+Chaque message décodé alimente, en mémoire, les seaux courants du véhicule
+(min/max/somme/nombre par PID analogique, comme SampleAggregator). Les seaux
+modifiés sont écrits périodiquement dans la table telemetry_rollups (upsert sur
+vehicle_id, resolution, bucket_start), sans relire la table telemetry.
+
+Un seau rencontré pour la première fois par ce processus (redémarrage, message
+tardif après l'éviction d'un seau fermé) est fusionné avec la ligne déjà en base
+avant sa première écriture: les agrégats restent exacts d'un redémarrage à l'autre.
+
+Un véhicule doit être traité par un seul worker (MQTT_INGEST_MODE=single ou
+partition): en mode shared, deux workers réécriraient le même seau.
+
+Table: SUPABASE_TELEMETRY_ROLLUPS.sql (créée automatiquement avec STORAGE_BACKEND=sqlite)
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .persistence_scheduler import SampleAggregator
+from .telemetry_state import COLUMN_INDEX, TELEMETRY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+TELEMETRY_ROLLUPS_ENABLED = os.getenv("TELEMETRY_ROLLUPS_ENABLED", "false").lower() in ("1", "true", "yes")
+TELEMETRY_ROLLUP_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_ROLLUP_FLUSH_INTERVAL", "10"))  # secondes
+TELEMETRY_ROLLUP_TABLE = os.getenv("TELEMETRY_ROLLUP_TABLE", "telemetry_rollups")
+
+# Du plus fin au plus grossier
+ROLLUP_RESOLUTIONS: Tuple[Tuple[str, int], ...] = (("1m", 60), ("1h", 3600), ("1d", 86400))
+RESOLUTION_SECONDS = dict(ROLLUP_RESOLUTIONS)
+
+BucketKey = Tuple[int, str, int]  # (vehicle_id, resolution, début du seau en secondes epoch)
+
+
+def format_bucket(seconds: int) -> str:
+    """Horodatage UTC à format fixe (comparable en texte avec le backend SQLite)"""
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def select_resolution(start: float, end: float, max_points: int) -> str:
+    """Résolution la plus fine dont le nombre de seaux sur [start, end] tient dans max_points"""
+    for name, seconds in ROLLUP_RESOLUTIONS:
+        if math.floor(end / seconds) - math.floor(start / seconds) + 1 <= max_points:
+            return name
+    return ROLLUP_RESOLUTIONS[-1][0]
+
+
+class RollupBucket(SampleAggregator):
+    """Agrégat d'un seau; `loaded`: la ligne existante en base y a déjà été fusionnée"""
+
+    __slots__ = ("dirty", "loaded")
+
+    def __init__(self):
+        super().__init__()
+        self.dirty = False
+        self.loaded = False
+
+    def merge(self, row: Dict[str, Any]) -> None:
+        """Ajoute les agrégats d'une ligne telemetry_rollups à ce seau"""
+        self.samples += row.get("sample_count") or 0
+        for name, stat in (row.get("stats") or {}).items():
+            index = COLUMN_INDEX.get(name)
+            count = stat.get("count") or 0
+            if index is None or not count:
+                continue
+            if self.counts[index] == 0:
+                self.mins[index], self.maxs[index] = stat["min"], stat["max"]
+            else:
+                self.mins[index] = min(self.mins[index], stat["min"])
+                self.maxs[index] = max(self.maxs[index], stat["max"])
+            self.sums[index] += stat["sum"]
+            self.counts[index] += count
+
+    def to_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            TELEMETRY_COLUMNS[index]: {
+                "min": self.mins[index],
+                "max": self.maxs[index],
+                "sum": self.sums[index],
+                "count": count,
+            }
+            for index, count in enumerate(self.counts)
+            if count
+        }
+
+
+def rollup_point(row: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Ligne telemetry_rollups → point de l'API: {"bucket_start", "sample_count", pid: {min, max, avg, count}}"""
+    stats = row.get("stats") or {}
+    names = stats if fields is None else [name for name in fields if name in stats]
+    point = {"bucket_start": row["bucket_start"], "sample_count": row.get("sample_count")}
+    for name in names:
+        stat = stats[name]
+        point[name] = {
+            "min": stat["min"],
+            "max": stat["max"],
+            "avg": round(stat["sum"] / stat["count"], 4),
+            "count": stat["count"],
+        }
+    return point
+
+
+class TelemetryRollups:
+    """Seaux ouverts en mémoire + écriture périodique des seaux modifiés"""
+
+    def __init__(
+        self,
+        enabled: bool = TELEMETRY_ROLLUPS_ENABLED,
+        table: str = TELEMETRY_ROLLUP_TABLE,
+        storage_factory: Optional[Callable[[], Any]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.enabled = enabled
+        self.table = table
+        self._storage_factory = storage_factory
+        self._clock = clock
+        self._buckets: Dict[BucketKey, RollupBucket] = {}
+        self._lock = threading.Lock()
+        self.samples_seen = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def _storage(self):
+        if self._storage_factory is not None:
+            return self._storage_factory()
+        from .storage import get_storage
+        return get_storage()
+
+    def observe(self, vehicle_id: int, values: List[Any], indexes: Iterable[int], timestamp: float) -> None:
+        """Ajoute un message décodé (appelé sous state.lock) aux seaux 1m/1h/1d du véhicule"""
+        if not self.enabled:
+            return
+        indexes = tuple(indexes)
+        with self._lock:
+            self.samples_seen += 1
+            for name, seconds in ROLLUP_RESOLUTIONS:
+                key = (vehicle_id, name, int(timestamp // seconds) * seconds)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = RollupBucket()
+                bucket.add(values, indexes)
+                bucket.dirty = True
+
+    async def _load_existing(self, storage, keys: List[BucketKey]) -> None:
+        for key in keys:
+            vehicle_id, resolution, start = key
+            rows = await storage.select(
+                self.table, "sample_count, stats",
+                eq={"vehicle_id": vehicle_id, "resolution": resolution, "bucket_start": format_bucket(start)},
+            )
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                for row in rows:
+                    bucket.merge(row)
+                bucket.loaded = True
+
+    async def flush(self) -> int:
+        """Écrit les seaux modifiés depuis la dernière écriture; retourne le nombre de lignes"""
+        with self._lock:
+            dirty_keys = [key for key, bucket in self._buckets.items() if bucket.dirty]
+            unloaded = [key for key in dirty_keys if not self._buckets[key].loaded]
+        if not dirty_keys:
+            self._evict()
+            return 0
+
+        storage = self._storage()
+        try:
+            await self._load_existing(storage, unloaded)
+        except Exception as e:
+            self.flush_errors += 1
+            logger.error(f"❌ Lecture des agrégats existants impossible: {e}")
+            return 0
+
+        now = format_bucket(int(self._clock()))
+        with self._lock:
+            dirty = [(key, bucket) for key, bucket in self._buckets.items() if bucket.dirty and bucket.loaded]
+            rows = [
+                {
+                    "vehicle_id": vehicle_id,
+                    "resolution": resolution,
+                    "bucket_start": format_bucket(start),
+                    "sample_count": bucket.samples,
+                    "stats": bucket.to_stats(),
+                    "updated_at": now,
+                }
+                for (vehicle_id, resolution, start), bucket in dirty
+            ]
+            for _, bucket in dirty:
+                bucket.dirty = False
+        if not rows:
+            return 0
+
+        try:
+            await storage.upsert(self.table, rows, on_conflict="vehicle_id,resolution,bucket_start")
+        except Exception as e:
+            # Les seaux restent en mémoire: nouvelle tentative à la prochaine écriture
+            with self._lock:
+                for _, bucket in dirty:
+                    bucket.dirty = True
+            self.flush_errors += 1
+            logger.error(f"❌ Écriture des agrégats ({len(rows)} seaux) impossible: {e}")
+            return 0
+
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self._evict()
+        return len(rows)
+
+    def _evict(self) -> None:
+        """Oublie les seaux fermés et déjà écrits (un message tardif rechargera la ligne)"""
+        now = self._clock()
+        with self._lock:
+            closed = [
+                key for key, bucket in self._buckets.items()
+                if not bucket.dirty and key[2] + RESOLUTION_SECONDS[key[1]] <= now
+            ]
+            for key in closed:
+                del self._buckets[key]
+
+    async def run_periodically(self, interval: float = TELEMETRY_ROLLUP_FLUSH_INTERVAL) -> None:
+        if not self.enabled or interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def query(
+        self,
+        vehicle_id: int,
+        start: float,
+        end: float,
+        max_points: int = 500,
+        resolution: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        storage=None,
+    ) -> Dict[str, Any]:
+        """Points agrégés de [start, end] (secondes epoch), à la résolution choisie"""
+        resolution = resolution or select_resolution(start, end, max_points)
+        seconds = RESOLUTION_SECONDS[resolution]
+        storage = storage or self._storage()
+        rows = await storage.select(
+            self.table, "bucket_start, sample_count, stats",
+            eq={"vehicle_id": vehicle_id, "resolution": resolution},
+            gte={"bucket_start": format_bucket(int(start // seconds) * seconds)},
+            lte={"bucket_start": format_bucket(int(end))},
+            order="bucket_start",
+        )
+        return {
+            "vehicle_id": vehicle_id,
+            "resolution": resolution,
+            "bucket_seconds": seconds,
+            "from": format_bucket(int(start)),
+            "to": format_bucket(int(end)),
+            "points": [rollup_point(row, fields) for row in rows],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            open_buckets = len(self._buckets)
+        return {
+            "enabled": self.enabled,
+            "open_buckets": open_buckets,
+            "samples_seen": self.samples_seen,
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+telemetry_rollups = TelemetryRollups()
@@ -0,0 +1,179 @@
+"""
+État télémétrique en mémoire, par véhicule
+
+Remplace l'ancien dictionnaire global `latest_data` partagé par tous les devices:
+chaque véhicule possède son propre enregistrement compact (slots + liste de
+valeurs indexée par colonne), ce qui évite le mélange des PIDs lorsque plusieurs
+devices publient en même temps.
+
+L'historique des graphiques est un buffer circulaire typé (app/history_buffer.py).
+"""
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .history_buffer import HistoryBuffer, Timestamp, to_microseconds
+
+# Colonnes PID de la table telemetry, dans un ordre fixe (index = position dans VehicleState.values)
+TELEMETRY_COLUMNS = (
+    # PIDs essentiels (04-11)
+    "engine_load",
+    "coolant_temperature",
+    "intake_pressure",
+    "rpm",
+    "vehicle_speed",
+    "intake_air_temp",
+    "maf_airflow",
+    "throttle_position",
+
+    # PIDs étendus
+    "monitor_status",
+    "oxygen_sensors_present_banks",
+    "obd_standard",
+    "time_since_engine_start",
+    "pids_supported_21_40",
+    "distance_mil_on",
+    "fuel_rail_pressure",
+    "oxygen_sensor1_faer",
+    "oxygen_sensor1_voltage",
+    "oxygen_sensor2_faer",
+    "egr_commanded",
+    "egr_error",
+    "egr_commanded_error",
+    "warmups_since_code_clear",
+    "distance_since_code_clear",
+    "absolute_barometric_pressure",
+    "pids_supported_41_60",
+    "pids_supported_61_80",
+    "pids_supported_81_a0",
+    "monitor_status_drive_cycle",
+    "control_module_voltage",
+    "relative_throttle_position",
+    "ambient_air_temperature",
+    "abs_throttle_position_d",
+    "abs_throttle_position_e",
+    "commanded_throttle_actuator",
+    "max_faer",
+    "max_oxy_sensor_voltage",
+    "max_oxy_sensor_current",
+    "max_intake_pressure",
+    "engine_coolant_temp1",
+    "engine_coolant_temp2",
+    "charge_air_cooler_temp",
+    "egt_bank1",
+    "diesel_aftertreatment",
+)
+
+COLUMN_INDEX = {name: index for index, name in enumerate(TELEMETRY_COLUMNS)}
+
+# Champs dont la présence indique des données exploitables
+ESSENTIAL_FIELDS = ("rpm", "vehicle_speed", "engine_load", "coolant_temperature", "control_module_voltage")
+_ESSENTIAL_INDEXES = tuple(COLUMN_INDEX[name] for name in ESSENTIAL_FIELDS)
+
+# Champs conservés dans l'historique (graphiques Analytics)
+HISTORY_FIELDS = ("rpm", "vehicle_speed", "coolant_temperature", "engine_load", "fuel_rail_pressure", "control_module_voltage")
+_HISTORY_INDEXES = tuple(COLUMN_INDEX[name] for name in HISTORY_FIELDS)
+
+# Capacité de l'historique en mémoire par véhicule (7200 points ≈ 2 h à 1 message/s, ~400 Ko)
+HISTORY_MAX_POINTS = int(os.getenv("TELEMETRY_HISTORY_MAX_POINTS", "7200"))
+
+
+class VehicleState:
+    """Dernières valeurs connues + historique récent d'un véhicule"""
+
+    __slots__ = (
+        "vehicle_id",
+        "device_id",
+        "device_code",
+        "values",
+        "state",
+        "last_message_time",
+        "history",
+        "last_saved_data",
+        "lock",
+    )
+
+    def __init__(self, vehicle_id: int, history_size: int = HISTORY_MAX_POINTS):
+        self.vehicle_id = vehicle_id
+        self.device_id: Optional[int] = None
+        self.device_code: Optional[str] = None
+        self.values: List[Any] = [None] * len(TELEMETRY_COLUMNS)
+        self.state = "offline"  # "offline", "running"
+        self.last_message_time: Optional[float] = None
+        self.history = HistoryBuffer(HISTORY_FIELDS, history_size)
+        self.last_saved_data: Optional[Dict[str, Any]] = None  # dernières valeurs quand la voiture s'éteint
+        self.lock = threading.Lock()
+
+    def get(self, column: str) -> Any:
+        return self.values[COLUMN_INDEX[column]]
+
+    def set(self, column: str, value: Any) -> None:
+        self.values[COLUMN_INDEX[column]] = value
+
+    def has_essential_data(self) -> bool:
+        values = self.values
+        return any(values[i] is not None for i in _ESSENTIAL_INDEXES)
+
+    def append_history(self, timestamp: Timestamp = None) -> None:
+        """Ajoute un point d'historique à partir des valeurs courantes (None: maintenant)"""
+        values = self.values
+        self.history.append(to_microseconds(timestamp), [values[index] for index in _HISTORY_INDEXES])
+
+    def to_row(self) -> Dict[str, Any]:
+        """Ligne prête à insérer dans la table telemetry (sans recorded_at)"""
+        row = {"vehicle_id": self.vehicle_id, "device_id": self.device_id}
+        row.update(zip(TELEMETRY_COLUMNS, self.values))
+        return row
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Format historique de `latest_data` (diffusion WebSocket / API)"""
+        data = {"vehicle_id": self.vehicle_id, "device_id": self.device_id, "device_code": self.device_code}
+        data.update(zip(TELEMETRY_COLUMNS, self.values))
+        return data
+
+    def history_list(self, last: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Points d'historique au format dict (les last plus récents, ou tous)"""
+        return self.history.to_points(last, extra={"vehicle_id": self.vehicle_id})
+
+    def history_arrays(self, last: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Historique en colonnes NumPy (copie): {"timestamp": datetime64[us], champ: float64}"""
+        return self.history.to_numpy(last)
+
+
+class TelemetryStateStore:
+    """Registre thread-safe des VehicleState, indexé par vehicle_id"""
+
+    def __init__(self, history_size: int = HISTORY_MAX_POINTS):
+        self._states: Dict[int, VehicleState] = {}
+        self._lock = threading.Lock()
+        self.history_size = history_size
+
+    def get(self, vehicle_id: int) -> Optional[VehicleState]:
+        return self._states.get(vehicle_id)
+
+    def get_or_create(self, vehicle_id: int) -> VehicleState:
+        state = self._states.get(vehicle_id)
+        if state is None:
+            with self._lock:
+                state = self._states.get(vehicle_id)
+                if state is None:
+                    state = VehicleState(vehicle_id, self.history_size)
+                    self._states[vehicle_id] = state
+        return state
+
+    def __iter__(self) -> Iterator[VehicleState]:
+        with self._lock:
+            states = list(self._states.values())
+        return iter(states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def total_history_points(self) -> int:
+        return sum(len(state.history) for state in self)
+
+
+# Registre partagé par le handler MQTT et l'API
+state_store = TelemetryStateStore()
@@ -0,0 +1,496 @@
+"""
+Journal d'écriture anticipée (WAL) sur disque pour la télémétrie
+
+Quand Supabase est lent ou indisponible, l'écrivain en mémoire finit par perdre
+des lignes (file bornée, erreurs d'insertion). Avec TELEMETRY_WAL_ENABLED=true,
+chaque ligne est d'abord ajoutée à un journal local:
+
+- segments `telemetry-<n>.wal` en ajout seul, rotation à TELEMETRY_WAL_SEGMENT_BYTES
+- enregistrements binaires: longueur (uint32) + CRC32 (uint32) + JSON de la ligne
+- fsync configurable: always (chaque ligne), interval (au plus toutes les
+  TELEMETRY_WAL_FSYNC_INTERVAL secondes), never (laissé à l'OS)
+
+Un thread de rejeu lit le journal à partir du dernier point de contrôle et
+l'envoie à la BDD par lots. Le point de contrôle n'avance qu'après un envoi
+réussi (au moins une fois); chaque ligne porte une clé `ingest_key` et l'envoi
+est un upsert qui ignore les doublons (voir SUPABASE_TELEMETRY_INGEST_KEY.sql).
+
+Panne (réseau, délai, 5xx): le lot est renvoyé plus tard, avec un délai
+croissant. Refus des données (4xx, contrainte, type: voir
+storage.is_rejected_write): le lot est coupé en deux jusqu'à isoler les lignes
+refusées, qui sont mises de côté dans `dead_letter.jsonl` (ligne, erreur,
+date) au lieu de bloquer tout le rejeu derrière elles.
+
+Les ajouts au journal (écriture, fsync selon la politique) sont faits hors de
+la boucle asyncio: submit() est appelé dans un thread (blocking_submit).
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import codec
+from .storage.base import is_rejected_write
+from .telemetry_writer import (
+    TELEMETRY_BATCH_SIZE,
+    TELEMETRY_LINGER_SECONDS,
+    Row,
+    telemetry_writer,
+)
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION DU JOURNAL ===
+TELEMETRY_WAL_ENABLED = os.getenv("TELEMETRY_WAL_ENABLED", "false").lower() in ("1", "true", "yes")
+TELEMETRY_WAL_DIR = os.getenv("TELEMETRY_WAL_DIR", "data/telemetry_wal")
+TELEMETRY_WAL_SEGMENT_BYTES = int(os.getenv("TELEMETRY_WAL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+TELEMETRY_WAL_MAX_BYTES = int(os.getenv("TELEMETRY_WAL_MAX_BYTES", str(1024 * 1024 * 1024)))  # 0 = illimité
+TELEMETRY_WAL_FSYNC = os.getenv("TELEMETRY_WAL_FSYNC", "interval")
+TELEMETRY_WAL_FSYNC_INTERVAL = float(os.getenv("TELEMETRY_WAL_FSYNC_INTERVAL", "1.0"))
+TELEMETRY_WAL_RETRY_MAX = float(os.getenv("TELEMETRY_WAL_RETRY_MAX", "30"))  # secondes entre deux essais, au plus
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+_HEADER = struct.Struct("<II")  # longueur, crc32
+_SEGMENT_PREFIX = "telemetry-"
+_SEGMENT_SUFFIX = ".wal"
+_CHECKPOINT_FILE = "checkpoint.json"
+_DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+Position = Tuple[int, int]  # (numéro de segment, offset)
+
+
+class TelemetryWal:
+    """Journal segmenté en ajout seul; thread-safe côté écriture"""
+
+    def __init__(
+        self,
+        directory: str = TELEMETRY_WAL_DIR,
+        segment_bytes: int = TELEMETRY_WAL_SEGMENT_BYTES,
+        max_bytes: int = TELEMETRY_WAL_MAX_BYTES,
+        fsync: str = TELEMETRY_WAL_FSYNC,
+        fsync_interval: float = TELEMETRY_WAL_FSYNC_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Politique fsync inconnue: {fsync} (attendu: {', '.join(FSYNC_POLICIES)})")
+        self.directory = directory
+        self.segment_bytes = max(1, segment_bytes)
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = 0
+        self._size = 0
+        self._dirty = False
+        self._last_fsync = clock()
+        self._closed_sizes: Dict[int, int] = {}  # segments fermés non encore supprimés
+
+        self.appended = 0
+        self.rejected = 0
+        self.truncated_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    # ------------------------------------------------------------------
+    # Segments
+    # ------------------------------------------------------------------
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{segment:012d}{_SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[int]:
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                try:
+                    found.append(int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(found)
+
+    def _recover(self) -> None:
+        """Tronque un éventuel enregistrement incomplet (arrêt brutal) puis ouvre un segment neuf"""
+        segments = self.segments()
+        if segments:
+            last = segments[-1]
+            path = self.segment_path(last)
+            valid_end = 0
+            for valid_end, _ in self.read_records(last, 0):
+                pass
+            size = os.path.getsize(path)
+            if valid_end < size:
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+                self.truncated_bytes = size - valid_end
+                logger.warning(f"⚠️  WAL: {self.truncated_bytes} octets incomplets tronqués dans {path}")
+            self._closed_sizes = {segment: os.path.getsize(self.segment_path(segment)) for segment in segments}
+        self._open_segment(segments[-1] + 1 if segments else 1)
+
+    def _open_segment(self, segment: int) -> None:
+        self._file = open(self.segment_path(segment), "ab")
+        self._segment = segment
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        self._sync_locked()
+        self._file.close()
+        self._closed_sizes[self._segment] = self._size
+        self._open_segment(self._segment + 1)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(self._closed_sizes.values()) + self._size
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+    def append(self, payload: bytes) -> bool:
+        """Ajoute un enregistrement; False si la taille maximale du journal est atteinte"""
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self.max_bytes and sum(self._closed_sizes.values()) + self._size + len(record) > self.max_bytes:
+                self.rejected += 1
+                return False
+            if self._size and self._size + len(record) > self.segment_bytes:
+                self._rotate()
+            self._file.write(record)
+            self._file.flush()  # visible par le thread de rejeu
+            self._size += len(record)
+            self._dirty = True
+            self.appended += 1
+            if self.fsync == "always" or (
+                self.fsync == "interval" and self._clock() - self._last_fsync >= self.fsync_interval
+            ):
+                self._sync_locked()
+        return True
+
+    def _sync_locked(self) -> None:
+        if self._dirty and self._file is not None:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._last_fsync = self._clock()
+
+    def sync_if_due(self) -> None:
+        """Appelé périodiquement: fsync des derniers ajouts en mode interval"""
+        with self._lock:
+            if self._dirty and self.fsync == "interval" and self._clock() - self._last_fsync >= self.fsync_interval:
+                self._sync_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None and self.fsync != "never":
+                self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def end_position(self) -> Position:
+        """Fin du dernier enregistrement complet"""
+        with self._lock:
+            return self._segment, self._size
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def read_records(self, segment: int, offset: int, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        Itère sur (offset suivant, payload) à partir de `offset`.
+        S'arrête sur un enregistrement incomplet ou corrompu (CRC).
+        """
+        try:
+            f = open(self.segment_path(segment), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            while end is None or offset < end:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                offset += _HEADER.size + length
+                yield offset, payload
+
+    def remove_segments_before(self, segment: int) -> int:
+        removed = 0
+        for old in self.segments():
+            if old >= segment:
+                break
+            os.remove(self.segment_path(old))
+            with self._lock:
+                self._closed_sizes.pop(old, None)
+            removed += 1
+        return removed
+
+
+class WalTelemetryWriter:
+    """
+    Même interface que BatchedTelemetryWriter: submit() écrit dans le journal,
+    un thread rejoue le journal vers `sink(rows)` à partir du point de contrôle.
+    """
+
+    overflow_policy = "drop_newest"  # journal plein: la nouvelle ligne est refusée
+
+    def __init__(
+        self,
+        wal: TelemetryWal,
+        sink: Callable[[List[Row]], Any],
+        batch_size: int = TELEMETRY_BATCH_SIZE,
+        linger: float = TELEMETRY_LINGER_SECONDS,
+        retry_max: float = TELEMETRY_WAL_RETRY_MAX,
+    ):
+        self.wal = wal
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.retry_max = retry_max
+        self._checkpoint_path = os.path.join(wal.directory, _CHECKPOINT_FILE)
+        self.dead_letter_path = os.path.join(wal.directory, _DEAD_LETTER_FILE)
+        self._checkpoint: Position = self._load_checkpoint()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._retry_delay = 0.0
+        self._next_attempt = 0.0
+        self._pending_lock = threading.Lock()
+
+        self.submitted = 0
+        self.written = 0
+        self.failed_attempts = 0
+        self.skipped_records = 0
+        self.dead_letters = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_duration: Optional[float] = None
+        self.pending = self._count_pending()
+
+    @property
+    def blocking_submit(self) -> bool:
+        # Écriture disque (et fsync périodique ou par ligne) à chaque submit: hors de la boucle asyncio
+        return True
+
+    # ------------------------------------------------------------------
+    # Côté producteur
+    # ------------------------------------------------------------------
+    def submit(self, row: Row) -> bool:
+        row.setdefault("ingest_key", uuid.uuid4().hex)
+        if not self.wal.append(codec.dumps_bytes(row)):
+            return False
+        with self._pending_lock:
+            self.submitted += 1
+            self.pending += 1
+            pending = self.pending
+        if pending >= self.batch_size:
+            self._wake.set()
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        return self.pending
+
+    # ------------------------------------------------------------------
+    # Point de contrôle
+    # ------------------------------------------------------------------
+    def _load_checkpoint(self) -> Position:
+        try:
+            with open(self._checkpoint_path) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["offset"])
+        except FileNotFoundError:
+            segments = self.wal.segments()
+            return (segments[0] if segments else 1), 0
+        except (ValueError, KeyError, TypeError) as e:
+            # Point de contrôle illisible: tout rejouer (les doublons sont ignorés par ingest_key)
+            logger.error(f"❌ WAL: point de contrôle illisible ({e}), rejeu complet")
+            segments = self.wal.segments()
+            return (segments[0] if segments else 1), 0
+
+    def _save_checkpoint(self, position: Position) -> None:
+        tmp = self._checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path)
+        self._checkpoint = position
+
+    def _count_pending(self) -> int:
+        count = 0
+        segment, offset = self._checkpoint
+        for current in self.wal.segments():
+            if current < segment:
+                continue
+            count += sum(1 for _ in self.wal.read_records(current, offset if current == segment else 0))
+        return count
+
+    # ------------------------------------------------------------------
+    # Rejeu
+    # ------------------------------------------------------------------
+    def _read_batch(self) -> Tuple[List[Row], Position]:
+        """Lit au plus batch_size lignes après le point de contrôle"""
+        segment, offset = self._checkpoint
+        end_segment, end_offset = self.wal.end_position
+        rows: List[Row] = []
+        while len(rows) < self.batch_size:
+            end = end_offset if segment == end_segment else None
+            for offset, payload in self.wal.read_records(segment, offset, end):
+                try:
+                    rows.append(codec.loads(payload))
+                except codec.DecodeError:
+                    self.skipped_records += 1
+                if len(rows) >= self.batch_size:
+                    return rows, (segment, offset)
+            if segment >= end_segment:
+                break
+            if end is None and offset < os.path.getsize(self.wal.segment_path(segment)):
+                # Fin de segment illisible (corruption): on passe au suivant
+                self.skipped_records += 1
+                logger.error(f"❌ WAL: segment {segment} corrompu à l'offset {offset}, suite ignorée")
+            following = [s for s in self.wal.segments() if s > segment]
+            if not following:
+                break
+            segment, offset = following[0], 0
+        return rows, (segment, offset)
+
+    def _send(self, rows: List[Row], rejected: List[Tuple[Row, str]]) -> None:
+        """
+        Envoie un lot; une ligne refusée par la BDD est isolée par dichotomie et
+        ajoutée à `rejected`. Les pannes sont propagées (lot entier renvoyé plus tard).
+        """
+        try:
+            self.sink(rows)
+        except Exception as e:
+            if not is_rejected_write(e):
+                raise
+            if len(rows) == 1:
+                rejected.append((rows[0], str(e)))
+                return
+            middle = len(rows) // 2
+            self._send(rows[:middle], rejected)
+            self._send(rows[middle:], rejected)
+
+    def _write_dead_letters(self, rejected: List[Tuple[Row, str]]) -> None:
+        """Lignes refusées mises de côté (avant l'avancée du point de contrôle)"""
+        at = datetime.now(timezone.utc).isoformat()
+        with open(self.dead_letter_path, "ab") as f:
+            for row, error in rejected:
+                f.write(codec.dumps_bytes({"at": at, "error": error, "row": row}) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_letters += len(rejected)
+        for row, error in rejected:
+            logger.error(f"❌ WAL: ligne {row.get('ingest_key')} refusée par la BDD ({error}), mise de côté")
+
+    def replay_available(self) -> int:
+        """Envoie tout ce qui est disponible; s'arrête au premier échec. Retourne le nombre de lignes envoyées"""
+        sent = 0
+        while True:
+            rows, position = self._read_batch()
+            if not rows:
+                if position != self._checkpoint:
+                    self._save_checkpoint(position)
+                    self.wal.remove_segments_before(position[0])
+                break
+            started = time.monotonic()
+            rejected: List[Tuple[Row, str]] = []
+            try:
+                self._send(rows, rejected)
+            except Exception as e:
+                self.failed_attempts += 1
+                self.last_error = str(e)
+                self._retry_delay = min(max(self._retry_delay * 2, 0.5), self.retry_max)
+                self._next_attempt = time.monotonic() + self._retry_delay
+                logger.error(f"❌ WAL: envoi de {len(rows)} lignes échoué ({e}), nouvel essai dans {self._retry_delay}s")
+                break
+            finally:
+                self.last_flush_duration = time.monotonic() - started
+            self._retry_delay = 0.0
+            if rejected:
+                self._write_dead_letters(rejected)
+            self._save_checkpoint(position)
+            self.wal.remove_segments_before(position[0])
+            with self._pending_lock:
+                self.pending = max(0, self.pending - len(rows))
+            self.written += len(rows) - len(rejected)
+            self.batches += 1
+            sent += len(rows) - len(rejected)
+        return sent
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-wal-replayer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Dernier rejeu puis arrêt; ce qui n'a pas pu être envoyé reste sur disque"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.wal.close()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wake.wait(self.linger)
+            self._wake.clear()
+            self.wal.sync_if_due()
+            # Pendant une panne BDD, on respecte le délai de nouvel essai même si le lot se remplit
+            if self.pending and time.monotonic() >= self._next_attempt:
+                self.replay_available()
+        # Tentative finale (une seule si la BDD est indisponible)
+        self._retry_delay = 0.0
+        self.replay_available()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "wal",
+            "queue_depth": self.pending,
+            "batch_size": self.batch_size,
+            "linger_seconds": self.linger,
+            "fsync": self.wal.fsync,
+            "segments": len(self.wal.segments()),
+            "checkpoint": list(self._checkpoint),
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.wal.rejected,
+            "failed_attempts": self.failed_attempts,
+            "skipped_records": self.skipped_records,
+            "dead_letters": self.dead_letters,
+            "retry_delay_seconds": self._retry_delay,
+            "batches": self.batches,
+            "last_flush_seconds": self.last_flush_duration,
+            "last_error": self.last_error,
+        }
+
+
+def default_telemetry_upsert_sink(rows: List[Row]) -> None:
+    """Upsert idempotent sur ingest_key: un lot rejoué deux fois n'est inséré qu'une fois"""
+    from .storage import get_telemetry_sink
+    get_telemetry_sink().upsert(rows, key="ingest_key")
+
+
+def build_ingest_writer():
+    """Écrivain utilisé par l'ingestion: journal sur disque si activé, file en mémoire sinon"""
+    if not TELEMETRY_WAL_ENABLED:
+        return telemetry_writer
+    return WalTelemetryWriter(TelemetryWal(), default_telemetry_upsert_sink)
+
+
+ingest_writer = build_ingest_writer()
@@ -0,0 +1,198 @@
+"""
+Écriture asynchrone et groupée des lignes de télémétrie
+
+Le thread réseau paho ne fait plus d'appel BDD: les lignes sont déposées dans une
+file bornée, et un thread d'écriture les insère par lots (multi-row insert) dès que
+la taille de lot est atteinte ou que le délai d'attente (linger) est écoulé.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION DE L'ÉCRIVAIN ===
+TELEMETRY_BATCH_SIZE = int(os.getenv("TELEMETRY_BATCH_SIZE", "50"))
+TELEMETRY_LINGER_SECONDS = float(os.getenv("TELEMETRY_LINGER_SECONDS", "2.0"))
+TELEMETRY_QUEUE_MAX = int(os.getenv("TELEMETRY_QUEUE_MAX", "10000"))
+# drop_oldest: on jette la ligne la plus ancienne | drop_newest: on refuse la nouvelle
+# block: on attend de la place (au plus TELEMETRY_BLOCK_TIMEOUT secondes) puis on refuse
+TELEMETRY_OVERFLOW_POLICY = os.getenv("TELEMETRY_OVERFLOW_POLICY", "drop_oldest")
+TELEMETRY_BLOCK_TIMEOUT = float(os.getenv("TELEMETRY_BLOCK_TIMEOUT", "1.0"))
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+Row = Dict[str, Any]
+
+
+class BatchedTelemetryWriter:
+    """File bornée + thread d'écriture par lots vers un `sink(rows)`"""
+
+    def __init__(
+        self,
+        sink: Callable[[List[Row]], Any],
+        batch_size: int = TELEMETRY_BATCH_SIZE,
+        linger: float = TELEMETRY_LINGER_SECONDS,
+        max_queue: int = TELEMETRY_QUEUE_MAX,
+        overflow_policy: str = TELEMETRY_OVERFLOW_POLICY,
+        block_timeout: float = TELEMETRY_BLOCK_TIMEOUT,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Politique de débordement inconnue: {overflow_policy} (attendu: {', '.join(OVERFLOW_POLICIES)})")
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.linger = linger
+        self.max_queue = max(1, max_queue)
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        self._queue: Deque[Row] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._oldest_enqueued_at: Optional[float] = None
+
+        # Compteurs exposés via stats()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_duration: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Côté producteur (thread MQTT)
+    # ------------------------------------------------------------------
+    def submit(self, row: Row) -> bool:
+        """
+        Dépose une ligne dans la file sans jamais faire d'appel BDD.
+
+        Returns:
+            False si la ligne a été refusée à cause de la politique de débordement
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow_policy == "drop_oldest":
+                    self._queue.popleft()
+                    self.dropped += 1
+                elif self.overflow_policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                else:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.dropped += 1
+                            return False
+                        self._cond.wait(remaining)
+
+            was_empty = not self._queue
+            if was_empty:
+                self._oldest_enqueued_at = time.monotonic()
+            self._queue.append(row)
+            self.submitted += 1
+            # Réveil du thread d'écriture: premier élément (armement du délai) ou lot complet
+            if was_empty or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def blocking_submit(self) -> bool:
+        """True si submit() peut attendre (à appeler hors de la boucle asyncio)"""
+        return self.overflow_policy == "block"
+
+    # ------------------------------------------------------------------
+    # Côté consommateur (thread d'écriture)
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Arrête le thread après avoir vidé la file"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Ce qui reste (thread non démarré ou timeout) est écrit de manière synchrone
+        while self._queue:
+            self._flush(self._take_batch())
+
+    def _take_batch(self) -> List[Row]:
+        with self._cond:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._oldest_enqueued_at = time.monotonic() if self._queue else None
+            self._cond.notify_all()  # réveille les producteurs en mode "block"
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running:
+                    if len(self._queue) >= self.batch_size:
+                        break
+                    if self._queue:
+                        wait = self._oldest_enqueued_at + self.linger - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if not self._running and not self._queue:
+                    return
+            self._flush(self._take_batch())
+
+    def _flush(self, batch: List[Row]) -> None:
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            self.sink(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            self.last_error = str(e)
+            logger.error(f"❌ Erreur lors de l'insertion d'un lot de {len(batch)} lignes: {e}")
+        finally:
+            self.last_flush_duration = time.monotonic() - started
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "linger_seconds": self.linger,
+            "overflow_policy": self.overflow_policy,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_seconds": self.last_flush_duration,
+            "last_error": self.last_error,
+        }
+
+
+def default_telemetry_sink(rows: List[Row]) -> None:
+    """Insertion multi-lignes via le backend configuré (TELEMETRY_SINK, voir storage/)"""
+    from .storage import get_telemetry_sink
+    get_telemetry_sink().insert(rows)
+
+
+# Écrivain partagé (démarré/arrêté par les événements FastAPI)
+telemetry_writer = BatchedTelemetryWriter(default_telemetry_sink)
@@ -0,0 +1,131 @@
+"""
+Trames WebSocket: un message est encodé une fois par encodage, puis partagé entre clients
+
+Encodages négociés par sous-protocole (Sec-WebSocket-Protocol):
+- twin.json (ou aucun sous-protocole): JSON, trames texte (codec.py)
+- twin.msgpack: MessagePack, trames binaires; paquet msgpack ou msgspec requis
+  (optionnel), sinon le sous-protocole n'est pas proposé
+
+    new WebSocket("ws://.../ws/telemetry?protocol=delta", ["twin.msgpack", "twin.json"])
+
+Les messages du client (subscribe, resync...) peuvent être envoyés en JSON
+texte ou dans l'encodage négocié (trame binaire).
+
+Frame construit son contenu au premier besoin et mémorise chaque encodage;
+FrameCache garde les trames récentes par (véhicule, seq, forme): un snapshot
+demandé par plusieurs clients à la même séquence n'est construit qu'une fois.
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+from . import codec
+
+# === CONFIGURATION ===
+WS_FRAME_CACHE_SIZE = int(os.getenv("WS_FRAME_CACHE_SIZE", "256"))  # trames gardées (toutes formes confondues)
+
+Encoded = Union[str, bytes]
+
+
+def _msgpack_encoder() -> Callable[[Any], bytes]:
+    try:
+        import msgpack
+    except ImportError:
+        import msgspec  # ImportError si aucun des deux n'est installé
+        return msgspec.msgpack.Encoder().encode
+    return lambda obj: msgpack.packb(obj, use_bin_type=True, default=str)
+
+
+def _msgpack_decoder() -> Callable[[bytes], Any]:
+    try:
+        import msgpack
+    except ImportError:
+        import msgspec
+        return msgspec.msgpack.Decoder().decode
+    return lambda data: msgpack.unpackb(data, raw=False)
+
+
+def _available_encoders() -> Dict[str, Callable[[Any], Encoded]]:
+    encoders: Dict[str, Callable[[Any], Encoded]] = {"json": codec.dumps}
+    try:
+        encoders["msgpack"] = _msgpack_encoder()
+    except ImportError:
+        pass
+    return encoders
+
+
+ENCODERS = _available_encoders()
+SUBPROTOCOLS = {"twin.json": "json", "twin.msgpack": "msgpack"}
+
+
+def negotiate(offered: Sequence[str]) -> Tuple[Optional[str], str]:
+    """Premier sous-protocole proposé et disponible → (sous-protocole, encodage); défaut: (None, "json")"""
+    for subprotocol in offered:
+        encoding = SUBPROTOCOLS.get(subprotocol)
+        if encoding in ENCODERS:
+            return subprotocol, encoding
+    return None, "json"
+
+
+def encode(payload: Any, encoding: str = "json") -> Encoded:
+    return ENCODERS[encoding](payload)
+
+
+def decode(data: Union[str, bytes], encoding: str = "json") -> Any:
+    """Message reçu d'un client: texte JSON, ou trame binaire dans l'encodage négocié"""
+    if isinstance(data, str) or encoding == "json":
+        return codec.loads(data)
+    return _msgpack_decoder()(data)
+
+
+class Frame:
+    """Message à diffuser: contenu construit au premier encodage, un encodage par format"""
+
+    __slots__ = ("_build", "_payload", "_encoded")
+
+    def __init__(self, payload: Any = None, build: Optional[Callable[[], Any]] = None):
+        self._build = build
+        self._payload = payload
+        self._encoded: Dict[str, Encoded] = {}
+
+    @property
+    def payload(self) -> Any:
+        if self._build is not None:
+            self._payload = self._build()
+            self._build = None
+        return self._payload
+
+    def encode(self, encoding: str = "json") -> Encoded:
+        encoded = self._encoded.get(encoding)
+        if encoded is None:
+            encoded = self._encoded[encoding] = encode(self.payload, encoding)
+        return encoded
+
+    @property
+    def encodings(self) -> List[str]:
+        return list(self._encoded)
+
+
+class FrameCache:
+    """Trames récentes par clé (véhicule, seq, forme), éviction des plus anciennes"""
+
+    def __init__(self, size: int = WS_FRAME_CACHE_SIZE):
+        self.size = max(size, 1)
+        self._frames: "OrderedDict[Hashable, Frame]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def frame(self, key: Hashable, build: Callable[[], Any]) -> Frame:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self.hits += 1
+            self._frames.move_to_end(key)
+            return frame
+        self.misses += 1
+        frame = self._frames[key] = Frame(build=build)
+        if len(self._frames) > self.size:
+            self._frames.popitem(last=False)
+        return frame
+
+    def stats(self) -> Dict[str, Any]:
+        return {"frames": len(self._frames), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,49 @@
+"""
+Benchmark: débit des codecs JSON disponibles (app/codec.py)
+
+- loads: payload MQTT de test_new_mqtt_format.py, décodé depuis les bytes
+- dumps: message telemetry_update avec 100 points d'historique
+
+Usage (depuis digital_twin_logic/backend):
+    python -m benchmarks.bench_json_codec
+"""
+import json
+import timeit
+from datetime import datetime
+
+from app.codec import CODEC_NAME, available_codecs
+from app.telemetry_state import TelemetryStateStore
+from test_new_mqtt_format import test_payload
+
+PAYLOAD = test_payload.encode("utf-8")
+
+
+def build_message():
+    state = TelemetryStateStore().get_or_create(1)
+    for i in range(100):
+        state.set("rpm", 800 + i)
+        state.set("vehicle_speed", i * 1.5)
+        state.append_history()
+    return {
+        "type": "telemetry_update",
+        "state": "running",
+        "data": state.to_dict(),
+        "history": state.history_list(),
+        "timestamp": datetime.now().isoformat(),
+    }
+
+
+def run(number: int = 5000) -> None:
+    message = build_message()
+    print(f"Codec sélectionné par l'application: {CODEC_NAME}")
+    print(f"Payload MQTT: {len(PAYLOAD)} octets - message WebSocket: {len(json.dumps(message))} octets\n")
+    print(f"{'codec':<10}{'loads msg/s':>14}{'dumps msg/s':>14}{'dumps Mo/s':>12}")
+    for name, (loads, dumps_bytes, _) in available_codecs().items():
+        loads_time = timeit.timeit(lambda: loads(PAYLOAD), number=number) / number
+        dumps_time = timeit.timeit(lambda: dumps_bytes(message), number=number) / number
+        size = len(dumps_bytes(message))
+        print(f"{name:<10}{1 / loads_time:>14,.0f}{1 / dumps_time:>14,.0f}{size / dumps_time / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    run()
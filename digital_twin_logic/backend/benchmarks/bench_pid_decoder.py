@@ -0,0 +1,65 @@
+"""
+Benchmark: décodage PID compilé vs ancienne boucle de on_message
+
+Usage (depuis digital_twin_logic/backend):
+    python -m benchmarks.bench_pid_decoder
+"""
+import json
+import timeit
+
+from app.pid_decoder import PID_TO_COLUMN_MAPPING, is_device_topic, pid_decoder
+from app.telemetry_state import TELEMETRY_COLUMNS
+from test_new_mqtt_format import test_payload
+
+TOPIC = "wincan/device1"
+DATA = json.loads(test_payload)
+# Une partie des PIDs arrive parfois en texte depuis le firmware
+DATA_AS_TEXT = {key: str(value) for key, value in DATA.items()}
+
+
+def legacy_decode(topic, data, latest_data):
+    """Copie de l'ancienne boucle de mqtt_handler.on_message"""
+    if not topic.startswith("wincan/device"):
+        return
+    import re
+    if not re.match(r'^wincan/device\d+$', topic):
+        return
+    updated_fields = 0
+    unmapped_pids = []
+    for pid_key, value in data.items():
+        if pid_key in PID_TO_COLUMN_MAPPING:
+            field_name = PID_TO_COLUMN_MAPPING[pid_key]
+            if isinstance(value, str):
+                try:
+                    value = float(value) if '.' in value else int(value)
+                except (ValueError, TypeError):
+                    pass
+            latest_data[field_name] = value
+            updated_fields += 1
+        else:
+            unmapped_pids.append(pid_key)
+    return updated_fields, unmapped_pids
+
+
+def compiled_decode(topic, data, values):
+    if not is_device_topic(topic):
+        return
+    return pid_decoder.decode_into(data, values)
+
+
+def run(number: int = 20000) -> None:
+    latest_data = dict.fromkeys(TELEMETRY_COLUMNS)
+    values = [None] * len(TELEMETRY_COLUMNS)
+
+    print(f"Payload: {len(DATA)} PIDs, {number} itérations\n")
+    print(f"{'cas':<36}{'µs/message':>12}{'messages/s':>14}")
+    for label, payload in (("valeurs JSON numériques", DATA), ("valeurs en texte", DATA_AS_TEXT)):
+        legacy = timeit.timeit(lambda: legacy_decode(TOPIC, payload, latest_data), number=number) / number
+        compiled = timeit.timeit(lambda: compiled_decode(TOPIC, payload, values), number=number) / number
+        print(f"{'legacy / ' + label:<36}{legacy * 1e6:>12.2f}{1 / legacy:>14,.0f}")
+        print(f"{'compilé / ' + label:<36}{compiled * 1e6:>12.2f}{1 / compiled:>14,.0f}")
+        print(f"{'gain':<36}{legacy / compiled:>11.2f}x\n")
+
+
+if __name__ == "__main__":
+    run()
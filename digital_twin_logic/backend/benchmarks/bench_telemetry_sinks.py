@@ -0,0 +1,105 @@
+"""
+Benchmark: débit d'écriture de la télémétrie, Supabase (PostgREST) vs COPY Postgres vs SQLite
+
+Sans option, mesure la préparation d'un lot (corps JSON PostgREST vs CSV pour
+COPY) et l'insertion dans une base SQLite temporaire, sans réseau. Avec --live,
+insère réellement des lots dans une table de test (jamais la table telemetry
+de production):
+
+    CREATE TABLE telemetry_bench (LIKE telemetry INCLUDING ALL);
+
+Usage (depuis digital_twin_logic/backend):
+    python -m benchmarks.bench_telemetry_sinks
+    SUPABASE_URL=... SUPABASE_KEY=... DATABASE_URL=postgresql://... \\
+        python -m benchmarks.bench_telemetry_sinks --live --rows 5000 --batch-size 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from app.storage import PostgresCopyTelemetrySink, SqliteTelemetrySink, SupabaseTelemetrySink
+from app.storage.postgres_copy import columns_for, rows_to_csv
+from app.telemetry_state import TELEMETRY_COLUMNS
+
+
+def build_rows(count: int):
+    rows = []
+    for i in range(count):
+        row = {"vehicle_id": 1 + i % 5, "device_id": 1 + i % 5}
+        for name in TELEMETRY_COLUMNS:
+            row[name] = round(random.uniform(0, 3000), 2)
+        row["recorded_at"] = datetime.now().isoformat()
+        rows.append(row)
+    return rows
+
+
+def batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def bench_encoding(rows, batch_size):
+    print(f"{'préparation':<22}{'lignes/s':>14}{'octets/ligne':>14}")
+    started = time.perf_counter()
+    size = sum(len(json.dumps(batch)) for batch in batches(rows, batch_size))
+    elapsed = time.perf_counter() - started
+    print(f"{'JSON (PostgREST)':<22}{len(rows) / elapsed:>14,.0f}{size / len(rows):>14.0f}")
+
+    started = time.perf_counter()
+    size = sum(len(rows_to_csv(batch, columns_for(batch)).getvalue()) for batch in batches(rows, batch_size))
+    elapsed = time.perf_counter() - started
+    print(f"{'CSV (COPY)':<22}{len(rows) / elapsed:>14,.0f}{size / len(rows):>14.0f}")
+
+
+def bench_sink(name, sink, rows, batch_size):
+    started = time.perf_counter()
+    for batch in batches(rows, batch_size):
+        sink.insert(batch)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22}{len(rows) / elapsed:>14,.0f}{elapsed:>12.2f}s")
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--live", action="store_true", help="insertion réelle dans --table")
+    parser.add_argument("--table", default="telemetry_bench")
+    args = parser.parse_args()
+
+    rows = build_rows(args.rows)
+    print(f"{args.rows} lignes, lots de {args.batch_size}\n")
+    bench_encoding(rows, args.batch_size)
+
+    print(f"\n{'insertion':<22}{'lignes/s':>14}{'durée':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        sink = SqliteTelemetrySink(os.path.join(directory, "bench.db"))
+        # Devices référencés par build_rows (clé étrangère telemetry.device_id)
+        sink.db.insert("devices", [{"device_code": f"bench{i}", "mqtt_topic": f"wincan/bench{i}"} for i in range(1, 6)])
+        try:
+            bench_sink("SQLite (WAL, local)", sink, rows, args.batch_size)
+        finally:
+            sink.close()
+    if not args.live:
+        return
+
+    if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"):
+        bench_sink("Supabase (PostgREST)", SupabaseTelemetrySink(table=args.table), rows, args.batch_size)
+    else:
+        print("Supabase: SUPABASE_URL / SUPABASE_KEY non définis, ignoré")
+    if os.getenv("DATABASE_URL"):
+        sink = PostgresCopyTelemetrySink(os.getenv("DATABASE_URL"), table=args.table)
+        try:
+            bench_sink("Postgres (COPY)", sink, rows, args.batch_size)
+        finally:
+            sink.close()
+    else:
+        print("Postgres: DATABASE_URL non défini, ignoré")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,110 @@
+"""
+Test de répartition de l'ingestion contre un Mosquitto local (>= 1.6 pour $share)
+
+    mosquitto -p 1883 -v
+    python test_mqtt_shared.py --mode shared --workers 3
+    python test_mqtt_shared.py --mode partition --workers 3
+
+Démarre N consommateurs configurés comme des workers uvicorn (app/mqtt_scaling.py),
+publie des messages sur wincan/device1..K puis vérifie que chaque message est
+traité exactement une fois et (mode partition) toujours par le même worker.
+"""
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+
+from app.mqtt_scaling import MqttScaling, build_client_id, create_client
+
+MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_USERNAME = os.getenv("MQTT_USERNAME")
+MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
+
+
+def start_worker(index, args, received, lock, ready):
+    scaling = MqttScaling(
+        mode=args.mode,
+        share_group="test_digital_twin",
+        partition_index=index,
+        partition_count=args.workers,
+    )
+    client = create_client(scaling, build_client_id("TestShared"))
+    if MQTT_USERNAME:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        for topic in scaling.subscriptions(["wincan/+"]):
+            client.subscribe(topic, qos=1)
+        ready.release()
+
+    def on_message(client, userdata, msg):
+        if not scaling.owns(msg.topic):
+            return
+        with lock:
+            received.append((index, msg.topic, msg.payload.decode()))
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    client.loop_start()
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("shared", "partition"), default="shared")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=50, help="messages par device")
+    args = parser.parse_args()
+
+    print(f"🧪 Répartition MQTT ({args.mode}, {args.workers} workers) sur {MQTT_BROKER}:{MQTT_PORT}")
+    received, lock, ready = [], threading.Lock(), threading.Semaphore(0)
+    workers = [start_worker(i, args, received, lock, ready) for i in range(args.workers)]
+    for _ in workers:
+        if not ready.acquire(timeout=5):
+            print("❌ Un worker n'a pas pu se connecter au broker")
+            sys.exit(1)
+    time.sleep(0.5)  # laisser les SUBACK arriver
+
+    publisher = create_client(MqttScaling(mode="single"), build_client_id("TestPublisher"))
+    if MQTT_USERNAME:
+        publisher.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    publisher.connect(MQTT_BROKER, MQTT_PORT, 60)
+    publisher.loop_start()
+    expected = args.devices * args.messages
+    for i in range(args.messages):
+        for device in range(1, args.devices + 1):
+            publisher.publish(f"wincan/device{device}", str(i), qos=1).wait_for_publish()
+
+    deadline = time.time() + 10
+    while len(received) < expected and time.time() < deadline:
+        time.sleep(0.1)
+    time.sleep(0.5)  # détecter d'éventuels doublons tardifs
+
+    for client in workers + [publisher]:
+        client.loop_stop()
+        client.disconnect()
+
+    per_worker = collections.Counter(index for index, _, _ in received)
+    duplicates = len(received) - len({(topic, payload) for _, topic, payload in received})
+    print(f"📊 Reçus: {len(received)}/{expected} | doublons: {duplicates} | par worker: {dict(per_worker)}")
+
+    ok = len(received) == expected and duplicates == 0
+    if args.mode == "partition":
+        owners = collections.defaultdict(set)
+        for index, topic, _ in received:
+            owners[topic].add(index)
+        stable = all(len(indexes) == 1 for indexes in owners.values())
+        print(f"🔒 Un seul worker par device: {'oui' if stable else 'non'}")
+        ok = ok and stable
+
+    print("✅ Répartition correcte" if ok else "❌ Répartition incorrecte")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+
+from app.broadcast_scheduler import BroadcastScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_is_merged_and_rate_limited_per_vehicle():
+    sent = []
+    clock = Clock()
+
+    async def broadcast(vehicle_id):
+        sent.append((vehicle_id, clock.now))
+
+    scheduler = BroadcastScheduler(broadcast, max_fps=10, clock=clock)
+
+    async def scenario():
+        # Premier message: diffusé aussitôt
+        scheduler.mark_dirty(1)
+        assert await scheduler.flush_due() is None
+        # Rafale de 50 messages dans le même intervalle: une seule trame, à l'échéance
+        for _ in range(50):
+            scheduler.mark_dirty(1)
+        scheduler.mark_dirty(2)
+        clock.now += 0.04
+        wait = await scheduler.flush_due()
+        assert abs(wait - 0.06) < 1e-9
+        clock.now += wait
+        assert await scheduler.flush_due() is None
+
+    asyncio.run(scenario())
+    assert sent == [(1, 100.0), (2, 100.04), (1, 100.1)]
+    assert scheduler.stats()["merged"] == 49 and scheduler.pending == 0
+
+
+def test_running_scheduler_bounds_frames_whatever_the_publish_rate():
+    sent = []
+
+    async def broadcast(vehicle_id):
+        sent.append(vehicle_id)
+
+    scheduler = BroadcastScheduler(broadcast, max_fps=20)
+
+    async def scenario():
+        await scheduler.start()
+        for _ in range(60):  # ~600 messages/s pendant 0,1 s
+            scheduler.mark_dirty(7)
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    # ~0,2 s à 20 trames/s au plus, trame finale comprise
+    assert 2 <= len(sent) <= 6
+    assert scheduler.pending == 0 and scheduler.flushed == len(sent)
+
+
+def test_failing_broadcast_does_not_stop_the_loop():
+    async def broadcast(vehicle_id):
+        raise RuntimeError("client parti")
+
+    scheduler = BroadcastScheduler(broadcast, max_fps=0)
+
+    async def scenario():
+        scheduler.mark_dirty(1)
+        await scheduler.flush_due()
+        scheduler.mark_dirty(1)
+        await scheduler.flush_due()
+
+    asyncio.run(scenario())
+    assert scheduler.errors == 2 and scheduler.pending == 0
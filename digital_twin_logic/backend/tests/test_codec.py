@@ -0,0 +1,25 @@
+import pytest
+
+from app import codec
+
+
+def test_roundtrip_from_bytes():
+    payload = b'{"0C-EngineRPM":1047,"04-CalcEngineLoad":79.61,"note":"d\xc3\xa9marrage"}'
+    data = codec.loads(payload)
+    assert data == {"0C-EngineRPM": 1047, "04-CalcEngineLoad": 79.61, "note": "démarrage"}
+    assert codec.loads(codec.dumps(data)) == data
+    assert isinstance(codec.dumps_bytes(data), bytes)
+
+
+def test_invalid_payload_raises_codec_error():
+    with pytest.raises(codec.DecodeError):
+        codec.loads(b'{"0C-EngineRPM":')
+
+
+@pytest.mark.parametrize("name", sorted(codec.available_codecs()))
+def test_every_available_backend_agrees(name):
+    loads, dumps_bytes, errors = codec.available_codecs()[name]
+    message = {"type": "telemetry_update", "data": {"rpm": 1047, "vehicle_speed": None}, "history": [{"rpm": 1.5}]}
+    assert loads(dumps_bytes(message)) == message
+    with pytest.raises(errors):
+        loads(b"not json")
@@ -0,0 +1,146 @@
+import pytest
+
+from app.device_cache import DeviceResolutionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(clock, devices, assignments, calls):
+    def load_device(topic):
+        calls.append(("device", topic))
+        return devices.get(topic)
+
+    def load_assignment(device_id):
+        calls.append(("assignment", device_id))
+        return assignments.get(device_id)
+
+    return DeviceResolutionCache(load_device, load_assignment, ttl=30, negative_ttl=5, clock=clock)
+
+
+def test_resolution_is_cached_until_ttl():
+    """Une seule paire de requêtes BDD tant que le TTL n'est pas expiré"""
+    clock = FakeClock()
+    calls = []
+    cache = make_cache(
+        clock,
+        {"wincan/device1": {"id": 1, "device_code": "device1", "status": "active"}},
+        {1: {"vehicle_id": 7, "vehicle_name": "Test"}},
+        calls,
+    )
+
+    for _ in range(3):
+        device, assignment = cache.resolve("wincan/device1")
+        assert device["id"] == 1
+        assert assignment["vehicle_id"] == 7
+
+    assert calls == [("device", "wincan/device1"), ("assignment", 1)]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+    clock.now = 31
+    cache.resolve("wincan/device1")
+    assert len(calls) == 4
+
+
+def test_negative_results_use_short_ttl():
+    """Un topic inconnu est mis en cache avec le TTL négatif"""
+    clock = FakeClock()
+    calls = []
+    cache = make_cache(clock, {}, {}, calls)
+
+    assert cache.resolve("wincan/device9") == (None, None)
+    cache.resolve("wincan/device9")
+    assert len(calls) == 1
+
+    clock.now = 6
+    cache.resolve("wincan/device9")
+    assert len(calls) == 2
+
+
+def test_inactive_device_skips_assignment_lookup():
+    clock = FakeClock()
+    calls = []
+    cache = make_cache(
+        clock,
+        {"wincan/device3": {"id": 3, "device_code": "device3", "status": "inactive"}},
+        {3: {"vehicle_id": 1}},
+        calls,
+    )
+
+    device, assignment = cache.resolve("wincan/device3")
+    assert device["status"] == "inactive"
+    assert assignment is None
+    assert calls == [("device", "wincan/device3")]
+
+
+def test_invalidate_by_device_id_and_topic():
+    clock = FakeClock()
+    calls = []
+    devices = {"wincan/device1": {"id": 1, "device_code": "device1", "status": "active"}}
+    assignments = {1: {"vehicle_id": 7}}
+    cache = make_cache(clock, devices, assignments, calls)
+
+    cache.resolve("wincan/device1")
+    assignments[1] = {"vehicle_id": 8}
+    assert cache.invalidate(device_id=1) == 1
+    assert cache.resolve("wincan/device1")[1]["vehicle_id"] == 8
+
+    cache.resolve("wincan/unknown")
+    devices["wincan/unknown"] = {"id": 2, "device_code": "unknown", "status": "active"}
+    assert cache.invalidate(topic="wincan/unknown") == 1
+    assert cache.resolve("wincan/unknown")[0]["id"] == 2
+
+
+def test_peek_never_loads_from_database():
+    clock = FakeClock()
+    calls = []
+    devices = {"wincan/device1": {"id": 1, "device_code": "device1", "status": "active"}}
+    cache = make_cache(clock, devices, {1: {"vehicle_id": 7}}, calls)
+
+    assert cache.peek("wincan/device1") is None
+    assert calls == []
+    cache.resolve("wincan/device1")
+    assert cache.peek("wincan/device1")[1]["vehicle_id"] == 7
+
+    clock.now += cache.ttl + 1
+    assert cache.peek("wincan/device1") is None
+
+
+def test_database_errors_are_raised_and_not_cached():
+    """Une erreur BDD transitoire n'est pas mémorisée comme « device inconnu »"""
+    clock = FakeClock()
+    calls = []
+    devices = {"wincan/device1": {"id": 1, "device_code": "device1", "status": "active"}}
+    assignments = {1: {"vehicle_id": 7}}
+    failures = {"device": 1, "assignment": 1}
+
+    def load_device(topic):
+        calls.append(("device", topic))
+        if failures["device"]:
+            failures["device"] -= 1
+            raise ConnectionError("BDD indisponible")
+        return devices.get(topic)
+
+    def load_assignment(device_id):
+        calls.append(("assignment", device_id))
+        if failures["assignment"]:
+            failures["assignment"] -= 1
+            raise TimeoutError("BDD lente")
+        return assignments.get(device_id)
+
+    cache = DeviceResolutionCache(load_device, load_assignment, ttl=30, negative_ttl=5, clock=clock)
+    with pytest.raises(ConnectionError):
+        cache.resolve("wincan/device1")
+    with pytest.raises(TimeoutError):
+        cache.resolve("wincan/device1")
+    assert cache.peek("wincan/device1") is None
+
+    assert cache.resolve("wincan/device1")[1]["vehicle_id"] == 7
+    assert cache.stats()["errors"] == 2 and cache.stats()["entries"] == 1
+    assert len(calls) == 5
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.downsampling import StreamingDownsampler, downsample_rows, lttb_indices, minmax_indices, to_seconds
+
+
+def make_rows(count, start=datetime(2024, 1, 1)):
+    return [
+        {"id": i, "recorded_at": (start + timedelta(seconds=i)).isoformat(), "rpm": 1000 + (i % 50), "vehicle_speed": None}
+        for i in range(count)
+    ]
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[437] = 50.0
+    indices = lttb_indices(x, y, 20)
+    assert len(indices) == 20
+    assert indices[0] == 0 and indices[-1] == 999
+    assert 437 in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_returns_everything_under_budget():
+    assert lttb_indices(np.arange(5.0), np.arange(5.0), 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_minmax_envelope_keeps_extremes_and_skips_nan():
+    y = np.sin(np.linspace(0, 20, 10_000))
+    y[1234] = 10.0
+    y[8765] = -10.0
+    y[5000:6000] = np.nan
+    indices = minmax_indices(y, 50)
+    assert len(indices) <= 102
+    assert {0, 9999, 1234, 8765} <= set(indices.tolist())
+    assert not np.isnan(y[indices[1:-1]]).any()
+
+
+def test_to_seconds_handles_naive_and_aware_timestamps():
+    naive = to_seconds(["2024-01-01T00:00:00", "2024-01-01T00:00:01.500000"])
+    aware = to_seconds(["2024-01-01T00:00:00+00:00", "2024-01-01T00:00:10Z"])
+    assert naive[1] - naive[0] == pytest.approx(1.5)
+    assert aware[1] - aware[0] == pytest.approx(10)
+
+
+def test_downsample_rows_shares_budget_and_ignores_empty_fields():
+    rows = make_rows(5000)
+    reduced = downsample_rows(rows, ["rpm", "vehicle_speed"], 100)
+    # vehicle_speed n'a aucune valeur: tout le budget va à rpm
+    assert 3 <= len(reduced) <= 100
+    assert reduced[0]["id"] == 0 and reduced[-1]["id"] == 4999
+    assert [row["id"] for row in reduced] == sorted(row["id"] for row in reduced)
+
+
+def test_downsample_rows_without_numeric_fields_uses_stride():
+    rows = [{"recorded_at": f"2024-01-01T00:00:{i:02d}", "rpm": None} for i in range(60)]
+    assert len(downsample_rows(rows, ["rpm"], 10)) == 10
+
+
+def test_downsample_rows_is_noop_under_budget():
+    rows = make_rows(50)
+    assert downsample_rows(rows, ["rpm"], 100) is rows
+    with pytest.raises(ValueError):
+        downsample_rows(make_rows(200), ["rpm"], 100, method="average")
+
+
+def test_minmax_on_a_million_points_is_fast():
+    y = np.random.default_rng(1).normal(size=1_000_000)
+    started = time.perf_counter()
+    indices = minmax_indices(y, 250)
+    assert time.perf_counter() - started < 1.0
+    assert len(indices) <= 502
+
+
+def stream(rows, max_points, page=700, **kwargs):
+    sampler = StreamingDownsampler(["rpm"], max_points, "lttb", **kwargs)
+    for start in range(0, len(rows), page):
+        sampler.add(rows[start:start + page])
+    return sampler, sampler.finish()
+
+
+def test_streaming_matches_downsample_rows_within_one_chunk():
+    rows = make_rows(3000)
+    sampler, result = stream(rows, 100, chunk_rows=5000)
+    assert result == downsample_rows(rows, ["rpm"], 100, "lttb")
+    assert sampler.rows_seen == 3000
+
+
+def test_streaming_covers_the_whole_range_with_uniform_density():
+    rows = make_rows(50_000)
+    rows[49_990]["rpm"] = 9000  # pic parmi les lignes les plus récentes
+    sampler, result = stream(rows, 100, chunk_rows=1000, max_blocks=8)
+    assert sampler.level > 0 and len(sampler.blocks) < 8
+    assert len(result) <= 100
+    ids = [row["id"] for row in result]
+    assert ids == sorted(ids) and ids[0] == 0 and ids[-1] == 49_999
+    assert 49_990 in ids
+    # Autant de points dans chaque moitié de la plage (à 20 % près)
+    first_half = sum(1 for i in ids if i < 25_000)
+    assert abs(first_half - (len(ids) - first_half)) <= len(ids) // 5
+
+
+def test_lttb_last_bucket_keeps_the_point_before_the_end():
+    y = np.zeros(200)
+    y[198] = 1.0
+    assert 198 in lttb_indices(np.arange(200.0), y, 100)
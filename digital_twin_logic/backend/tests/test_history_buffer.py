@@ -0,0 +1,67 @@
+import sys
+
+import numpy as np
+
+from app import downsampling
+from app.downsampling import downsample_history
+from app.history_buffer import HistoryBuffer, isoformat, to_microseconds
+from app.telemetry_state import HISTORY_FIELDS, VehicleState
+
+T0 = to_microseconds("2024-01-01T12:00:00")
+
+
+def test_ring_buffer_keeps_latest_points_in_order():
+    buffer = HistoryBuffer(("rpm", "vehicle_speed"), capacity=4)
+    for i in range(10):
+        buffer.append(T0 + i * 1_000_000, [1000 + i, None if i % 2 else i])
+
+    arrays = buffer.to_numpy()
+    assert len(buffer) == 4 and buffer.appended == 10
+    assert arrays["rpm"].tolist() == [1006, 1007, 1008, 1009]
+    assert np.isnan(arrays["vehicle_speed"][1])
+    assert arrays["timestamp"].dtype == np.dtype("datetime64[us]")
+    assert np.all(np.diff(arrays["timestamp"].view(np.int64)) == 1_000_000)
+
+    points = buffer.to_points(last=2, extra={"vehicle_id": 7})
+    assert points == [
+        {"timestamp": "2024-01-01T12:00:08", "vehicle_id": 7, "rpm": 1008.0, "vehicle_speed": 8.0},
+        {"timestamp": "2024-01-01T12:00:09", "vehicle_id": 7, "rpm": 1009.0, "vehicle_speed": None},
+    ]
+
+
+def test_timestamps_round_trip_to_the_microsecond():
+    value = "2024-06-30T23:59:59.999999"
+    assert isoformat(to_microseconds(value)) == value
+
+
+def test_text_values_are_stored_as_missing():
+    buffer = HistoryBuffer(("rpm",), capacity=2)
+    buffer.append(T0, ["NO DATA"])
+    assert buffer.to_points() == [{"timestamp": isoformat(T0), "rpm": None}]
+
+
+def test_hours_of_history_stay_compact():
+    state = VehicleState(1, history_size=7200)
+    for i in range(7200):
+        state.set("rpm", 800 + i % 100)
+        state.append_history(timestamp=(T0 + i * 1_000_000) / 1e6)
+    columns = [state.history._timestamps, *state.history._columns]
+    assert sum(sys.getsizeof(column) for column in columns) < 7200 * 8 * (len(HISTORY_FIELDS) + 1) * 1.2
+    assert len(state.history_arrays()["rpm"]) == 7200
+
+
+def test_downsample_history_window_and_reduction(monkeypatch):
+    state = VehicleState(3, history_size=1000)
+    for i in range(1000):
+        state.set("rpm", 1000 + (500 if i == 421 else 0))
+        state.append_history(timestamp=(T0 + i * 1_000_000) / 1e6)
+
+    window = downsample_history(state.history_arrays(), HISTORY_FIELDS, extra={"vehicle_id": 3})
+    assert len(window) == downsampling.WS_HISTORY_WINDOW
+    assert window[-1]["timestamp"] == isoformat(T0 + 999_000_000) and window[-1]["vehicle_id"] == 3
+
+    monkeypatch.setattr(downsampling, "WS_HISTORY_MAX_POINTS", 50)
+    reduced = downsample_history(state.history_arrays(), HISTORY_FIELDS)
+    assert len(reduced) <= 50
+    assert reduced[0]["timestamp"] == isoformat(T0)
+    assert any(point["rpm"] == 1500 for point in reduced)
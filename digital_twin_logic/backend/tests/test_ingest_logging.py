@@ -0,0 +1,32 @@
+from app.ingest_logging import IngestLogger, IngestMetrics, format_event
+
+
+def test_format_event_is_key_value():
+    line = format_event("mqtt.decoded", device="device1", pids=41, hint="table devices")
+    assert line == 'event=mqtt.decoded device=device1 pids=41 hint="table devices"'
+    assert format_event("x", payload='{"a":\n1}') == 'event=x payload="{\\"a\\":\\n1}"'
+
+
+def test_summary_mode_is_quiet_by_default():
+    log = IngestLogger(name="test.ingest.summary", mode="summary")
+    assert not log.sampled()
+    assert IngestLogger(name="test.ingest.verbose", mode="verbose").sampled()
+
+
+def test_metrics_summary_resets_window(caplog):
+    log = IngestLogger(name="test.ingest.metrics", mode="summary")
+    log.logger.propagate = True
+    metrics = IngestMetrics(log, interval=0)
+
+    metrics.messages += 10
+    metrics.saved += 2
+    metrics.unmapped_pids += 3
+    with caplog.at_level("INFO", logger="test.ingest.metrics"):
+        assert metrics.tick(write_queue=4)
+
+    summary = caplog.records[-1].getMessage()
+    assert "event=ingest.summary" in summary
+    assert "msgs=10" in summary and "saved=2" in summary and "unmapped_pids=3" in summary
+    assert "write_queue=4" in summary
+    assert metrics.messages == 0
+    assert metrics.stats()["messages"] == 10
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+from app.ingest_pipeline import IngestPipeline
+
+
+def test_per_topic_ordering_with_concurrent_consumers():
+    """Les messages d'un même topic sont traités dans l'ordre, même avec plusieurs consommateurs"""
+    seen = {}
+
+    async def handler(topic, payload, received_at):
+        await asyncio.sleep(0)  # laisser les autres consommateurs s'intercaler
+        seen.setdefault(topic, []).append(int(payload))
+
+    async def scenario():
+        pipeline = IngestPipeline(handler, workers=3, queue_size=1000)
+        await pipeline.start()
+
+        def paho_thread():
+            for i in range(50):
+                for device in range(1, 6):
+                    pipeline.submit_threadsafe(f"wincan/device{device}", str(i).encode(), 0.0)
+
+        thread = threading.Thread(target=paho_thread)
+        thread.start()
+        await asyncio.to_thread(thread.join)
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["processed"] == 250
+    assert all(values == list(range(50)) for values in seen.values())
+    assert len(seen) == 5
+
+
+def test_full_queue_drops_oldest_message():
+    processed = []
+
+    async def handler(topic, payload, received_at):
+        processed.append(payload)
+
+    async def scenario():
+        pipeline = IngestPipeline(handler, workers=1, queue_size=2)
+        await pipeline.start()
+        # Enqueue direct (sans céder la main): le consommateur n'a rien lu
+        for payload in (b"1", b"2", b"3"):
+            pipeline._enqueue(("wincan/device1", payload, 0.0))
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(scenario())
+    assert processed == [b"2", b"3"]
+    assert stats["dropped"] == 1
+
+
+def test_handler_errors_do_not_stop_consumer():
+    processed = []
+
+    async def handler(topic, payload, received_at):
+        if payload == b"bad":
+            raise ValueError("boom")
+        processed.append(payload)
+
+    async def scenario():
+        pipeline = IngestPipeline(handler, workers=1)
+        await pipeline.start()
+        for payload in (b"bad", b"ok"):
+            pipeline._enqueue(("wincan/device1", payload, 0.0))
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(scenario())
+    assert processed == [b"ok"]
+    assert stats["failed"] == 1
+
+
+def test_submit_before_start_is_counted_as_dropped():
+    async def handler(topic, payload, received_at):
+        pass
+
+    pipeline = IngestPipeline(handler)
+    assert not pipeline.submit_threadsafe("wincan/device1", b"{}", 0.0)
+    assert pipeline.stats()["dropped"] == 1
@@ -0,0 +1,85 @@
+import collections
+import warnings
+
+import paho.mqtt.client as mqtt
+import pytest
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from app.mqtt_handler import on_connect, on_disconnect
+from app import mqtt_scaling as scaling_module
+from app.mqtt_scaling import MqttScaling, build_client_id, create_client, scaling_from_env
+
+
+def test_client_ids_are_unique_per_process_instance():
+    assert build_client_id() != build_client_id()
+    assert build_client_id("Worker").startswith("Worker-")
+
+
+def test_shared_mode_prefixes_subscriptions_and_uses_mqtt_v5():
+    scaling = MqttScaling(mode="shared", share_group="ingest", share_by_topic=True)
+    assert scaling.subscriptions(["wincan/+"]) == ["$share/ingest/wincan/+"]
+    assert scaling.protocol == mqtt.MQTTv5
+    assert scaling.owns("wincan/device1")
+    create_client(scaling, "test-client")  # constructible en v5
+
+
+def test_partition_mode_assigns_each_device_to_exactly_one_worker():
+    workers = [MqttScaling(mode="partition", partition_index=i, partition_count=3) for i in range(3)]
+    owners = collections.Counter()
+    for device in range(1, 101):
+        topic = f"wincan/device{device}"
+        owning = [i for i, worker in enumerate(workers) if worker.owns(topic)]
+        assert len(owning) == 1
+        owners[owning[0]] += 1
+    # Répartition raisonnable entre workers
+    assert min(owners.values()) > 15
+    assert sum(worker.skipped for worker in workers) == 200
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"mode": "cluster"},
+    {"mode": "shared", "share_group": "a/b", "share_by_topic": True},
+    {"mode": "shared", "share_group": "ingest"},  # répartition du broker non garantie par topic
+    {"mode": "partition", "partition_index": 3, "partition_count": 3},
+    {"mode": "partition", "partition_index": "auto", "partition_count": 3},
+])
+def test_invalid_configuration_is_rejected(kwargs):
+    with pytest.raises(ValueError):
+        MqttScaling(**kwargs)
+
+
+def test_a_partition_is_ingested_by_one_process_per_host(tmp_path):
+    first = MqttScaling(mode="partition", partition_index=1, partition_count=3, lock_dir=str(tmp_path))
+    same = MqttScaling(mode="partition", partition_index=1, partition_count=3, lock_dir=str(tmp_path))
+    other = MqttScaling(mode="partition", partition_index=2, partition_count=3, lock_dir=str(tmp_path))
+    first.start()
+    other.start()
+    with pytest.raises(RuntimeError, match="une unité par index"):
+        same.start()  # uvicorn --workers N: même environnement, même index
+    first.stop()
+    same.start()
+    same.stop()
+    other.stop()
+
+
+def test_invalid_environment_is_reported_at_startup_not_at_import(monkeypatch):
+    monkeypatch.setattr(scaling_module, "MQTT_INGEST_MODE", "partition")
+    monkeypatch.setattr(scaling_module, "MQTT_PARTITION_COUNT", 2)
+    monkeypatch.setattr(scaling_module, "MQTT_PARTITION_INDEX", "x")  # faute de frappe
+    scaling = scaling_from_env()
+    assert scaling.mode == "partition"
+    assert "MQTT_PARTITION_INDEX" in scaling.stats()["error"]
+    with pytest.raises(ValueError, match="MQTT_PARTITION_INDEX"):
+        scaling.start()
+
+
+def test_clients_use_the_v2_callback_api(capsys):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        client = create_client(MqttScaling(mode="single"), "test-client")
+    assert client._callback_api_version == mqtt.CallbackAPIVersion.VERSION2
+    on_connect(client, None, None, ReasonCode(PacketTypes.CONNACK, "Not authorized"), None)
+    on_disconnect(client, None, None, ReasonCode(PacketTypes.DISCONNECT, "Unspecified error"), None)
+    output = capsys.readouterr().out
+    assert "Not authorized" in output and "Unspecified error" in output
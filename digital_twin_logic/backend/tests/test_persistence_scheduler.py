@@ -0,0 +1,57 @@
+from app.persistence_scheduler import PersistenceScheduler
+from app.telemetry_state import COLUMN_INDEX, TelemetryStateStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cadence_is_per_vehicle():
+    """Chaque véhicule est sauvegardé à sa propre cadence"""
+    clock = FakeClock()
+    scheduler = PersistenceScheduler(interval=5, aggregate=False, clock=clock)
+    store = TelemetryStateStore()
+    car_a, car_b = store.get_or_create(1), store.get_or_create(2)
+
+    assert scheduler.observe(car_a, [COLUMN_INDEX["rpm"]])
+    # L'ancien throttling global aurait bloqué le véhicule 2 ici
+    assert scheduler.observe(car_b, [COLUMN_INDEX["rpm"]])
+    assert not scheduler.observe(car_a, [COLUMN_INDEX["rpm"]])
+
+    clock.now += 5
+    assert scheduler.observe(car_a, [COLUMN_INDEX["rpm"]])
+    assert scheduler.observe(car_b, [COLUMN_INDEX["rpm"]])
+
+
+def test_aggregation_of_intermediate_samples():
+    clock = FakeClock()
+    scheduler = PersistenceScheduler(interval=5, aggregate=True, clock=clock)
+    state = TelemetryStateStore().get_or_create(1)
+
+    state.set("rpm", 1000)
+    scheduler.observe(state, [COLUMN_INDEX["rpm"]])
+    scheduler.build_row(state)  # première sauvegarde immédiate
+
+    for rpm, status in ((800, 1), (2400, 2), (1300, 3)):
+        clock.now += 1
+        state.set("rpm", rpm)
+        state.set("monitor_status", status)
+        scheduler.observe(state, [COLUMN_INDEX["rpm"], COLUMN_INDEX["monitor_status"]])
+
+    clock.now += 3
+    assert scheduler.observe(state, [])
+    row = scheduler.build_row(state)
+
+    assert row["rpm"] == 1500
+    assert row["aggregates"]["rpm"] == {"min": 800, "max": 2400, "mean": 1500, "count": 3}
+    # Les statuts ne sont pas moyennés: dernière valeur conservée
+    assert row["monitor_status"] == 3
+    assert "monitor_status" not in row["aggregates"]
+    assert row["sample_count"] == 4
+
+    # L'agrégation repart de zéro après chaque sauvegarde
+    assert scheduler.build_row(state).get("aggregates") is None
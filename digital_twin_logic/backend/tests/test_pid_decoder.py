@@ -0,0 +1,44 @@
+import json
+import sys
+import os
+
+from app.pid_decoder import PID_TO_COLUMN_MAPPING, PidDecoder, is_device_topic
+from app.telemetry_state import COLUMN_INDEX, TELEMETRY_COLUMNS
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from test_new_mqtt_format import test_payload  # noqa: E402
+
+
+def test_device_topic_filter():
+    assert is_device_topic("wincan/device1")
+    assert is_device_topic("wincan/device42")
+    assert not is_device_topic("wincan/OxyCrnt")
+    assert not is_device_topic("wincan/device_test")
+    assert not is_device_topic("wincan/device1/extra")
+
+
+def test_decode_reference_payload():
+    """Le payload de test_new_mqtt_format.py est décodé en une passe"""
+    data = json.loads(test_payload)
+    values = [None] * len(TELEMETRY_COLUMNS)
+    decoder = PidDecoder()
+
+    updated, unmapped = decoder.decode_into(data, values)
+
+    assert unmapped == 0
+    assert len(updated) == len(data)
+    for pid_key, column in PID_TO_COLUMN_MAPPING.items():
+        assert values[COLUMN_INDEX[column]] == data[pid_key]
+
+
+def test_typed_string_conversion_and_unmapped_counters():
+    values = [None] * len(TELEMETRY_COLUMNS)
+    decoder = PidDecoder()
+
+    decoder.decode_into({"0C-EngineRPM": "1047", "1F-TimeSinceEngStart": "724", "Foo": 1}, values)
+    decoder.decode_into({"Foo": 2, "Bar": 3, "01-MonitorStatus": "n/a"}, values)
+
+    assert values[COLUMN_INDEX["rpm"]] == 1047.0
+    assert values[COLUMN_INDEX["time_since_engine_start"]] == 724
+    assert values[COLUMN_INDEX["monitor_status"]] == "n/a"  # texte conservé
+    assert decoder.unmapped_stats() == {"Foo": 2, "Bar": 1}
@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.storage import PostgrestBackend, StorageError
+from app.storage.postgrest import build_filters
+
+
+def make_backend(handler):
+    requests = []
+
+    def record(request):
+        requests.append(request)
+        return handler(request)
+
+    backend = PostgrestBackend(
+        url="https://example.supabase.co/", key="secret", http2=False,
+        transport=httpx.MockTransport(record),
+    )
+    return backend, requests
+
+
+def test_filters_use_postgrest_operators():
+    params = build_filters(eq={"vehicle_id": 3, "unassigned_at": None, "is_active": True},
+                           gte={"recorded_at": "2024-01-01"})
+    assert params == [
+        ("vehicle_id", "eq.3"),
+        ("unassigned_at", "is.null"),
+        ("is_active", "eq.true"),
+        ("recorded_at", "gte.2024-01-01"),
+    ]
+    assert build_filters(in_={"id": [3, 5]}) == [("id", 'in.("3","5")')]
+
+
+def test_select_builds_query_and_sends_credentials():
+    backend, requests = make_backend(lambda request: httpx.Response(200, json=[{"id": 1}]))
+
+    async def scenario():
+        rows = await backend.select(
+            "vehicle_device_assignment", "id, cars(id, name)",
+            eq={"device_id": 7}, order="assigned_at", desc=True, limit=10,
+        )
+        await backend.close()
+        return rows
+
+    assert asyncio.run(scenario()) == [{"id": 1}]
+    request = requests[0]
+    assert request.method == "GET"
+    assert request.url.path == "/rest/v1/vehicle_device_assignment"
+    assert request.url.params.multi_items() == [
+        ("select", "id,cars(id,name)"),
+        ("device_id", "eq.7"),
+        ("order", "assigned_at.desc"),
+        ("limit", "10"),
+    ]
+    assert request.headers["apikey"] == "secret"
+    assert request.headers["authorization"] == "Bearer secret"
+
+
+def test_writes_ask_for_the_representation():
+    backend, requests = make_backend(lambda request: httpx.Response(201, json=[{"id": 5}]))
+
+    async def scenario():
+        inserted = await backend.insert("devices", {"device_code": "OBD-1"})
+        await backend.upsert("telemetry", [{"ingest_key": "k"}], on_conflict="ingest_key", ignore_duplicates=True)
+        await backend.update("devices", {"status": "inactive"}, eq={"id": 5})
+        await backend.delete("devices", eq={"id": 5})
+        await backend.close()
+        return inserted
+
+    assert asyncio.run(scenario()) == [{"id": 5}]
+    insert, upsert, update, delete = requests
+    assert insert.method == "POST" and json.loads(insert.content) == {"device_code": "OBD-1"}
+    assert insert.headers["prefer"] == "return=representation"
+    assert upsert.url.params["on_conflict"] == "ingest_key"
+    assert upsert.headers["prefer"] == "resolution=ignore-duplicates,return=representation"
+    assert update.method == "PATCH" and update.url.params["id"] == "eq.5"
+    assert delete.method == "DELETE" and delete.url.params["id"] == "eq.5"
+
+
+def test_rpc_and_empty_responses():
+    def handler(request):
+        if request.url.path.endswith("/rpc/get_vehicles_last_state"):
+            return httpx.Response(200, json=[{"vehicle_id": 1, "status": "running"}])
+        return httpx.Response(204)
+
+    backend, requests = make_backend(handler)
+
+    async def scenario():
+        state = await backend.rpc("get_vehicles_last_state")
+        deleted = await backend.delete("devices", eq={"id": 1})
+        await backend.close()
+        return state, deleted
+
+    state, deleted = asyncio.run(scenario())
+    assert state == [{"vehicle_id": 1, "status": "running"}]
+    assert deleted == []
+    assert json.loads(requests[0].content) == {}
+
+
+def test_errors_raise_storage_error_with_status():
+    backend, _ = make_backend(
+        lambda request: httpx.Response(409, json={"message": "duplicate key value violates unique constraint"})
+    )
+
+    async def scenario():
+        try:
+            await backend.insert("devices", {"device_code": "OBD-1"})
+        finally:
+            await backend.close()
+
+    with pytest.raises(StorageError) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.status_code == 409
+    assert "duplicate key" in str(excinfo.value)
+
+
+def test_requires_credentials(monkeypatch):
+    monkeypatch.delenv("SUPABASE_URL", raising=False)
+    monkeypatch.delenv("SUPABASE_KEY", raising=False)
+    with pytest.raises(ValueError):
+        PostgrestBackend()
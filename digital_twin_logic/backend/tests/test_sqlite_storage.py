@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from app.storage import SINKS, STORAGE_BACKENDS, SqliteBackend, SqliteTelemetrySink, StorageError
+from app.storage.sqlite import close_sqlite_database, parse_columns
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "twin.db")
+    yield path
+    close_sqlite_database(path)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def seed(backend):
+    vehicle = (await backend.insert("vehicles", {"name": "Clio", "vin": "VF1"}))[0]
+    device = (await backend.insert("devices", {"device_code": "device1", "mqtt_topic": "wincan/device1"}))[0]
+    return vehicle, device
+
+
+def test_parse_columns_with_embedded_resources():
+    assert parse_columns("id, vehicle_id, vehicles(id, name, vin)") == (
+        ["id", "vehicle_id"], [("vehicles", ["id", "name", "vin"])]
+    )
+    assert parse_columns("*") == (["*"], [])
+
+
+def test_registered_as_backend_and_sink():
+    assert STORAGE_BACKENDS["sqlite"] is SqliteBackend
+    assert SINKS["sqlite"] is SqliteTelemetrySink
+
+
+def test_crud_and_filters(db_path):
+    backend = SqliteBackend(db_path)
+
+    async def scenario():
+        vehicle, device = await seed(backend)
+        assert vehicle["id"] == 1 and vehicle["status"] == "active" and vehicle["created_at"]
+        # "cars" est un alias de la table vehicles
+        assert (await backend.select("cars", "name", eq={"id": vehicle["id"]})) == [{"name": "Clio"}]
+
+        updated = await backend.update("devices", {"status": "inactive"}, eq={"id": device["id"]})
+        assert updated[0]["status"] == "inactive"
+        assert await backend.select("devices", "id", eq={"status": "active"}) == []
+        assert await backend.select("devices", "id", eq={"description": None}) == [{"id": device["id"]}]
+
+        deleted = await backend.delete("devices", eq={"id": device["id"]})
+        assert [row["device_code"] for row in deleted] == ["device1"]
+        assert await backend.select("devices") == []
+
+    run(scenario())
+
+
+def test_constraint_and_unknown_column_errors(db_path):
+    backend = SqliteBackend(db_path)
+
+    async def scenario():
+        await seed(backend)
+        with pytest.raises(StorageError) as excinfo:
+            await backend.insert("devices", {"device_code": "device1", "mqtt_topic": "wincan/other"})
+        assert excinfo.value.status_code == 409
+        with pytest.raises(StorageError) as excinfo:
+            await backend.select("devices", eq={"nope": 1})
+        assert excinfo.value.status_code == 400
+
+    run(scenario())
+
+
+def test_assignments_embeds_view_and_trigger(db_path):
+    backend = SqliteBackend(db_path)
+
+    async def scenario():
+        vehicle, device = await seed(backend)
+        other = (await backend.insert("vehicles", {"name": "Zoe"}))[0]
+        first = (await backend.insert("vehicle_device_assignment",
+                                      {"vehicle_id": vehicle["id"], "device_id": device["id"]}))[0]
+        assert first["is_active"] is True
+
+        # Un nouvel assignment actif désactive l'ancien (trigger)
+        await backend.insert("vehicle_device_assignment", {"vehicle_id": other["id"], "device_id": device["id"]})
+        history = await backend.select(
+            "vehicle_device_assignment", "id, is_active, unassigned_at, cars(id, name, vin)",
+            eq={"device_id": device["id"]}, order="id",
+        )
+        assert [(row["is_active"], row["cars"]["name"]) for row in history] == [(False, "Clio"), (True, "Zoe")]
+        assert history[0]["unassigned_at"] is not None
+        assert "vehicle_id" not in history[0]
+
+        active = await backend.select("v_active_device_assignments")
+        assert [(row["vehicle_name"], row["mqtt_topic"]) for row in active] == [("Zoe", "wincan/device1")]
+
+    run(scenario())
+
+
+def test_telemetry_sink_batches_and_upsert_is_idempotent(db_path):
+    backend = SqliteBackend(db_path)
+    sink = SqliteTelemetrySink(db_path)
+
+    async def scenario():
+        vehicle, device = await seed(backend)
+        rows = [
+            {"vehicle_id": vehicle["id"], "device_id": device["id"], "rpm": 900 + i,
+             "recorded_at": f"2024-01-01T00:00:0{i}", "aggregates": {"rpm": {"min": 900}}, "ingest_key": f"k{i}"}
+            for i in range(3)
+        ]
+        sink.insert(rows[:2])
+        sink.upsert(rows)  # k0 et k1 existent déjà
+        stored = await backend.select("telemetry", eq={"vehicle_id": vehicle["id"]}, order="recorded_at")
+        assert [row["rpm"] for row in stored] == [900, 901, 902]
+        assert stored[0]["aggregates"] == {"rpm": {"min": 900}}
+
+        window = await backend.select("telemetry", "rpm", gte={"recorded_at": "2024-01-01T00:00:01"},
+                                      lte={"recorded_at": "2024-01-01T00:00:01"})
+        assert window == [{"rpm": 901}]
+
+        state = await backend.rpc("get_vehicles_last_state")
+        assert state[0]["vehicle_name"] == "Clio"
+        assert state[0]["last_rpm"] == 902
+        assert state[0]["last_update"] == "2024-01-01T00:00:02"
+        with pytest.raises(StorageError):
+            await backend.rpc("unknown_function")
+
+    run(scenario())
+
+
+def test_database_helpers_use_local_storage(db_path, monkeypatch):
+    from app import database
+    from app.storage import sqlite
+
+    backend = SqliteBackend(db_path)
+
+    async def scenario():
+        vehicle, device = await seed(backend)
+        await backend.insert("vehicle_device_assignment", {"vehicle_id": vehicle["id"], "device_id": device["id"]})
+        return device
+
+    device = run(scenario())
+    monkeypatch.setattr(database, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(database, "get_sqlite_database", lambda: sqlite.get_sqlite_database(db_path))
+
+    assert database.get_device_by_topic("wincan/device1")["id"] == device["id"]
+    assignment = database.get_active_vehicle_for_device(device["id"])
+    assert assignment["vehicle_name"] == "Clio" and assignment["is_active"] is True
+    assert database.get_active_device_topics() == ["wincan/device1"]
@@ -0,0 +1,52 @@
+import csv
+from contextlib import contextmanager
+
+import pytest
+
+from app.storage import PostgresCopyTelemetrySink, SupabaseTelemetrySink, create_telemetry_sink
+from app.storage.postgres_copy import columns_for, rows_to_csv
+
+
+def test_columns_are_the_ordered_union_of_the_batch():
+    rows = [{"vehicle_id": 1, "rpm": 900}, {"vehicle_id": 2, "sample_count": 3, "rpm": 1000}]
+    assert columns_for(rows) == ["vehicle_id", "rpm", "sample_count"]
+
+
+def test_csv_encoding_of_nulls_and_jsonb():
+    rows = [
+        {"vehicle_id": 1, "rpm": 912.5, "aggregates": {"rpm": {"min": 800, "max": 1000}}},
+        {"vehicle_id": 2, "rpm": None},
+    ]
+    columns = columns_for(rows)
+    parsed = list(csv.reader(rows_to_csv(rows, columns)))
+    assert parsed[0] == ["1", "912.5", '{"rpm": {"min": 800, "max": 1000}}']
+    # Valeur None et colonne absente: marqueur NULL de COPY
+    assert parsed[1] == ["2", r"\N", r"\N"]
+
+
+def test_copy_sink_sends_one_copy_per_batch():
+    class FakeCursor:
+        def __init__(self):
+            self.copies = []
+
+        def copy_expert(self, statement, buffer):
+            self.copies.append(buffer.read())
+
+    cursor = FakeCursor()
+    sink = PostgresCopyTelemetrySink(dsn="postgresql://localhost/test")
+
+    @contextmanager
+    def fake_cursor():
+        yield cursor
+
+    sink._cursor = fake_cursor
+    sink([{"vehicle_id": 1, "rpm": 900}, {"vehicle_id": 1, "rpm": 950}])
+    assert cursor.copies == ["1,900\n1,950\n"]
+
+
+def test_sink_selection():
+    assert isinstance(create_telemetry_sink("supabase"), SupabaseTelemetrySink)
+    with pytest.raises(ValueError):
+        create_telemetry_sink("mysql")
+    with pytest.raises(ValueError):
+        PostgresCopyTelemetrySink(dsn=None)
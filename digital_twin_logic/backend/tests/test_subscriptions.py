@@ -0,0 +1,85 @@
+import pytest
+
+from app.mqtt_scaling import MqttScaling
+from app.subscriptions import SubscriptionManager
+
+
+class FakeClient:
+    def __init__(self):
+        self.subscribed = set()
+        self.calls = []
+
+    def subscribe(self, topics):
+        self.calls.append(("subscribe", [topic for topic, _ in topics]))
+        self.subscribed.update(topic for topic, _ in topics)
+        return 0, 1
+
+    def unsubscribe(self, topics):
+        self.calls.append(("unsubscribe", list(topics)))
+        self.subscribed.difference_update(topics)
+        return 0, 2
+
+
+def make_manager(topics, **kwargs):
+    kwargs.setdefault("scaling", MqttScaling(mode="single"))
+    manager = SubscriptionManager(lambda: topics["value"], **kwargs)
+    client = FakeClient()
+    manager._client = client  # attach() synchronise dans un thread
+    return manager, client
+
+
+def test_subscribes_only_to_active_device_topics_and_resyncs_diff():
+    topics = {"value": ["wincan/device1", "wincan/device2"]}
+    manager, client = make_manager(topics)
+
+    assert manager.sync() == {"added": ["wincan/device1", "wincan/device2"], "removed": []}
+    assert client.subscribed == {"wincan/device1", "wincan/device2"}
+
+    # Device 2 désactivé, device 3 ajouté: seul le diff est envoyé au broker
+    topics["value"] = ["wincan/device1", "wincan/device3"]
+    assert manager.sync() == {"added": ["wincan/device3"], "removed": ["wincan/device2"]}
+    assert client.calls[-2:] == [("subscribe", ["wincan/device3"]), ("unsubscribe", ["wincan/device2"])]
+
+    # Rien n'a changé: aucun appel
+    manager.sync()
+    assert len(client.calls) == 3
+
+
+def test_database_outage_keeps_current_subscriptions_or_falls_back_to_wildcard():
+    topics = {"value": None}
+    manager, client = make_manager(topics)
+    manager.sync()
+    assert client.subscribed == {"wincan/+"}
+
+    topics["value"] = ["wincan/device1"]
+    manager.sync()
+    assert client.subscribed == {"wincan/device1"}
+
+    topics["value"] = None
+    manager.sync()
+    assert client.subscribed == {"wincan/device1"}
+    assert manager.stats()["load_errors"] == 2
+
+
+def test_wildcard_mode_and_shared_scaling():
+    manager, client = make_manager({"value": ["wincan/device1"]}, mode="wildcard",
+                                   scaling=MqttScaling(mode="shared", share_group="ingest", share_by_topic=True))
+    manager.sync()
+    assert client.subscribed == {"$share/ingest/wincan/+"}
+
+
+def test_partition_mode_subscribes_only_to_owned_devices():
+    topics = {"value": [f"wincan/device{i}" for i in range(1, 31)]}
+    subscribed = set()
+    for index in range(3):
+        manager, client = make_manager(topics, scaling=MqttScaling(mode="partition", partition_index=index,
+                                                                   partition_count=3))
+        manager.sync()
+        assert not subscribed & client.subscribed
+        subscribed |= client.subscribed
+    assert subscribed == set(topics["value"])
+
+
+def test_invalid_mode_is_rejected():
+    with pytest.raises(ValueError):
+        SubscriptionManager(lambda: [], mode="all")
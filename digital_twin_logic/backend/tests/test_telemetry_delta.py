@@ -0,0 +1,109 @@
+import asyncio
+
+from app import codec
+from app.mqtt_handler import broadcast_telemetry, get_snapshot
+from app.telemetry_delta import TelemetryDeltaEncoder
+from app.telemetry_state import VehicleState, state_store
+
+
+def _running_state():
+    state = VehicleState(3, history_size=500)
+    state.state = "running"
+    for i in range(100):
+        state.set("rpm", 800 + i)
+        state.set("vehicle_speed", 50)
+        state.append_history(timestamp=1_700_000_000 + i)
+    return state
+
+
+def test_delta_carries_only_changes_and_new_points():
+    encoder = TelemetryDeltaEncoder()
+    state = _running_state()
+
+    first = encoder.delta(state)
+    assert first["seq"] == 1 and first["state"] == "running"
+    assert first["data"]["vehicle_speed"] == 50 and len(first["history"]) == 100
+
+    state.set("rpm", 2000)
+    state.append_history(timestamp=1_700_000_100)
+    second = encoder.delta(state)
+    assert second["seq"] == 2 and "state" not in second
+    assert second["data"] == {"rpm": 2000}
+    assert [point["rpm"] for point in second["history"]] == [2000]
+
+    # Aucun changement: delta vide mais séquence continue
+    third = encoder.delta(state)
+    assert third["seq"] == 3 and third["data"] == {} and third["history"] == []
+
+    state.state = "offline"
+    assert encoder.delta(state)["state"] == "offline"
+
+
+def test_snapshot_resumes_the_sequence_and_is_much_larger_than_a_delta():
+    encoder = TelemetryDeltaEncoder()
+    state = _running_state()
+    encoder.delta(state)
+
+    snapshot = encoder.snapshot(state)
+    assert snapshot["type"] == "telemetry_snapshot" and snapshot["seq"] == 1
+    assert snapshot["data"] == state.to_dict() and len(snapshot["history"]) == 100
+    assert encoder.seq(3) == 1 and encoder.seq(99) == 0
+
+    state.set("rpm", 3000)
+    state.append_history(timestamp=1_700_000_100)
+    delta = encoder.delta(state)
+    assert delta["seq"] == snapshot["seq"] + 1
+    assert len(codec.dumps(delta)) * 10 < len(codec.dumps(snapshot))
+
+
+def test_snapshots_follow_state_changes_without_broadcasts():
+    state = state_store.get_or_create(9001)
+    state.state = "running"
+    state.set("rpm", 1000)
+    state.append_history(timestamp=1_700_000_000)
+
+    async def scenario():
+        first = (await get_snapshot(9001)).payload
+        state.set("rpm", 4000)
+        state.append_history(timestamp=1_700_000_001)
+        await broadcast_telemetry(9001)  # aucun client abonné: la séquence n'avance pas
+        return first, (await get_snapshot(9001)).payload
+
+    first, second = asyncio.run(scenario())
+    assert second["seq"] == first["seq"] + 1  # la séquence avance même sans client
+    assert first["data"]["rpm"] == 1000 and second["data"]["rpm"] == 4000
+    assert len(second["history"]) == 2
+
+
+def test_subscribe_after_idle_then_value_returns_to_its_old_value():
+    state = state_store.get_or_create(9002)
+    state.state = "running"
+    state.set("rpm", 1000)
+    state.append_history(timestamp=1_700_000_000)
+    encoder = TelemetryDeltaEncoder()
+    encoder.delta(state)  # diffusion à un client, qui se déconnecte ensuite
+
+    state.set("rpm", 4000)
+    encoder.advance(state)  # diffusion sans destinataire
+    snapshot = encoder.snapshot(state)  # nouvel abonné
+    assert snapshot["data"]["rpm"] == 4000
+
+    state.set("rpm", 1000)
+    delta = encoder.delta(state)
+    assert delta["seq"] == snapshot["seq"] + 1 and delta["data"] == {"rpm": 1000}
+
+
+def test_snapshot_describes_the_state_at_its_sequence():
+    encoder = TelemetryDeltaEncoder()
+    state = _running_state()
+    encoder.delta(state)
+    state.set("rpm", 4000)  # pas encore diffusé
+    state.append_history(timestamp=1_700_000_100)
+
+    snapshot = encoder.snapshot(state)
+    assert snapshot["seq"] == 1 and snapshot["data"]["rpm"] == 899
+    assert len(snapshot["history"]) == 100
+
+    state.set("rpm", 899)  # revenu à la valeur du snapshot avant la diffusion
+    delta = encoder.delta(state)
+    assert delta["seq"] == 2 and delta["data"] == {} and len(delta["history"]) == 1
@@ -0,0 +1,119 @@
+import asyncio
+import csv
+import gzip
+import io
+
+import pytest
+
+from app import codec
+from app.storage import SqliteBackend
+from app.storage.sqlite import close_sqlite_database
+from app.telemetry_export import TelemetryExport, iter_export_batches, stream_export
+
+COLUMNS = ["recorded_at", "id", "rpm", "monitor_status"]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = str(tmp_path / "export.db")
+    backend = SqliteBackend(path)
+    asyncio.run(backend.insert("vehicles", [{"id": 1, "name": "Twin"}, {"id": 2, "name": "Autre"}]))
+    rows = [
+        {"vehicle_id": 1, "recorded_at": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}+00:00",
+         "rpm": 800 + i, "monitor_status": None if i % 2 else 7}
+        for i in range(120)
+    ]
+    rows.append({"vehicle_id": 2, "recorded_at": "2024-01-01T00:00:00+00:00", "rpm": 1})
+    asyncio.run(backend.insert("telemetry", rows))
+    yield backend
+    close_sqlite_database(path)
+
+
+def run_export(storage, export, **kwargs):
+    async def scenario():
+        batches = iter_export_batches(storage, 1, export.writer.columns, batch_size=25, **kwargs)
+        return [chunk async for chunk in stream_export(export, batches)]
+    return asyncio.run(scenario())
+
+
+def test_csv_export_is_chronological_and_chunked(storage):
+    chunks = run_export(storage, TelemetryExport(COLUMNS, "csv"))
+    assert len(chunks) == 5  # 120 lignes par lots de 25
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert len(rows) == 120
+    assert [int(row["id"]) for row in rows] == list(range(1, 121))
+    assert rows[0] == {"recorded_at": "2024-01-01T00:00:00+00:00", "id": "1", "rpm": "800", "monitor_status": "7"}
+    assert rows[1]["monitor_status"] == ""
+
+
+def test_gzip_ndjson_export_with_range(storage):
+    export = TelemetryExport(COLUMNS, "ndjson", "gzip")
+    assert export.media_type == "application/gzip"
+    assert export.filename("telemetry_1") == "telemetry_1.ndjson.gz"
+    chunks = run_export(
+        storage, export,
+        gte={"recorded_at": "2024-01-01T00:01:00+00:00"}, lte={"recorded_at": "2024-01-01T00:01:09+00:00"},
+    )
+    lines = gzip.decompress(b"".join(chunks)).splitlines()
+    assert [codec.loads(line)["rpm"] for line in lines] == list(range(860, 870))
+
+
+def test_empty_csv_export_has_header(storage):
+    export = TelemetryExport(COLUMNS, "csv")
+    chunks = run_export(storage, export, gte={"recorded_at": "2030-01-01T00:00:00+00:00"})
+    assert b"".join(chunks) == b"recorded_at,id,rpm,monitor_status\n"
+
+
+def test_invalid_combinations_are_rejected():
+    with pytest.raises(ValueError, match="Format"):
+        TelemetryExport(COLUMNS, "xlsx")
+    with pytest.raises(ValueError, match="Compression"):
+        TelemetryExport(COLUMNS, "csv", "brotli")
+    with pytest.raises(ValueError, match="arrow"):
+        TelemetryExport(COLUMNS, "arrow", "gzip")
+
+
+def test_parquet_export_round_trip(storage):
+    pq = pytest.importorskip("pyarrow.parquet")
+    chunks = run_export(storage, TelemetryExport(COLUMNS, "parquet", "zstd"))
+    table = pq.read_table(io.BytesIO(b"".join(chunks)))
+    assert table.num_rows == 120 and table.column("rpm")[0].as_py() == 800.0
+
+
+def test_zstd_csv_export(storage):
+    zstandard = pytest.importorskip("zstandard")
+    chunks = run_export(storage, TelemetryExport(COLUMNS, "csv", "zstd"))
+    data = zstandard.ZstdDecompressor().decompressobj().decompress(b"".join(chunks))
+    assert data.count(b"\n") == 121
+
+
+def test_postgres_export_includes_archived_days(storage, tmp_path, monkeypatch):
+    from app import telemetry_export, telemetry_query
+    from app.telemetry_archive import TelemetryArchive
+
+    archive = TelemetryArchive(str(tmp_path / "archive"))
+    monkeypatch.setattr(telemetry_query, "telemetry_archive", archive)
+    day = 1_703_980_800  # 2023-12-31, jour archivé (et purgé de la base)
+    archive.write(1, day, [
+        {"id": 1000 + i, "vehicle_id": 1, "recorded_at": f"2023-12-31T0{i}:00:00+00:00", "rpm": i} for i in range(3)
+    ])
+
+    class SqliteCursorSink:
+        """Curseur Postgres simulé: seules les lignes encore en base"""
+
+        def iter_batches(self, columns, vehicle_id, gte=None, lte=None, batch_size=5000):
+            rows = storage.db.select("telemetry", ", ".join(columns), eq={"vehicle_id": vehicle_id},
+                                     gte=gte, lte=lte, order="recorded_at, id")
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+
+    monkeypatch.setattr(telemetry_export, "TELEMETRY_SINK", "postgres")
+    monkeypatch.setattr(telemetry_export, "get_telemetry_sink", SqliteCursorSink)
+
+    rows = list(csv.DictReader(io.StringIO(b"".join(run_export(storage, TelemetryExport(COLUMNS, "csv"))).decode())))
+    assert [int(row["id"]) for row in rows] == [1000, 1001, 1002] + list(range(1, 121))
+
+    archived_only = run_export(
+        storage, TelemetryExport(COLUMNS, "csv"), lte={"recorded_at": "2023-12-31T01:30:00+00:00"},
+    )
+    assert [row["id"] for row in csv.DictReader(io.StringIO(b"".join(archived_only).decode()))] == ["1000", "1001"]
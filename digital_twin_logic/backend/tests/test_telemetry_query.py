@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.storage import PostgrestBackend, SqliteBackend
+from app.storage.sqlite import close_sqlite_database
+from app.telemetry_query import (
+    LATEST_COLUMNS, decode_cursor, encode_cursor, fetch_page, iter_pages, iter_rows, ndjson_lines, parse_fields, wants_ndjson,
+)
+from app import codec
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = str(tmp_path / "query.db")
+    backend = SqliteBackend(path)
+    asyncio.run(backend.insert("vehicles", {"id": 1, "name": "Twin"}))
+    # 3 lignes par seconde: plusieurs lignes partagent le même recorded_at
+    rows = [
+        {"vehicle_id": 1, "recorded_at": f"2024-01-01T00:00:{i // 3:02d}+00:00", "rpm": 1000 + i, "vehicle_speed": i}
+        for i in range(25)
+    ]
+    asyncio.run(backend.insert("telemetry", rows))
+    yield backend
+    close_sqlite_database(path)
+
+
+class CappedStorage:
+    """Comme PostgREST avec max-rows: chaque réponse est tronquée sans erreur"""
+
+    def __init__(self, storage, max_rows):
+        self.storage = storage
+        self.max_rows = max_rows
+
+    async def select(self, *args, limit=None, **kwargs):
+        return await self.storage.select(*args, limit=min(limit or self.max_rows, self.max_rows), **kwargs)
+
+
+def collect(rows):
+    async def scenario():
+        return [row async for row in rows]
+    return asyncio.run(scenario())
+
+
+def test_parse_fields_validates_and_keeps_cursor_columns():
+    assert parse_fields("rpm, vehicle_speed", ["rpm"]) == ["recorded_at", "id", "rpm", "vehicle_speed"]
+    assert parse_fields(None, ["id", "rpm"]) == ["recorded_at", "id", "rpm"]
+    with pytest.raises(ValueError, match="password"):
+        parse_fields("rpm,password", [])
+    # Colonne de la migration optionnelle des agrégats: seulement sur demande (TELEMETRY_SAVE_AGGREGATE=false)
+    assert "sample_count" not in LATEST_COLUMNS
+    assert parse_fields("sample_count", LATEST_COLUMNS) == ["recorded_at", "id", "sample_count"]
+
+
+def test_cursor_round_trip_and_invalid_values():
+    cursor = encode_cursor({"recorded_at": "2024-01-01T00:00:00+00:00", "id": 42, "rpm": 900})
+    assert decode_cursor(cursor) == {"recorded_at": "2024-01-01T00:00:00+00:00", "id": 42}
+    for invalid in ("???", encode_cursor({"recorded_at": 1, "id": 2}), "WzFd"):
+        with pytest.raises(ValueError):
+            decode_cursor(invalid)
+
+
+def test_keyset_pages_cover_ties_without_gaps(storage):
+    columns = parse_fields("rpm", [])
+    seen, after = [], None
+    while True:
+        rows, cursor = asyncio.run(fetch_page(storage, 1, columns, 4, after=after))
+        assert all(set(row) == {"recorded_at", "id", "rpm"} for row in rows)
+        seen.extend(row["id"] for row in rows)
+        if cursor is None:
+            break
+        after = decode_cursor(cursor)
+    assert seen == list(range(25, 0, -1))
+
+
+def test_iter_rows_respects_limit_and_range(storage):
+    rows = collect(iter_rows(storage, 1, ["recorded_at", "id"], page_size=4, limit=10))
+    assert [row["id"] for row in rows] == list(range(25, 15, -1))
+
+    bounded = collect(iter_rows(
+        storage, 1, ["recorded_at", "id"], page_size=2,
+        gte={"recorded_at": "2024-01-01T00:00:02+00:00"}, lte={"recorded_at": "2024-01-01T00:00:03+00:00"},
+    ))
+    assert [row["id"] for row in bounded] == [12, 11, 10, 9, 8, 7]
+
+
+def test_server_capped_pages_are_not_mistaken_for_the_last_page(storage):
+    capped = CappedStorage(storage, max_rows=4)
+    pages = collect(iter_pages(capped, 1, ["recorded_at", "id"], page_size=10))
+    assert [len(page) for page in pages] == [4, 4, 4, 4, 4, 4, 1]
+    assert [row["id"] for page in pages for row in page] == list(range(25, 0, -1))
+
+
+def test_ndjson_lines_emits_one_document_per_row(storage):
+    chunks = collect(ndjson_lines(iter_rows(storage, 1, ["recorded_at", "id", "rpm"], page_size=7), chunk_rows=10))
+    lines = b"".join(chunks).splitlines()
+    assert len(chunks) == 3 and len(lines) == 25
+    assert codec.loads(lines[0]) == {"recorded_at": "2024-01-01T00:00:08+00:00", "id": 25, "rpm": 1024}
+
+
+def test_wants_ndjson_from_format_or_accept_header():
+    assert wants_ndjson("ndjson", None)
+    assert not wants_ndjson("json", "application/x-ndjson")
+    assert wants_ndjson(None, "application/x-ndjson, */*")
+    assert not wants_ndjson(None, "application/json")
+
+
+def test_postgrest_keyset_filter_and_order():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=[])
+
+    backend = PostgrestBackend(url="https://example.supabase.co", key="secret", http2=False,
+                               transport=httpx.MockTransport(handler))
+    after = {"recorded_at": "2024-01-01T00:00:00+00:00", "id": 5}
+    asyncio.run(fetch_page(backend, 1, ["recorded_at", "id", "rpm"], 100, after=after))
+    asyncio.run(backend.close())
+
+    params = requests[0].url.params
+    assert params["select"] == "recorded_at,id,rpm"
+    assert params["order"] == "recorded_at.desc,id.desc"
+    assert params["or"] == (
+        '(recorded_at.lt."2024-01-01T00:00:00+00:00",'
+        'and(recorded_at.eq."2024-01-01T00:00:00+00:00",id.lt."5"))'
+    )
@@ -0,0 +1,183 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from app import telemetry_query
+from app.storage import SqliteBackend
+from app.storage.sqlite import close_sqlite_database
+from app.telemetry_archive import TelemetryArchive
+from app.telemetry_query import decode_cursor, fetch_page, iter_rows
+from app.telemetry_retention import TelemetryRetention
+
+DAY = 86400
+T0 = 1_704_067_200  # 2024-01-01T00:00:00Z
+
+
+def iso(seconds):
+    from datetime import datetime, timezone
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = str(tmp_path / "retention.db")
+    backend = SqliteBackend(path)
+    asyncio.run(backend.insert("vehicles", [{"id": 1, "name": "Twin"}, {"id": 2, "name": "Autre"}]))
+    yield backend
+    close_sqlite_database(path)
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    archive = TelemetryArchive(str(tmp_path / "archive"))
+    monkeypatch.setattr(telemetry_query, "telemetry_archive", archive)
+    return archive
+
+
+def insert(storage, vehicle_id, timestamps, **values):
+    rows = [{"vehicle_id": vehicle_id, "recorded_at": iso(ts), "rpm": 1000 + i, "monitor_status": 3, **values}
+            for i, ts in enumerate(timestamps)]
+    asyncio.run(storage.insert("telemetry", rows))
+
+
+def make_retention(storage, archive, now):
+    return TelemetryRetention(enabled=True, retention_days=2, archive=archive,
+                              storage_factory=lambda: storage, clock=lambda: now)
+
+
+def test_old_days_move_to_archive_files(storage, archive):
+    insert(storage, 1, [T0 + h * 3600 for h in range(0, 72, 6)])  # 3 jours, 4 lignes par jour
+    insert(storage, 2, [T0 + 10])
+    retention = make_retention(storage, archive, now=T0 + 4 * DAY + 100)
+
+    assert asyncio.run(retention.run_once()) == 9  # jours 1 et 2 du véhicule 1, jour 1 du véhicule 2
+    hot = asyncio.run(storage.select("telemetry", "vehicle_id, recorded_at", order="recorded_at"))
+    assert [row["recorded_at"] for row in hot] == [iso(T0 + 2 * DAY + h * 3600) for h in range(0, 24, 6)]
+    assert sorted(os.listdir(os.path.join(archive.path, "vehicle_1"))) == ["2024-01-01.npz", "2024-01-02.npz"]
+    assert retention.stats()["archived_partitions"] == 3
+
+    # Rien de nouveau à archiver
+    assert asyncio.run(retention.run_once()) == 0
+
+
+def test_queries_read_archived_ranges_transparently(storage, archive):
+    insert(storage, 1, [T0 + h * 3600 for h in range(0, 72, 6)], device_id=None)
+    asyncio.run(make_retention(storage, archive, now=T0 + 4 * DAY).run_once())
+
+    columns = ["recorded_at", "id", "rpm", "monitor_status", "device_id"]
+    seen, after = [], None
+    while True:
+        rows, cursor = asyncio.run(fetch_page(storage, 1, columns, 5, after=after))
+        seen.extend(rows)
+        if cursor is None:
+            break
+        after = decode_cursor(cursor)
+    assert [row["id"] for row in seen] == list(range(12, 0, -1))
+    oldest = seen[-1]
+    assert oldest == {"recorded_at": iso(T0), "id": 1, "rpm": 1000, "monitor_status": 3, "device_id": None}
+
+    async def chronological():
+        return [row["id"] async for row in iter_rows(
+            storage, 1, ["recorded_at", "id"], desc=False, page_size=3,
+            gte={"recorded_at": iso(T0 + 12 * 3600)}, lte={"recorded_at": iso(T0 + DAY + 12 * 3600)},
+        )]
+    assert asyncio.run(chronological()) == [3, 4, 5, 6, 7]
+
+
+class CappedStorage:
+    """Réponses tronquées à max_rows lignes, comme PostgREST (max-rows)"""
+
+    def __init__(self, storage, max_rows):
+        self.storage = storage
+        self.max_rows = max_rows
+
+    async def select(self, *args, limit=None, **kwargs):
+        return await self.storage.select(*args, limit=min(limit or self.max_rows, self.max_rows), **kwargs)
+
+
+def test_capped_database_pages_do_not_skip_rows_before_archives(storage, archive):
+    insert(storage, 1, [T0 + h * 3600 for h in range(0, 72, 6)])
+    asyncio.run(make_retention(storage, archive, now=T0 + 4 * DAY).run_once())
+    insert(storage, 1, [T0 + 4 * DAY + h * 3600 for h in range(10)])
+
+    async def scan(desc):
+        return [row["id"] async for row in iter_rows(
+            CappedStorage(storage, max_rows=3), 1, ["recorded_at", "id"], desc=desc, page_size=50,
+        )]
+    assert asyncio.run(scan(True)) == list(range(22, 0, -1))
+    assert asyncio.run(scan(False)) == list(range(1, 23))
+
+
+def test_late_rows_are_merged_into_existing_archive(storage, archive):
+    insert(storage, 1, [T0 + 60, T0 + 120])
+    retention = make_retention(storage, archive, now=T0 + 3 * DAY)
+    asyncio.run(retention.run_once())
+
+    insert(storage, 1, [T0 + 90])  # message tardif du même jour
+    assert asyncio.run(retention.run_once()) == 1
+    rows = archive.select(1, ["recorded_at", "id"], desc=False)
+    assert [row["recorded_at"] for row in rows] == [iso(T0 + 60), iso(T0 + 90), iso(T0 + 120)]
+    assert asyncio.run(storage.select("telemetry")) == []
+
+
+def test_only_archived_ids_are_deleted(storage, archive):
+    asyncio.run(storage.insert("telemetry", [
+        {"id": 10, "vehicle_id": 1, "recorded_at": iso(T0 + 60), "rpm": 1},
+        {"id": 20, "vehicle_id": 1, "recorded_at": iso(T0 + 120), "rpm": 2},
+    ]))
+
+    class LateWriter:
+        """Une ligne d'id inférieur arrive entre la lecture et la suppression"""
+
+        def __getattr__(self, name):
+            return getattr(storage, name)
+
+        async def delete(self, table, **kwargs):
+            await storage.insert("telemetry", {"id": 15, "vehicle_id": 1, "recorded_at": iso(T0 + 90), "rpm": 3})
+            return await storage.delete(table, **kwargs)
+
+    retention = TelemetryRetention(enabled=True, retention_days=2, archive=archive,
+                                   storage_factory=LateWriter, clock=lambda: T0 + 3 * DAY)
+    assert asyncio.run(retention.run_once()) == 2
+    assert [row["id"] for row in asyncio.run(storage.select("telemetry", "id"))] == [15]
+    assert [row["id"] for row in archive.select(1, ["id"], desc=False)] == [10, 20]
+
+
+def test_disabled_retention_keeps_everything(storage, archive):
+    insert(storage, 1, [T0])
+    retention = TelemetryRetention(enabled=False, archive=archive, storage_factory=lambda: storage)
+    assert asyncio.run(retention.run_once()) == 0
+    assert len(asyncio.run(storage.select("telemetry"))) == 1
+
+
+def test_databases_without_the_aggregates_migration_are_archived(storage, archive):
+    from app.storage import StorageError
+
+    class WithoutAggregates:
+        """Table telemetry sans sample_count / aggregates (migration optionnelle non appliquée)"""
+
+        def __getattr__(self, name):
+            return getattr(storage, name)
+
+        async def select(self, table, columns="*", **kwargs):
+            if table == "telemetry" and ("sample_count" in columns or "aggregates" in columns):
+                raise StorageError("column telemetry.sample_count does not exist", 400)
+            return await storage.select(table, columns, **kwargs)
+
+    insert(storage, 1, [T0 + 60])
+    retention = TelemetryRetention(enabled=True, retention_days=2, archive=archive,
+                                   storage_factory=WithoutAggregates, clock=lambda: T0 + 3 * DAY)
+    assert asyncio.run(retention.run_once()) == 1
+    assert retention.stats()["errors"] == 0
+
+    # Fichier d'un format plus ancien, sans ces colonnes, complété par des lignes qui les ont
+    path = os.path.join(archive.path, "vehicle_1", "2024-01-01.npz")
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name not in ("sample_count", "aggregates")}
+    np.savez_compressed(path, **arrays)
+    insert(storage, 1, [T0 + 120], sample_count=4)
+    assert asyncio.run(make_retention(storage, archive, now=T0 + 3 * DAY).run_once()) == 1
+    rows = archive.select(1, ["id", "sample_count", "aggregates"], desc=False)
+    assert rows == [{"id": 1, "sample_count": None, "aggregates": None}, {"id": 2, "sample_count": 4, "aggregates": None}]
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from app.storage import SqliteBackend
+from app.storage.sqlite import close_sqlite_database
+from app.telemetry_rollups import TelemetryRollups, format_bucket, rollup_point, select_resolution
+from app.telemetry_state import COLUMN_INDEX, TELEMETRY_COLUMNS
+
+T0 = 1_700_000_040  # début d'une minute (UTC)
+RPM = COLUMN_INDEX["rpm"]
+SPEED = COLUMN_INDEX["vehicle_speed"]
+MONITOR = COLUMN_INDEX["monitor_status"]
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = str(tmp_path / "rollups.db")
+    yield SqliteBackend(path)
+    close_sqlite_database(path)
+
+
+def make_rollups(storage, now=T0):
+    clock = {"now": now}
+    rollups = TelemetryRollups(enabled=True, storage_factory=lambda: storage, clock=lambda: clock["now"])
+    return rollups, clock
+
+
+def sample(rollups, timestamp, rpm, speed=None, vehicle_id=1):
+    values = [None] * len(TELEMETRY_COLUMNS)
+    values[RPM], values[SPEED], values[MONITOR] = rpm, speed, "ok"
+    indexes = [RPM, MONITOR] + ([SPEED] if speed is not None else [])
+    rollups.observe(vehicle_id, values, indexes, timestamp)
+
+
+def test_select_resolution_uses_finest_bucket_within_budget():
+    assert select_resolution(T0, T0 + 3600, 500) == "1m"
+    assert select_resolution(T0, T0 + 7 * 86400, 500) == "1h"
+    assert select_resolution(T0, T0 + 90 * 86400, 500) == "1d"
+    # Au-delà du budget même en 1d: la résolution la plus grossière
+    assert select_resolution(T0, T0 + 3 * 365 * 86400, 500) == "1d"
+
+
+def test_disabled_rollups_ignore_samples(storage):
+    rollups = TelemetryRollups(enabled=False, storage_factory=lambda: storage)
+    sample(rollups, T0, 900)
+    assert rollups.stats()["open_buckets"] == 0
+
+
+def test_flush_writes_one_row_per_resolution(storage):
+    rollups, _ = make_rollups(storage)
+    sample(rollups, T0 + 1, 800, speed=10)
+    sample(rollups, T0 + 2, 1200)
+    sample(rollups, T0 + 61, 2000, speed=30)  # minute suivante
+
+    assert asyncio.run(rollups.flush()) == 4  # 2 seaux 1m + 1h + 1d
+    rows = asyncio.run(storage.select("telemetry_rollups", eq={"resolution": "1m"}, order="bucket_start"))
+    assert [row["bucket_start"] for row in rows] == [format_bucket(T0), format_bucket(T0 + 60)]
+    assert rows[0]["sample_count"] == 2
+    assert rows[0]["stats"]["rpm"] == {"min": 800, "max": 1200, "sum": 2000.0, "count": 2}
+    # Les statuts / bitmasks ne sont pas agrégés
+    assert "monitor_status" not in rows[0]["stats"]
+
+    hourly = asyncio.run(storage.select("telemetry_rollups", eq={"resolution": "1h"}))[0]
+    assert rollup_point(hourly, ["rpm", "vehicle_speed"]) == {
+        "bucket_start": hourly["bucket_start"],
+        "sample_count": 3,
+        "rpm": {"min": 800, "max": 2000, "avg": 1333.3333, "count": 3},
+        "vehicle_speed": {"min": 10, "max": 30, "avg": 20.0, "count": 2},
+    }
+
+    # Rien de modifié: pas de nouvelle écriture
+    assert asyncio.run(rollups.flush()) == 0
+
+
+def test_restart_merges_with_existing_rows(storage):
+    rollups, _ = make_rollups(storage)
+    sample(rollups, T0 + 1, 1000)
+    asyncio.run(rollups.flush())
+
+    restarted, _ = make_rollups(storage)
+    sample(restarted, T0 + 5, 3000)
+    asyncio.run(restarted.flush())
+
+    row = asyncio.run(storage.select(
+        "telemetry_rollups", eq={"resolution": "1m", "bucket_start": format_bucket(T0)}
+    ))[0]
+    assert row["sample_count"] == 2
+    assert row["stats"]["rpm"] == {"min": 1000, "max": 3000, "sum": 4000.0, "count": 2}
+
+
+def test_closed_buckets_are_evicted_and_late_samples_merge(storage):
+    rollups, clock = make_rollups(storage)
+    sample(rollups, T0 + 1, 1000)
+    clock["now"] = T0 + 61
+    asyncio.run(rollups.flush())
+    # Le seau 1m fermé et écrit est oublié; 1h et 1d restent ouverts
+    assert rollups.stats()["open_buckets"] == 2
+
+    sample(rollups, T0 + 30, 500)  # message tardif
+    asyncio.run(rollups.flush())
+    row = asyncio.run(storage.select(
+        "telemetry_rollups", eq={"resolution": "1m", "bucket_start": format_bucket(T0)}
+    ))[0]
+    assert row["stats"]["rpm"]["count"] == 2 and row["stats"]["rpm"]["min"] == 500
+
+
+def test_failed_write_is_retried(storage):
+    class FailingOnce:
+        def __init__(self):
+            self.failed = False
+
+        async def select(self, *args, **kwargs):
+            return await storage.select(*args, **kwargs)
+
+        async def upsert(self, *args, **kwargs):
+            if not self.failed:
+                self.failed = True
+                raise RuntimeError("réseau indisponible")
+            return await storage.upsert(*args, **kwargs)
+
+    flaky = FailingOnce()
+    rollups = TelemetryRollups(enabled=True, storage_factory=lambda: flaky, clock=lambda: T0)
+    sample(rollups, T0 + 1, 1000)
+    assert asyncio.run(rollups.flush()) == 0
+    assert rollups.stats()["flush_errors"] == 1
+    assert asyncio.run(rollups.flush()) == 3
+
+
+def test_query_picks_resolution_and_filters_range(storage):
+    rollups, clock = make_rollups(storage)
+    for minute in range(5):
+        sample(rollups, T0 + minute * 60, 1000 + minute)
+    sample(rollups, T0, 1, vehicle_id=2)
+    clock["now"] = T0 + 300
+    asyncio.run(rollups.flush())
+
+    result = asyncio.run(rollups.query(1, T0 + 60, T0 + 180, max_points=10, fields=["rpm"]))
+    assert result["resolution"] == "1m" and result["bucket_seconds"] == 60
+    assert [point["rpm"]["avg"] for point in result["points"]] == [1001, 1002, 1003]
+
+    coarse = asyncio.run(rollups.query(1, T0, T0 + 300, max_points=2))
+    assert coarse["resolution"] == "1h"
+    assert coarse["points"][0]["rpm"]["count"] == 5
@@ -0,0 +1,42 @@
+from app.telemetry_state import TelemetryStateStore, TELEMETRY_COLUMNS, HISTORY_FIELDS
+
+
+def test_vehicles_do_not_share_values():
+    """Deux devices qui publient en même temps ne mélangent plus leurs PIDs"""
+    store = TelemetryStateStore()
+    car_a = store.get_or_create(1)
+    car_b = store.get_or_create(2)
+
+    car_a.device_id = 10
+    car_a.set("rpm", 1500)
+    car_b.device_id = 20
+    car_b.set("vehicle_speed", 90)
+
+    assert store.get_or_create(1) is car_a
+    assert car_a.get("vehicle_speed") is None
+    assert car_b.get("rpm") is None
+
+    row = car_b.to_row()
+    assert row["vehicle_id"] == 2
+    assert row["device_id"] == 20
+    assert row["vehicle_speed"] == 90
+    assert set(row) == {"vehicle_id", "device_id", *TELEMETRY_COLUMNS}
+
+
+def test_essential_data_and_history():
+    store = TelemetryStateStore(history_size=3)
+    state = store.get_or_create(5)
+    assert not state.has_essential_data()
+
+    state.set("coolant_temperature", 87)
+    assert state.has_essential_data()
+
+    for i in range(5):
+        state.set("rpm", 1000 + i)
+        state.append_history(timestamp=f"2024-01-01T00:00:0{i}")
+
+    history = state.history_list()
+    assert [p["timestamp"] for p in history] == [f"2024-01-01T00:00:0{i}" for i in (2, 3, 4)]
+    assert history[-1]["rpm"] == 1004
+    assert set(history[-1]) == {"timestamp", "vehicle_id", *HISTORY_FIELDS}
+    assert store.total_history_points() == 3
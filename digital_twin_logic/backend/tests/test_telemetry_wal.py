@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+from app import codec
+from app.storage import StorageError, is_rejected_write
+from app.telemetry_wal import TelemetryWal, WalTelemetryWriter
+
+
+def make_writer(directory, sink, **wal_kwargs):
+    wal_kwargs.setdefault("fsync", "never")
+    return WalTelemetryWriter(TelemetryWal(str(directory), **wal_kwargs), sink, batch_size=10, linger=60)
+
+
+def test_rows_survive_database_outage_and_restart(tmp_path):
+    """Aucune ligne perdue: le point de contrôle n'avance qu'après un envoi réussi"""
+    def failing_sink(rows):
+        raise RuntimeError("supabase indisponible")
+
+    writer = make_writer(tmp_path, failing_sink)
+    for i in range(25):
+        assert writer.submit({"vehicle_id": 1, "rpm": i})
+    assert writer.replay_available() == 0
+    assert writer.stats()["failed_attempts"] == 1
+    writer.wal.close()
+
+    # Redémarrage: la BDD répond de nouveau
+    received = []
+    writer = make_writer(tmp_path, received.extend)
+    assert writer.queue_depth == 25
+    assert writer.replay_available() == 25
+    assert [row["rpm"] for row in received] == list(range(25))
+    assert len({row["ingest_key"] for row in received}) == 25
+    assert writer.queue_depth == 0
+    writer.wal.close()
+
+    # Rien n'est rejoué une seconde fois
+    received.clear()
+    writer = make_writer(tmp_path, received.extend)
+    assert writer.queue_depth == 0
+    assert writer.replay_available() == 0
+
+
+def test_segment_rotation_and_cleanup(tmp_path):
+    received = []
+    writer = make_writer(tmp_path, received.extend, segment_bytes=200)
+    for i in range(20):
+        writer.submit({"vehicle_id": 2, "rpm": i})
+    assert len(writer.wal.segments()) > 3
+
+    writer.replay_available()
+    assert [row["rpm"] for row in received] == list(range(20))
+    # Seul le segment actif reste sur disque
+    assert writer.wal.segments() == [writer.wal.end_position[0]]
+
+
+def test_torn_tail_is_truncated_on_recovery(tmp_path):
+    wal = TelemetryWal(str(tmp_path), fsync="always")
+    assert wal.append(b'{"rpm": 1}')
+    path = wal.segment_path(wal.end_position[0])
+    wal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x40\x00\x00\x00\x01\x02")  # en-tête incomplet (crash pendant l'écriture)
+
+    wal = TelemetryWal(str(tmp_path))
+    assert wal.truncated_bytes == 6
+    assert [payload for _, payload in wal.read_records(1, 0)] == [b'{"rpm": 1}']
+
+
+def test_corrupted_record_in_closed_segment_is_skipped(tmp_path):
+    received = []
+    writer = make_writer(tmp_path, received.extend, segment_bytes=60)
+    for i in range(4):
+        writer.submit({"rpm": i})
+    assert len(writer.wal.segments()) == 4  # un enregistrement par segment
+    first = writer.wal.segments()[0]
+    path = writer.wal.segment_path(first)
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) - 2)
+        f.write(b"!!")
+
+    writer.replay_available()
+    assert writer.stats()["skipped_records"] == 1
+    assert [row["rpm"] for row in received] == [1, 2, 3]
+
+
+def test_full_journal_rejects_new_rows(tmp_path):
+    writer = make_writer(tmp_path, lambda rows: None, max_bytes=100)
+    results = [writer.submit({"rpm": i, "padding": "x" * 20}) for i in range(5)]
+    assert results[0] and not results[-1]
+    assert writer.stats()["dropped"] >= 1
+
+
+def test_unknown_fsync_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        TelemetryWal(str(tmp_path), fsync="sometimes")
+
+
+def test_rejected_rows_are_isolated_into_the_dead_letter_file(tmp_path):
+    """Une ligne refusée (4xx) ne bloque pas le rejeu des autres"""
+    received = []
+
+    def strict_sink(rows):
+        if any(isinstance(row["rpm"], str) for row in rows):
+            raise StorageError('invalid input syntax for type double precision: "n/a"', 400)
+        received.extend(rows)
+
+    writer = make_writer(tmp_path, strict_sink)
+    for i in range(25):
+        writer.submit({"vehicle_id": 1, "rpm": "n/a" if i in (3, 17) else i})
+    assert writer.replay_available() == 23
+    assert sorted(row["rpm"] for row in received) == [i for i in range(25) if i not in (3, 17)]
+    assert writer.queue_depth == 0 and writer.stats()["dead_letters"] == 2
+    with open(writer.dead_letter_path, "rb") as f:
+        dead = [codec.loads(line) for line in f]
+    assert [entry["row"]["rpm"] for entry in dead] == ["n/a", "n/a"]
+    assert "double precision" in dead[0]["error"]
+
+
+def test_outages_are_retried_not_dead_lettered(tmp_path):
+    def unavailable(rows):
+        raise StorageError("503 Service Unavailable", 503)
+
+    writer = make_writer(tmp_path, unavailable)
+    writer.submit({"vehicle_id": 1, "rpm": 1})
+    assert writer.replay_available() == 0
+    assert writer.queue_depth == 1 and writer.stats()["dead_letters"] == 0
+    assert not os.path.exists(writer.dead_letter_path)
+    assert writer.blocking_submit  # ajout au journal hors de la boucle asyncio, quelle que soit la politique fsync
+
+
+def test_rejected_write_classification():
+    class PgError(Exception):
+        def __init__(self, pgcode):
+            self.pgcode = pgcode
+
+    assert is_rejected_write(StorageError("contrainte", 409)) and is_rejected_write(PgError("22P02"))
+    assert is_rejected_write(PgError("23502"))
+    assert not is_rejected_write(StorageError("indisponible", 503))
+    assert not is_rejected_write(StorageError("trop de requêtes", 429))
+    assert not is_rejected_write(PgError("08006")) and not is_rejected_write(TimeoutError())
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from app.telemetry_writer import BatchedTelemetryWriter
+
+
+def test_flush_by_batch_size():
+    """Un lot complet est inséré en une seule requête multi-lignes"""
+    batches = []
+    flushed = threading.Event()
+
+    def sink(rows):
+        batches.append(list(rows))
+        flushed.set()
+
+    writer = BatchedTelemetryWriter(sink, batch_size=3, linger=60, max_queue=100)
+    writer.start()
+    try:
+        for i in range(3):
+            writer.submit({"vehicle_id": 1, "rpm": i})
+        assert flushed.wait(2)
+    finally:
+        writer.stop()
+
+    assert batches == [[{"vehicle_id": 1, "rpm": 0}, {"vehicle_id": 1, "rpm": 1}, {"vehicle_id": 1, "rpm": 2}]]
+    assert writer.stats()["written"] == 3
+
+
+def test_flush_by_linger_deadline():
+    batches = []
+    writer = BatchedTelemetryWriter(batches.append, batch_size=100, linger=0.05, max_queue=100)
+    writer.start()
+    try:
+        writer.submit({"vehicle_id": 1})
+        deadline = time.monotonic() + 2
+        while not batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        writer.stop()
+    assert batches == [[{"vehicle_id": 1}]]
+
+
+@pytest.mark.parametrize("policy,expected", [("drop_oldest", [2, 3]), ("drop_newest", [1, 2])])
+def test_overflow_policies(policy, expected):
+    batches = []
+    writer = BatchedTelemetryWriter(batches.append, batch_size=10, linger=60, max_queue=2, overflow_policy=policy)
+    for i in (1, 2, 3):
+        writer.submit({"rpm": i})
+    assert writer.queue_depth == 2
+    assert writer.stats()["dropped"] == 1
+
+    # stop() sans start(): la file est vidée de manière synchrone
+    writer.stop()
+    assert [row["rpm"] for row in batches[0]] == expected
+
+
+def test_sink_errors_are_counted_not_raised():
+    def failing_sink(rows):
+        raise RuntimeError("supabase indisponible")
+
+    writer = BatchedTelemetryWriter(failing_sink, batch_size=1, linger=60)
+    writer.submit({"rpm": 1})
+    writer.stop()
+    stats = writer.stats()
+    assert stats["failed"] == 1
+    assert "indisponible" in stats["last_error"]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        BatchedTelemetryWriter(lambda rows: None, overflow_policy="ignore")
@@ -0,0 +1,44 @@
+import pytest
+
+from app import codec, ws_frames
+from app.ws_frames import Frame, FrameCache
+
+
+def test_frame_is_built_and_encoded_once():
+    built = []
+
+    def build():
+        built.append(1)
+        return {"type": "telemetry_delta", "seq": 7}
+
+    frame = Frame(build=build)
+    first = frame.encode("json")
+    assert frame.encode("json") is first and first == codec.dumps({"type": "telemetry_delta", "seq": 7})
+    assert built == [1] and frame.encodings == ["json"]
+
+
+def test_frame_cache_reuses_frames_per_key_and_evicts_oldest():
+    cache = FrameCache(size=2)
+    snapshot = cache.frame((1, 5, "snapshot"), lambda: {"seq": 5})
+    assert cache.frame((1, 5, "snapshot"), lambda: {"seq": "other"}) is snapshot
+    cache.frame((1, 6, "snapshot"), lambda: {"seq": 6})
+    cache.frame((2, 1, "snapshot"), lambda: {"seq": 1})
+    assert cache.frame((1, 5, "snapshot"), lambda: {"seq": 5}) is not snapshot
+    assert cache.stats() == {"frames": 2, "hits": 1, "misses": 4}
+
+
+def test_negotiation_falls_back_to_json():
+    assert ws_frames.negotiate([]) == (None, "json")
+    assert ws_frames.negotiate(["other", "twin.json"]) == ("twin.json", "json")
+    expected = ("twin.msgpack", "msgpack") if "msgpack" in ws_frames.ENCODERS else ("twin.json", "json")
+    assert ws_frames.negotiate(["twin.msgpack", "twin.json"]) == expected
+    assert ws_frames.decode('{"type": "resync"}', "msgpack") == {"type": "resync"}
+
+
+def test_msgpack_round_trip():
+    if "msgpack" not in ws_frames.ENCODERS:
+        pytest.skip("msgpack / msgspec non installé")
+    payload = {"type": "telemetry_delta", "seq": 3, "data": {"rpm": 900.5}, "history": []}
+    encoded = Frame(payload).encode("msgpack")
+    assert isinstance(encoded, bytes) and len(encoded) < len(codec.dumps(payload))
+    assert ws_frames.decode(encoded, "msgpack") == payload